@@ -147,10 +147,10 @@ class ExpenditureAdmin(BaseAdmin):
         "raw_org_name",
         "committee",
         "expn_date",
-        "dupe",
+        "is_duplicate",
     )
     list_filter = (
-        "dupe",
+        "is_duplicate",
     )
     search_fields = (
         "name",
@@ -233,3 +233,64 @@ class PropositionFilerAdmin(BaseAdmin):
         "filer",
         "position",
     )
+
+
+@admin.register(models.HighWaterMark)
+class HighWaterMarkAdmin(BaseAdmin):
+    list_display = (
+        "source_table",
+        "filing_id",
+        "amend_id",
+        "updated",
+    )
+
+
+@admin.register(models.BuildRun)
+class BuildRunAdmin(BaseAdmin):
+    list_display = (
+        "started",
+        "finished",
+        "mode",
+        "status",
+    )
+    list_filter = (
+        "mode",
+        "status",
+    )
+
+
+@admin.register(models.BuildStage)
+class BuildStageAdmin(BaseAdmin):
+    list_display = (
+        "build_run",
+        "name",
+        "status",
+        "started",
+        "duration",
+        "db_time",
+        "rows_in",
+        "rows_out",
+    )
+    list_filter = (
+        "name",
+        "status",
+    )
+
+
+@admin.register(models.BuildChange)
+class BuildChangeAdmin(BaseAdmin):
+    list_display = (
+        "build_run",
+        "model_name",
+        "change_type",
+        "filing_id_raw",
+        "amend_id",
+        "transaction_id",
+    )
+    list_filter = (
+        "model_name",
+        "change_type",
+    )
+    search_fields = (
+        "filing_id_raw",
+    )
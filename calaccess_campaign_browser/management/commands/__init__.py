@@ -1,12 +1,24 @@
+import time
 import requests
 from time import sleep
 from bs4 import BeautifulSoup
+from datetime import timedelta
 from requests.exceptions import HTTPError
+from calaccess_campaign_browser.utils.explain import ExplainCursor
+from calaccess_campaign_browser.utils.backends import get_backend
+from calaccess_campaign_browser.models import Filing, Summary
 from django.utils.termcolors import colorize
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class CalAccessCommand(BaseCommand):
+    # Loaders that support --explain switch this on to dry run their SQL
+    explain = False
+    # Loaders that support --cycle set this to the one cycle they reload
+    cycle = None
+    # Loaders that support --changed-only set this to only reload the
+    # filings whose content hash was cleared
+    changed_only = False
 
     def header(self, string):
         self.stdout.write(colorize(string, fg="cyan", opts=("bold",)))
@@ -23,6 +35,183 @@ class CalAccessCommand(BaseCommand):
     def warn(self, string):
         self.stdout.write(colorize(string, fg="yellow"))
 
+    @property
+    def backend(self):
+        """
+        The loader backend for the database the data is loaded into.
+        """
+        if not hasattr(self, '_backend'):
+            self._backend = get_backend()
+        return self._backend
+
+    def get_cursor(self):
+        """
+        Returns a database cursor, or one that explains each statement
+        instead of running it if this is a dry run.
+        """
+        if not self.explain:
+            return self.backend.cursor()
+        if self.backend.vendor != 'mysql':
+            raise CommandError("--explain is only available on MySQL")
+        if not hasattr(self, 'explain_cursor'):
+            self.explain_cursor = ExplainCursor(self.backend.cursor(), self)
+        return self.explain_cursor
+
+    def get_filing_filter_sql(self, alias):
+        """
+        Returns a condition that limits a merge to the filings being
+        reloaded, which are those of one cycle, those whose raw records
+        changed, or all of them.
+        """
+        condition_list = []
+        if self.cycle:
+            condition_list.append("%s.`cycle_id` = %d" % (alias, self.cycle))
+        if self.changed_only:
+            condition_list.append("%s.`content_hash` IS NULL" % alias)
+        return " AND ".join(condition_list) or "true"
+
+    def get_raw_filter_sql(self, alias):
+        """
+        Returns a condition that limits a raw table to the filings being
+        reloaded.
+        """
+        if not (self.cycle or self.changed_only):
+            return "true"
+        return """EXISTS (
+            SELECT 1
+            FROM %s as f
+            WHERE f.`filing_id_raw` = %s.`FILING_ID`
+            AND %s
+        )""" % (
+            Filing._meta.db_table,
+            alias,
+            self.get_filing_filter_sql("f")
+        )
+
+    def truncate_cycle(self, model):
+        """
+        Empties the rows of the cycle being reloaded from a model's table.
+        """
+        self.log(" Emptying the %s cycle" % self.cycle)
+        self.backend.truncate_cycle(
+            self.get_cursor(),
+            model._meta.db_table,
+            self.cycle
+        )
+
+    def delete_cycle(self, model):
+        """
+        Deletes the rows of the filings in the cycle being reloaded from a
+        model's table, for tables without a cycle of their own.
+        """
+        self.log(" Emptying the %s cycle" % self.cycle)
+        self.get_cursor().execute("""
+            DELETE FROM `%(table)s`
+            WHERE EXISTS (
+                SELECT 1
+                FROM %(filing_table)s as f
+                WHERE f.`filing_id_raw` = `%(table)s`.`filing_id_raw`
+                AND f.`cycle_id` = %(cycle)d
+            )
+        """ % dict(
+            table=model._meta.db_table,
+            filing_table=Filing._meta.db_table,
+            cycle=self.cycle
+        ))
+
+    def delete_changed(self, model):
+        """
+        Deletes the rows of the filings whose raw records changed from a
+        model's table.
+        """
+        self.log(" Emptying changed filings")
+        self.get_cursor().execute("""
+            DELETE FROM `%(table)s`
+            WHERE EXISTS (
+                SELECT 1
+                FROM %(filing_table)s as f
+                WHERE f.`filing_id_raw` = `%(table)s`.`filing_id_raw`
+                AND f.`content_hash` IS NULL
+            )
+        """ % dict(
+            table=model._meta.db_table,
+            filing_table=Filing._meta.db_table
+        ))
+
+    def link_summaries(self):
+        """
+        Points each summary at the filing with its filing ID and amendment,
+        where it doesn't already, with a single UPDATE.
+        """
+        self.log(" Linking summaries to filings")
+        self.backend.update_join(
+            self.get_cursor(),
+            Summary._meta.db_table, "s",
+            Filing._meta.db_table, "f",
+            "s.`filing_id_raw` = f.`filing_id_raw` "
+            "AND s.`amend_id` = f.`amend_id` "
+            "AND (s.`filing_id` IS NULL OR s.`filing_id` <> f.`id`)",
+            "filing_id = f.`id`"
+        )
+
+    def execute_in_chunks(self, sql, start, end, chunk_size, budget=None):
+        """
+        Runs a statement once for each range of ids from ``start`` to
+        ``end`` and logs the throughput and time left after every chunk.
+
+        The statement gets the bounds of each range as the ``chunk_start``
+        and ``chunk_end`` query parameters. Each chunk commits on its own,
+        which keeps undo logs and replication lag small. Without a
+        ``chunk_size`` the whole range runs as one chunk.
+
+        With a ``budget`` in seconds, a warning is logged once the estimate
+        runs over it and the load is stopped when the time is actually up.
+        """
+        c = self.get_cursor()
+        if self.explain:
+            # One plan covers every chunk
+            c.execute(sql, dict(
+                chunk_start=start or 0,
+                chunk_end=(end or 0) + 1
+            ))
+            return 0
+        if start is None:
+            return 0
+        chunk_size = chunk_size or end + 1 - start
+        total = 0
+        began = time.time()
+        warned = False
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + chunk_size, end + 1)
+            c.execute(sql, dict(chunk_start=chunk_start, chunk_end=chunk_end))
+            total += max(c.rowcount, 0)
+            elapsed = time.time() - began
+            done = float(chunk_end - start) / (end + 1 - start)
+            self.log("   %s rows through %s (%.0f rows/sec, %s left)" % (
+                total,
+                chunk_end - 1,
+                total / elapsed if elapsed else 0,
+                timedelta(seconds=int(elapsed / done - elapsed)),
+            ))
+            chunk_start = chunk_end
+            if not budget or chunk_start > end:
+                continue
+            if elapsed > budget:
+                raise CommandError(
+                    "Stopped at %s after running over the %s time budget" % (
+                        chunk_end - 1,
+                        timedelta(seconds=budget)
+                    )
+                )
+            if not warned and elapsed / done > budget:
+                self.warn("   Expected to take %s, over the %s budget" % (
+                    timedelta(seconds=int(elapsed / done)),
+                    timedelta(seconds=budget)
+                ))
+                warned = True
+        return total
+
 
 class ScrapeCommand(CalAccessCommand):
     base_url = 'http://cal-access.ss.ca.gov/'
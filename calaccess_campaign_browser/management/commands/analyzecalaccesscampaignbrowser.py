@@ -0,0 +1,86 @@
+from optparse import make_option
+from calaccess_campaign_browser import models
+from calaccess_campaign_browser.management.commands import CalAccessCommand
+
+
+custom_options = (
+    make_option(
+        "--optimize",
+        action="store_true",
+        dest="optimize",
+        default=False,
+        help="Rebuild fragmented tables to reclaim their free space"
+    ),
+    make_option(
+        "--min-free",
+        action="store",
+        type="float",
+        dest="min_free",
+        default=0.1,
+        help="Smallest share of free space that makes a table worth \
+rebuilding with --optimize"
+    ),
+)
+
+
+class Command(CalAccessCommand):
+    help = "Refresh the optimizer statistics of the CAL-ACCESS campaign \
+browser database tables"
+    option_list = CalAccessCommand.option_list + custom_options
+
+    def handle(self, *args, **options):
+        """
+        Analyzes every refined table after a load, so the first queries
+        against them aren't planned with statistics from before it.
+        """
+        self.header("Analyzing CAL-ACCESS campaign browser database tables")
+        self.backend.ignore_warnings()
+        self.cursor = self.get_cursor()
+        optimize = options.get('optimize', False)
+        min_free = options.get('min_free', 0.1)
+        model_list = [
+            models.Filer,
+            models.Filing,
+            models.Summary,
+            models.FilingPeriod,
+            models.Cycle,
+            models.Committee,
+            models.Contribution,
+            models.Expenditure,
+            models.Election,
+            models.Office,
+            models.Candidate,
+            models.Proposition,
+            models.PropositionFiler,
+        ]
+        before_total = after_total = 0
+        for m in model_list:
+            table = m._meta.db_table
+            before = self.backend.get_table_size(self.cursor, table)
+            if optimize and before[2] >= min_free:
+                action = "optimized"
+                self.backend.optimize(self.cursor, table)
+            else:
+                action = "analyzed"
+                self.backend.analyze(self.cursor, table)
+            after = self.backend.get_table_size(self.cursor, table)
+            self.log(" %s %s: %s data, %s indexes, %.0f%% free -> \
+%s data, %s indexes, %.0f%% free" % (
+                m.__name__,
+                action,
+                self.format_size(before[0]),
+                self.format_size(before[1]),
+                before[2] * 100,
+                self.format_size(after[0]),
+                self.format_size(after[1]),
+                after[2] * 100,
+            ))
+            before_total += before[0] + before[1]
+            after_total += after[0] + after[1]
+        self.success("Done! %s before, %s after" % (
+            self.format_size(before_total),
+            self.format_size(after_total),
+        ))
+
+    def format_size(self, size):
+        return "%.1f MB" % (size / 1024.0 / 1024.0)
@@ -1,17 +1,438 @@
+import json
+from optparse import make_option
+from django.utils import timezone
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from calaccess_campaign_browser import models
+from calaccess_campaign_browser.utils.shadow import ShadowTables
+from calaccess_campaign_browser.utils.staging import StagingTables
+from calaccess_campaign_browser.utils.pipeline import (
+    Stage,
+    CheckpointPipeline
+)
 from calaccess_campaign_browser.management.commands import CalAccessCommand
 
 
+custom_options = (
+    make_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Only load filings added since the last build instead of \
+flushing and reloading everything"
+    ),
+    make_option(
+        "--shadow",
+        action="store_true",
+        dest="shadow",
+        default=False,
+        help="Load into shadow tables and swap them in when complete"
+    ),
+    make_option(
+        "--max-shrink",
+        action="store",
+        type="float",
+        dest="max_shrink",
+        default=0.1,
+        help="Largest share of rows a table may lose before a shadow swap \
+is refused"
+    ),
+    make_option(
+        "--rollback",
+        action="store_true",
+        dest="rollback",
+        default=False,
+        help="Swap the previous generation of tables back in"
+    ),
+    make_option(
+        "--workers",
+        action="store",
+        type="int",
+        dest="workers",
+        default=4,
+        help="Number of independent build stages to run at the same time"
+    ),
+    make_option(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        default=False,
+        help="Pick up the last unfinished build, skipping completed stages"
+    ),
+    make_option(
+        "--telemetry",
+        action="store",
+        dest="telemetry",
+        default=None,
+        help="Path to write the timing, row counts and memory use of each \
+build stage as JSON"
+    ),
+    make_option(
+        "--from-files",
+        action="store_true",
+        dest="from_files",
+        default=False,
+        help="Load summaries, contributions and expenditures straight from \
+the raw TSV files instead of the raw tables"
+    ),
+    make_option(
+        "--optimize",
+        action="store_true",
+        dest="optimize",
+        default=False,
+        help="Rebuild fragmented tables when the statistics are refreshed \
+at the end of the build"
+    ),
+)
+
+
 class Command(CalAccessCommand):
     help = 'Transforms and loads refined data from raw CAL-ACCESS source files'
+    option_list = CalAccessCommand.option_list + custom_options
+
+    # Tables that are rebuilt by a shadow load and swapped in together
+    shadow_model_list = [
+        models.Filer,
+        models.Filing,
+        models.Summary,
+        models.FilingPeriod,
+        models.Cycle,
+        models.Committee,
+        models.Contribution,
+        models.Expenditure,
+        models.Election,
+        models.Office,
+        models.Candidate,
+        models.Proposition,
+        models.PropositionFiler,
+        models.HighWaterMark,
+    ]
+
+    # Tables that must be loaded before a shadow swap is allowed
+    required_model_list = [
+        models.Filer,
+        models.Committee,
+        models.Filing,
+        models.Summary,
+        models.Contribution,
+    ]
 
     def handle(self, *args, **options):
-        call_command("flushcalaccesscampaignbrowser")
-        call_command("loadcalaccesscampaignfilers")
-        call_command("loadcalaccesscampaignfilings")
-        call_command("loadcalaccesscampaignsummaries")
-        call_command("loadcalaccesscampaigncontributions")
-        # call_command("loadcalaccesscampaignexpenditures")
-        call_command("scrapecalaccesscampaigncandidates")
-        call_command("scrapecalaccesscampaignpropositions")
+        if options['rollback']:
+            self.header("Rolling back to the previous generation of tables")
+            ShadowTables(self.shadow_model_list).rollback()
+            self.success("Done!")
+            return
+
+        if options['resume']:
+            try:
+                build_run = models.BuildRun.objects.exclude(
+                    status='complete'
+                ).latest()
+            except models.BuildRun.DoesNotExist:
+                raise CommandError("There is no unfinished build to resume")
+            # The stages to resume depend on how the build was started,
+            # so it carries on with the options it was started with
+            for name, value in (
+                ('incremental', build_run.mode == 'incremental'),
+                ('shadow', build_run.mode == 'shadow'),
+                ('from_files', build_run.from_files),
+                ('optimize', build_run.optimize),
+            ):
+                if options[name] and not value:
+                    raise CommandError(
+                        "The build being resumed wasn't started with --%s" % (
+                            name.replace('_', '-')
+                        )
+                    )
+            self.header("Resuming %s" % build_run)
+        else:
+            if options['shadow'] and options['incremental']:
+                raise CommandError(
+                    "Shadow builds load everything and can't be incremental"
+                )
+            if options['from_files'] and options['incremental']:
+                raise CommandError(
+                    "Incremental builds read the raw tables, not the raw files"
+                )
+            if options['shadow']:
+                mode = 'shadow'
+            elif options['incremental']:
+                mode = 'incremental'
+            else:
+                mode = 'full'
+            build_run = models.BuildRun.objects.create(
+                mode=mode,
+                from_files=options['from_files'],
+                optimize=options['optimize']
+            )
+            # A resumed build picks up the staging tables it left behind,
+            # but a new one starts over from the latest raw data
+            StagingTables().drop()
+            # Keep the keys of the tables being replaced to compare with
+            call_command("diffcalaccesscampaignbrowser", snapshot=True)
+
+        try:
+            if build_run.mode == 'shadow':
+                self.shadow_build(
+                    build_run,
+                    options['max_shrink'],
+                    options['workers'],
+                    resume=options['resume'],
+                    from_files=build_run.from_files,
+                    optimize=build_run.optimize
+                )
+            else:
+                self.build(
+                    build_run,
+                    incremental=build_run.mode == 'incremental',
+                    workers=options['workers'],
+                    from_files=build_run.from_files,
+                    optimize=build_run.optimize
+                )
+        except:
+            build_run.status = 'failed'
+            build_run.save()
+            self.write_telemetry(build_run, options['telemetry'])
+            raise
+        StagingTables().drop()
+        build_run.status = 'complete'
+        build_run.finished = timezone.now()
+        build_run.save()
+        self.write_telemetry(build_run, options['telemetry'])
         self.success("Done!")
+
+    def write_telemetry(self, build_run, path):
+        if not path:
+            return
+        with open(path, 'w') as f:
+            json.dump(build_run.get_telemetry(), f, indent=4)
+
+    def get_stage_list(self, incremental=False, flush=True, from_files=False,
+                       optimize=False, build_run=None):
+        """
+        Returns the build stages along with the tables each one reads
+        and writes, which decide what can run at the same time.
+
+        Loading from files replaces the stages that read the biggest raw
+        tables with one that streams the raw files instead.
+        """
+        stage_list = []
+        if incremental:
+            # Filers, committees and cycles are left as they are, so a full
+            # build is still needed to pick up new committees.
+            stage_list.append(Stage(
+                "filings",
+                "loadcalaccesscampaignfilings",
+                outputs=["FilingPeriod", "Filing"],
+                sources=["FILER_FILINGS_CD", "FILING_PERIOD_CD"],
+                truncate_on_restart=False,
+                incremental=True
+            ))
+            stage_list.append(Stage(
+                "summaries",
+                "loadcalaccesscampaignsummaries",
+                inputs=["Filing"],
+                outputs=["Summary"],
+                sources=["SMRY_CD"],
+                truncate_on_restart=False,
+                incremental=True
+            ))
+            stage_list.append(Stage(
+                "contributions",
+                "loadcalaccesscampaigncontributions",
+                inputs=["Filing"],
+                outputs=["Contribution"],
+                sources=["RCPT_CD", "S497_CD"],
+                truncate_on_restart=False,
+                incremental=True
+            ))
+            stage_list.append(Stage(
+                "expenditures",
+                "loadcalaccesscampaignexpenditures",
+                inputs=["Filing"],
+                outputs=["Expenditure"],
+                sources=["EXPN_CD"],
+                truncate_on_restart=False,
+                incremental=True
+            ))
+        else:
+            if flush:
+                stage_list.append(Stage(
+                    "flush",
+                    "flushcalaccesscampaignbrowser",
+                    outputs=["flush"]
+                ))
+            stage_list.append(Stage(
+                "filers",
+                "loadcalaccesscampaignfilers",
+                inputs=["flush"],
+                outputs=["Cycle", "Filer", "Committee"],
+                sources=[
+                    "FILERNAME_CD",
+                    "FILER_TO_FILER_TYPE_CD",
+                    "FILER_LINKS_CD",
+                    "FILER_FILINGS_CD",
+                ]
+            ))
+            stage_list.append(Stage(
+                "filings",
+                "loadcalaccesscampaignfilings",
+                inputs=["Cycle", "Committee"],
+                outputs=["FilingPeriod", "Filing"],
+                sources=["FILER_FILINGS_CD", "FILING_PERIOD_CD"]
+            ))
+            if from_files:
+                stage_list.append(Stage(
+                    "rawfiles",
+                    "loadcalaccesscampaignrawfiles",
+                    inputs=["Filing", "Committee"],
+                    outputs=["Summary", "Contribution", "Expenditure"]
+                ))
+            else:
+                # Summaries are linked to the filings they're loaded for
+                stage_list.append(Stage(
+                    "summaries",
+                    "loadcalaccesscampaignsummaries",
+                    inputs=["Filing"],
+                    outputs=["Summary"],
+                    sources=["SMRY_CD"]
+                ))
+                stage_list.append(Stage(
+                    "contributions",
+                    "loadcalaccesscampaigncontributions",
+                    inputs=["Filing", "Committee"],
+                    outputs=["Contribution"],
+                    sources=["RCPT_CD", "S497_CD"]
+                ))
+                stage_list.append(Stage(
+                    "expenditures",
+                    "loadcalaccesscampaignexpenditures",
+                    inputs=["Filing"],
+                    outputs=["Expenditure"],
+                    sources=["EXPN_CD"]
+                ))
+                # Store a hash of each filing's raw records, so a refresh
+                # only reloads the filings that change after this build
+                stage_list.append(Stage(
+                    "hashes",
+                    "refreshcalaccesscampaignfilings",
+                    inputs=["Filing"],
+                    outputs=["content_hash"],
+                    sources=["RCPT_CD", "S497_CD", "SMRY_CD", "EXPN_CD"],
+                    truncate_on_restart=False,
+                    record_only=True
+                ))
+        # The scrapers get or create their records, so they can be rerun
+        stage_list.append(Stage(
+            "candidates",
+            "scrapecalaccesscampaigncandidates",
+            inputs=["flush", "Filer"],
+            outputs=["Election", "Office", "Candidate"],
+            truncate_on_restart=False
+        ))
+        # Propositions are linked to the elections found by the last scraper
+        stage_list.append(Stage(
+            "propositions",
+            "scrapecalaccesscampaignpropositions",
+            inputs=["flush", "Filer", "Election"],
+            outputs=["Proposition", "PropositionFiler"],
+            truncate_on_restart=False
+        ))
+        # Record what changed since the tables the build replaces
+        stage_list.append(Stage(
+            "diff",
+            "diffcalaccesscampaignbrowser",
+            inputs=["Filing", "Contribution"],
+            outputs=["BuildChange"],
+            truncate_on_restart=False,
+            build_run=build_run.id if build_run else None
+        ))
+        # Refresh the optimizer statistics once everything is loaded
+        stage_list.append(Stage(
+            "analyze",
+            "analyzecalaccesscampaignbrowser",
+            inputs=sorted(set(o for s in stage_list for o in s.outputs)),
+            outputs=["analyze"],
+            truncate_on_restart=False,
+            optimize=optimize
+        ))
+        return stage_list
+
+    def build(self, build_run, incremental=False, flush=True, workers=1,
+              from_files=False, optimize=False):
+        self.header("Running build stages")
+        pipeline = CheckpointPipeline(
+            self.get_stage_list(
+                incremental,
+                flush,
+                from_files,
+                optimize,
+                build_run
+            ),
+            build_run,
+            workers=workers,
+            log=self.log
+        )
+        pipeline.run()
+
+        duration, stage_list = pipeline.get_critical_path()
+        self.header("Critical path")
+        for stage in stage_list:
+            self.log(" %s (%.1fs)" % (stage.name, stage.duration))
+        self.log(" %.1fs of %.1fs total" % (duration, pipeline.duration))
+
+        self.header("Stage telemetry")
+        for stage in build_run.stages.all():
+            if stage.duration is None:
+                continue
+            self.log(
+                " %s: %.1fs, %.1fs in the database, %s rows in, %s rows out, \
+%.0f MB peak" % (
+                    stage.name,
+                    stage.duration,
+                    stage.db_time or 0,
+                    stage.rows_in,
+                    stage.rows_out,
+                    (stage.peak_rss or 0) / 1024.0 / 1024.0,
+                )
+            )
+
+    def shadow_build(self, build_run, max_shrink, workers=1, resume=False,
+                     from_files=False, optimize=False):
+        """
+        Loads a complete new generation of tables while the live ones keep
+        serving the site, then swaps them in all at once.
+        """
+        shadow = ShadowTables(self.shadow_model_list)
+        # A resumed build carries on with the shadow tables it left behind
+        if not resume:
+            self.header("Creating shadow tables")
+            shadow.create()
+        shadow.activate()
+        try:
+            # The shadow tables start out empty, so there's nothing to flush
+            self.build(
+                build_run,
+                flush=False,
+                workers=workers,
+                from_files=from_files,
+                optimize=optimize
+            )
+        finally:
+            shadow.deactivate()
+
+        self.header("Validating shadow tables")
+        for m, live, new in shadow.get_row_counts():
+            self.log(" %s: %s live, %s new" % (m.__name__, live, new))
+        problems = shadow.validate(self.required_model_list, max_shrink)
+        if problems:
+            for p in problems:
+                self.failure(" %s" % p)
+            raise CommandError(
+                "Shadow tables failed validation and were not swapped in"
+            )
+
+        self.header("Swapping in shadow tables")
+        shadow.swap()
@@ -0,0 +1,66 @@
+from optparse import make_option
+from django.core.management.base import CommandError
+from calaccess_campaign_browser.models import BuildRun, BuildChange
+from calaccess_campaign_browser.utils.changes import BuildChanges
+from calaccess_campaign_browser.management.commands import CalAccessCommand
+
+
+custom_options = (
+    make_option(
+        "--snapshot",
+        action="store_true",
+        dest="snapshot",
+        default=False,
+        help="Copy the keys of the current tables to compare the next \
+build against"
+    ),
+    make_option(
+        "--build-run",
+        action="store",
+        type="int",
+        dest="build_run",
+        default=None,
+        help="ID of the build to record the changes under, the latest \
+by default"
+    ),
+)
+
+
+class Command(CalAccessCommand):
+    help = "Compare the filings and contributions of a build with the \
+generation of tables before it"
+    option_list = CalAccessCommand.option_list + custom_options
+
+    def handle(self, *args, **options):
+        self.backend.ignore_warnings()
+        changes = BuildChanges(self.get_cursor(), self.backend)
+        if options.get('snapshot'):
+            self.header("Saving the keys of the current tables")
+            changes.snapshot()
+            self.success("Done!")
+            return
+
+        try:
+            if options.get('build_run'):
+                build_run = BuildRun.objects.get(pk=options['build_run'])
+            else:
+                build_run = BuildRun.objects.latest()
+        except BuildRun.DoesNotExist:
+            raise CommandError("There is no build to record the changes of")
+        if not changes.has_snapshot():
+            raise CommandError("There is no snapshot of the previous tables")
+
+        self.header("Comparing %s with the previous tables" % build_run)
+        changes.record(build_run)
+        for model in changes.model_list:
+            for change_type, label in BuildChange.CHANGE_CHOICES:
+                self.log(" %s %s: %s" % (
+                    label,
+                    model.__name__,
+                    BuildChange.objects.filter(
+                        build_run=build_run,
+                        model_name=model.__name__,
+                        change_type=change_type
+                    ).count()
+                ))
+        self.success("Done!")
@@ -1,6 +1,6 @@
-from django.db import connection
 from calaccess_campaign_browser import models
 from calaccess_campaign_browser.management.commands import CalAccessCommand
+from calaccess_campaign_browser.utils.staging import StagingTables
 
 
 class Command(CalAccessCommand):
@@ -8,10 +8,10 @@ class Command(CalAccessCommand):
 
     def handle(self, *args, **options):
         self.header("Dropping CAL-ACCESS campaign browser database tables")
-        self.cursor = connection.cursor()
+        self.cursor = self.get_cursor()
 
-        # Ignore MySQL "note" warnings so this can be run with DEBUG=True
-        self.cursor.execute("""SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0;""")
+        # Ignore MySQL warnings so this can be run with DEBUG=True
+        self.backend.ignore_warnings()
 
         # Loop through the models and drop all the tables
         model_list = [
@@ -28,11 +28,14 @@ class Command(CalAccessCommand):
             models.Candidate,
             models.Proposition,
             models.PropositionFiler,
+            models.HighWaterMark,
+            models.BuildChange,
+            models.BuildStage,
+            models.BuildRun,
         ]
         sql = """DROP TABLE IF EXISTS `%s`;"""
         for m in model_list:
             self.log(" %s" % m.__name__)
             self.cursor.execute(sql % m._meta.db_table)
-
-        # Revert database to default "note" warning behavior
-        self.cursor.execute("""SET SQL_NOTES=@OLD_SQL_NOTES;""")
+        for t in StagingTables(self.cursor).drop():
+            self.log(" %s" % t)
@@ -7,6 +7,8 @@ from django.conf import settings
 from django.utils.datastructures import SortedDict
 
 from calaccess_campaign_browser.models import (
+    BuildRun,
+    BuildChange,
     Contribution,
     Cycle,
     Expenditure,
@@ -35,6 +37,13 @@ custom_options = (
         default=True,
         help="Skip summary export"
     ),
+    make_option(
+        "--skip-changes",
+        action="store_false",
+        dest="changes",
+        default=True,
+        help="Skip export of what the latest build changed"
+    ),
 )
 
 
@@ -55,6 +64,8 @@ class Command(BaseCommand):
             self.expenditures()
         if options['summary']:
             self.summary()
+        if options['changes']:
+            self.changes()
 
     def contributions(self):
         print 'working on contributions'
@@ -66,10 +77,10 @@ class Command(BaseCommand):
             ('amount', 'amount'),
             ('bakref_tid', 'bakref_tid'),
             ('cmte_id', 'cmte_id'),
-            ('committee__filer__name', 'filer'),
-            ('committee__filer__filer_id', 'filer_id'),
-            ('committee__name', 'committee'),
-            ('committee__filer_id_raw', 'committee_id'),
+            ('filer_name', 'filer'),
+            ('filer_id_raw', 'filer_id'),
+            ('committee_name', 'committee'),
+            ('committee_filer_id_raw', 'committee_id'),
             ('ctrib_adr1', 'ctrib_adr1'),
             ('ctrib_adr2', 'ctrib_adr2'),
             ('ctrib_city', 'ctrib_city'),
@@ -85,12 +96,12 @@ class Command(BaseCommand):
             ('ctrib_zip4', 'ctrib_zip4'),
             ('cum_oth', 'cum_oth'),
             ('cum_ytd', 'cum_ytd'),
-            ('cycle__name', 'cycle'),
+            ('cycle', 'cycle'),
             ('date_thru', 'date_thru'),
             ('entity_cd', 'entity_cd'),
             ('filing__filing_id_raw', 'filing_id'),
-            ('filing__start_date', 'filing_start_date'),
-            ('filing__end_date', 'filing_end_date'),
+            ('filing_start_date', 'filing_start_date'),
+            ('filing_end_date', 'filing_end_date'),
             ('form_type', 'form_type'),
             ('id', 'id'),
             ('intr_adr1', 'intr_adr1'),
@@ -122,7 +133,7 @@ class Command(BaseCommand):
         csv_writer.writerow(header_translation)
         for c in Cycle.objects.all():
             dict_rows = Contribution.objects.filter(cycle=c).exclude(
-                dupe=True).values(*header_translation.keys())
+                is_duplicate=True).values(*header_translation.keys())
             csv_writer.writerows(dict_rows)
         outfile.close()
         print 'Exported contributions'
@@ -137,20 +148,20 @@ class Command(BaseCommand):
             ('amount', 'amount'),
             ('bakref_tid', 'bakref_tid'),
             ('cmte_id', 'cmte_id'),
-            ('committee__filer__name', 'filer'),
-            ('committee__filer__filer_id', 'filer_id'),
-            ('committee__name', 'committee'),
-            ('committee__filer_id_raw', 'committee_id'),
+            ('filer_name', 'filer'),
+            ('filer_id_raw', 'filer_id'),
+            ('committee_name', 'committee'),
+            ('committee_filer_id_raw', 'committee_id'),
             ('cum_ytd', 'cum_ytd'),
-            ('cycle__name', 'cycle'),
+            ('cycle', 'cycle'),
             ('entity_cd', 'entity_cd'),
             ('expn_chkno', 'expn_chkno'),
             ('expn_code', 'expn_code'),
             ('expn_date', 'expn_date'),
             ('expn_dscr', 'expn_dscr'),
             ('filing__filing_id_raw', 'filing_id'),
-            ('filing__start_date', 'filing_start_date'),
-            ('filing__end_date', 'filing_end_date'),
+            ('filing_start_date', 'filing_start_date'),
+            ('filing_end_date', 'filing_end_date'),
             ('form_type', 'form_type'),
             ('g_from_e_f', 'g_from_e_f'),
             ('id', 'id'),
@@ -178,7 +189,7 @@ class Command(BaseCommand):
         csv_writer.writerow(header_translation)
         for c in Cycle.objects.all():
             dict_rows = Expenditure.objects.filter(cycle=c).exclude(
-                dupe=True).values(*header_translation.keys())
+                is_duplicate=True).values(*header_translation.keys())
             csv_writer.writerows(dict_rows)
         outfile.close()
         print 'Exported expenditures '
@@ -226,3 +237,31 @@ class Command(BaseCommand):
             csv_writer.writerows(dict_rows)
         outfile.close()
         print 'Exported summary'
+
+    def changes(self):
+        print 'working on changes'
+        try:
+            build_run = BuildRun.objects.filter(status='complete').latest()
+        except BuildRun.DoesNotExist:
+            print 'No complete build to export the changes of'
+            return
+        csv_name = 'changes.csv'
+        outfile_path = os.path.join(self.data_dir,  csv_name)
+        outfile = open(outfile_path, 'w')
+
+        header_translation = SortedDict([
+            ('build_run__started', 'build_started'),
+            ('model_name', 'model'),
+            ('change_type', 'change'),
+            ('filing_id_raw', 'filing_id'),
+            ('amend_id', 'amend_id'),
+            ('transaction_id', 'tran_id'),
+        ])
+        csv_writer = csvkit.unicsv.UnicodeCSVDictWriter(
+            outfile, fieldnames=header_translation.keys(), delimiter='|')
+        csv_writer.writerow(header_translation)
+        dict_rows = BuildChange.objects.filter(
+            build_run=build_run).values(*header_translation.keys())
+        csv_writer.writerows(dict_rows)
+        outfile.close()
+        print 'Exported changes'
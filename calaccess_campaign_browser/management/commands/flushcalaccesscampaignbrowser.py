@@ -1,4 +1,3 @@
-from django.db import connection
 from calaccess_campaign_browser import models
 from calaccess_campaign_browser.management.commands import CalAccessCommand
 
@@ -8,9 +7,8 @@ class Command(CalAccessCommand):
 
     def handle(self, *args, **options):
         self.header("Flushing CAL-ACCESS campaign browser database tables")
-        c = connection.cursor()
-        c.execute("""SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0;""")
-        c.execute("""SET FOREIGN_KEY_CHECKS = 0;""")
+        # Ignore MySQL warnings so this can be run with DEBUG=True
+        self.backend.ignore_warnings()
         model_list = [
             models.Filer,
             models.Filing,
@@ -25,11 +23,11 @@ class Command(CalAccessCommand):
             models.Candidate,
             models.Proposition,
             models.PropositionFiler,
+            models.HighWaterMark,
         ]
-        sql = """TRUNCATE `%s`;"""
         for m in model_list:
             self.log(" %s" % m.__name__)
-            c.execute(sql % m._meta.db_table)
-        # Revert database to default "note" warning behavior
-        c.execute("""SET SQL_NOTES=@OLD_SQL_NOTES;""")
-        c.execute("""SET FOREIGN_KEY_CHECKS = 1;""")
+        self.backend.truncate(
+            self.get_cursor(),
+            [m._meta.db_table for m in model_list]
+        )
@@ -1,36 +1,306 @@
 import os
-import csv
-import copy
-import MySQLdb
-import warnings
 import tempfile
-from django.db import connection
+from optparse import make_option
+from django.db.models import Max
+from django.core.management.base import CommandError
+from multiprocessing import cpu_count
 from calaccess_raw.models import RcptCd, S497Cd
 from calaccess_raw import get_download_directory
 from calaccess_campaign_browser.management.commands import CalAccessCommand
-from calaccess_campaign_browser.models import Contribution, Filing, Committee
+from calaccess_campaign_browser.models import (
+    Contribution,
+    Filing,
+    Committee,
+    Filer,
+    HighWaterMark
+)
+from calaccess_campaign_browser.utils.indexes import DeferredIndexes
+from calaccess_campaign_browser.utils.staging import StagingTables
+from calaccess_campaign_browser.utils.duplicates import mark_duplicates_csv
+
+
+custom_options = (
+    make_option(
+        "--dedupe-in-database",
+        action="store_true",
+        dest="in_database",
+        default=False,
+        help="Mark duplicates with a grouped query instead of a CSV rewrite"
+    ),
+    make_option(
+        "--processes",
+        action="store",
+        type="int",
+        dest="processes",
+        default=cpu_count(),
+        help="Number of processes used to mark duplicates in CSV dumps"
+    ),
+    make_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Only load contributions added since the last load"
+    ),
+    make_option(
+        "--cycle",
+        action="store",
+        type="int",
+        dest="cycle",
+        default=None,
+        help="Empty and reload the contributions of a single election cycle"
+    ),
+    make_option(
+        "--changed-only",
+        action="store_true",
+        dest="changed_only",
+        default=False,
+        help="Only reload the filings whose raw records changed"
+    ),
+    make_option(
+        "--keep-indexes",
+        action="store_true",
+        dest="keep_indexes",
+        default=False,
+        help="Maintain secondary indexes during the load instead of \
+rebuilding them afterwards"
+    ),
+    make_option(
+        "--chunk-size",
+        action="store",
+        type="int",
+        dest="chunk_size",
+        default=10000,
+        help="Number of FILING_IDs merged in each INSERT statement"
+    ),
+    make_option(
+        "--explain",
+        action="store_true",
+        dest="explain",
+        default=False,
+        help="Explain each statement against the current tables instead of \
+running it"
+    ),
+)
 
 
 class Command(CalAccessCommand):
     help = "Load refined campaign contributions from CAL-ACCESS raw data"
+    option_list = CalAccessCommand.option_list + custom_options
+    late_headers = [
+        "FILING_ID",
+        "AMEND_ID",
+        "LINE_ITEM",
+        "REC_TYPE",
+        "FORM_TYPE",
+        "TRAN_ID",
+        "ENTITY_CD",
+        "ENTY_NAML",
+        "ENTY_NAMF",
+        "ENTY_NAMT",
+        "ENTY_NAMS",
+        "ENTY_CITY",
+        "ENTY_ST",
+        "ENTY_ZIP4",
+        "CTRIB_EMP",
+        "CTRIB_OCC",
+        "CTRIB_SELF",
+        "ELEC_DATE",
+        "CTRIB_DATE",
+        "DATE_THRU",
+        "AMOUNT",
+        "CMTE_ID",
+        "CAND_NAML",
+        "CAND_NAMF",
+        "CAND_NAMT",
+        "CAND_NAMS",
+        "OFFICE_CD",
+        "OFFIC_DSCR",
+        "JURIS_CD",
+        "JURIS_DSCR",
+        "DIST_NO",
+        "OFF_S_H_CD",
+        "BAL_NAME",
+        "BAL_NUM",
+        "BAL_JURIS",
+        "MEMO_CODE",
+        "MEMO_REFNO",
+        "BAL_ID",
+        "CAND_ID",
+        "SUP_OFF_CD",
+        "SUP_OPP_CD"
+    ]
+    quarterly_headers = [
+        "FILING_ID",
+        "AMEND_ID",
+        "LINE_ITEM",
+        "REC_TYPE",
+        "FORM_TYPE",
+        "TRAN_ID",
+        "ENTITY_CD",
+        "CTRIB_NAML",
+        "CTRIB_NAMF",
+        "CTRIB_NAMT",
+        "CTRIB_NAMS",
+        "CTRIB_CITY",
+        "CTRIB_ST",
+        "CTRIB_ZIP4",
+        "CTRIB_EMP",
+        "CTRIB_OCC",
+        "CTRIB_SELF",
+        "TRAN_TYPE",
+        "RCPT_DATE",
+        "DATE_THRU",
+        "AMOUNT",
+        "CUM_YTD",
+        "CUM_OTH",
+        "CTRIB_DSCR",
+        "CMTE_ID",
+        "TRES_NAML",
+        "TRES_NAMF",
+        "TRES_NAMT",
+        "TRES_NAMS",
+        "TRES_CITY",
+        "TRES_ST",
+        "TRES_ZIP4",
+        "INTR_NAML",
+        "INTR_NAMF",
+        "INTR_NAMT",
+        "INTR_NAMS",
+        "INTR_CITY",
+        "INTR_ST",
+        "INTR_ZIP4",
+        "INTR_EMP",
+        "INTR_OCC",
+        "INTR_SELF",
+        "CAND_NAML",
+        "CAND_NAMF",
+        "CAND_NAMT",
+        "CAND_NAMS",
+        "OFFICE_CD",
+        "OFFIC_DSCR",
+        "JURIS_CD",
+        "JURIS_DSCR",
+        "DIST_NO",
+        "OFF_S_H_CD",
+        "BAL_NAME",
+        "BAL_NUM",
+        "BAL_JURIS",
+        "SUP_OPP_CD",
+        "MEMO_CODE",
+        "MEMO_REFNO",
+        "BAKREF_TID",
+        "XREF_SCHNM",
+        "XREF_MATCH",
+        "INT_RATE",
+        "INTR_CMTEID",
+        "CTRIB_ADR1",
+        "CTRIB_ADR2",
+        "INTR_ADR1",
+        "INTR_ADR2"
+    ]
 
     def handle(self, *args, **options):
         self.header("Loading contributions")
         self.set_options(*args, **options)
 
         # Ignore MySQL warnings so this can be run with DEBUG=True
-        warnings.filterwarnings("ignore", category=MySQLdb.Warning)
+        self.backend.ignore_warnings()
+
+        if self.cycle:
+            self.truncate_cycle(Contribution)
+        if self.changed_only:
+            self.delete_changed(Contribution)
+        last_id = Contribution.objects.aggregate(max=Max('id'))['max'] or 0
+
+        # Partial loads are small, and an incremental one reads the indexes
+        # to find what's new, so only a full load defers them.
+        if (self.incremental or self.cycle or self.changed_only or
+                self.keep_indexes or self.explain):
+            self.load()
+        else:
+            indexes = DeferredIndexes(Contribution)
+            self.log(" Dropping secondary indexes")
+            indexes.drop()
+            try:
+                self.load()
+            finally:
+                self.log(" Rebuilding secondary indexes")
+                indexes.rebuild()
 
+        if self.incremental:
+            self.mark_new_duplicates(last_id)
+        if self.explain:
+            self.cursor.summarize()
+            return
+        # The marks cover every filing, so a partial load leaves them alone
+        if self.cycle or self.changed_only:
+            return
+        HighWaterMark.objects.update_mark(RcptCd._meta.db_table)
+        HighWaterMark.objects.update_mark(S497Cd._meta.db_table)
+
+    def load(self):
         self.log(" Quarterly filings")
-        self.transform_quarterly_contributions_csv()
-        self.load_quarterly_contributions()
+        if self.incremental:
+            self.load_quarterly_contributions(
+                raw_model=RcptCd._meta.db_table,
+                delta=True,
+            )
+        elif self.in_database:
+            self.mark_duplicates_in_database(
+                RcptCd._meta.db_table,
+                self.quarterly_latest_table
+            )
+            self.load_quarterly_contributions(
+                raw_model=RcptCd._meta.db_table,
+                latest_table=self.quarterly_latest_table,
+            )
+        else:
+            if self.is_staged(self.quarterly_tmp_table):
+                self.log("  Reusing staged receipts")
+            else:
+                self.transform_quarterly_contributions_csv()
+                self.load_quarterly_contributions_csv()
+            self.load_quarterly_contributions()
         self.log(" Late filings")
-        self.transform_late_contributions_csv()
-        self.load_late_contributions()
+        if self.incremental:
+            self.load_late_contributions(
+                raw_model=S497Cd._meta.db_table,
+                delta=True,
+            )
+        elif self.in_database:
+            self.mark_duplicates_in_database(
+                S497Cd._meta.db_table,
+                self.late_latest_table
+            )
+            self.load_late_contributions(
+                raw_model=S497Cd._meta.db_table,
+                latest_table=self.late_latest_table,
+            )
+        else:
+            if self.is_staged(self.late_tmp_table):
+                self.log("  Reusing staged receipts")
+            else:
+                self.transform_late_contributions_csv()
+                self.load_late_contributions_csv()
+            self.load_late_contributions()
 
     def set_options(self, *args, **kwargs):
         self.data_dir = os.path.join(get_download_directory(), 'csv')
-        self.cursor = connection.cursor()
+        self.explain = kwargs.get('explain', False)
+        self.cursor = self.get_cursor()
+        self.in_database = kwargs.get('in_database', False)
+        self.incremental = kwargs.get('incremental', False)
+        self.cycle = kwargs.get('cycle')
+        self.changed_only = kwargs.get('changed_only', False)
+        if (self.cycle or self.changed_only) and self.incremental:
+            raise CommandError(
+                "Reloaded filings are loaded in full and can't be loaded \
+incrementally"
+            )
+        self.keep_indexes = kwargs.get('keep_indexes', False)
+        self.chunk_size = kwargs.get('chunk_size') or 10000
+        self.processes = kwargs.get('processes') or cpu_count()
         # Quarterlies stuff
         self.quarterly_tmp_csv = tempfile.NamedTemporaryFile().name
         self.quarterly_target_csv = os.path.join(
@@ -43,254 +313,292 @@ class Command(CalAccessCommand):
             self.data_dir,
             's497_cd_transformed.csv'
         )
-        self.late_tmp_table = "TMP_%s" % S497Cd._meta.db_table
+        # The transformed receipts are staged for the rest of the build,
+        # unless they only cover some filings or don't really exist
+        self.staging = StagingTables(self.cursor)
+        if self.cycle or self.changed_only or self.explain:
+            self.quarterly_tmp_table = "TMP_%s" % RcptCd._meta.db_table
+            self.late_tmp_table = "TMP_%s" % S497Cd._meta.db_table
+        else:
+            self.quarterly_tmp_table = self.staging.get_table("rcpt_cd")
+            self.late_tmp_table = self.staging.get_table("s497_cd")
+        # In-database duplicate marking stuff
+        self.quarterly_latest_table = "tmp_latest_rcpt_cd"
+        self.late_latest_table = "tmp_latest_s497_cd"
 
-    def transform_late_contributions_csv(self):
-        self.log("  Marking duplicates")
-        self.log("   Dumping CSV sorted by unique identifier")
+    def mark_duplicates_in_database(self, raw_model, latest_table):
+        """
+        Collects the id of the one raw record that survives in each
+        FILING_ID and TRAN_ID group, which is the latest amendment.
+
+        Everything else in the group is a duplicate. This is the same rule
+        the CSV transformation applies to its sorted dump, computed with a
+        grouped query so no rows leave the database. TRAN_IDs are compared
+        byte for byte, like the CSV transformation does, so ones that only
+        differ in case aren't grouped together.
+        """
+        self.log("  Marking duplicates in the database")
+        self.cursor.execute("DROP TABLE IF EXISTS %s" % latest_table)
         sql = """
-        SELECT
-            `S497_CD`.`FILING_ID`,
-            `S497_CD`.`AMEND_ID`,
-            `S497_CD`.`LINE_ITEM`,
-            `S497_CD`.`REC_TYPE`,
-            `S497_CD`.`FORM_TYPE`,
-            `S497_CD`.`TRAN_ID`,
-            `S497_CD`.`ENTITY_CD`,
-            `S497_CD`.`ENTY_NAML`,
-            `S497_CD`.`ENTY_NAMF`,
-            `S497_CD`.`ENTY_NAMT`,
-            `S497_CD`.`ENTY_NAMS`,
-            `S497_CD`.`ENTY_CITY`,
-            `S497_CD`.`ENTY_ST`,
-            `S497_CD`.`ENTY_ZIP4`,
-            `S497_CD`.`CTRIB_EMP`,
-            `S497_CD`.`CTRIB_OCC`,
-            `S497_CD`.`CTRIB_SELF`,
-            `S497_CD`.`ELEC_DATE`,
-            `S497_CD`.`CTRIB_DATE`,
-            `S497_CD`.`DATE_THRU`,
-            `S497_CD`.`AMOUNT`,
-            `S497_CD`.`CMTE_ID`,
-            `S497_CD`.`CAND_NAML`,
-            `S497_CD`.`CAND_NAMF`,
-            `S497_CD`.`CAND_NAMT`,
-            `S497_CD`.`CAND_NAMS`,
-            `S497_CD`.`OFFICE_CD`,
-            `S497_CD`.`OFFIC_DSCR`,
-            `S497_CD`.`JURIS_CD`,
-            `S497_CD`.`JURIS_DSCR`,
-            `S497_CD`.`DIST_NO`,
-            `S497_CD`.`OFF_S_H_CD`,
-            `S497_CD`.`BAL_NAME`,
-            `S497_CD`.`BAL_NUM`,
-            `S497_CD`.`BAL_JURIS`,
-            `S497_CD`.`MEMO_CODE`,
-            `S497_CD`.`MEMO_REFNO`,
-            `S497_CD`.`BAL_ID`,
-            `S497_CD`.`CAND_ID`,
-            `S497_CD`.`SUP_OFF_CD`,
-            `S497_CD`.`SUP_OPP_CD`
-        FROM %(raw_model)s
-        ORDER BY FILING_ID, TRAN_ID, AMEND_ID DESC
-        INTO OUTFILE '%(tmp_csv)s'
-        FIELDS TERMINATED BY ','
-        ENCLOSED BY '"'
-        LINES TERMINATED BY '\n'
+            SELECT MIN(r.`id`) as `id`
+            FROM `%(raw_model)s` as r
+            INNER JOIN (
+                SELECT
+                    `FILING_ID`,
+                    %(tran_id)s as `TRAN_ID`,
+                    MAX(`AMEND_ID`) as `AMEND_ID`
+                FROM `%(raw_model)s`
+                GROUP BY 1, 2
+            ) as max
+            ON r.`FILING_ID` = max.`FILING_ID`
+            AND %(raw_tran_id)s = max.`TRAN_ID`
+            AND r.`AMEND_ID` = max.`AMEND_ID`
+            GROUP BY r.`FILING_ID`, %(raw_tran_id)s
         """ % dict(
-            raw_model=S497Cd._meta.db_table,
-            tmp_csv=self.late_tmp_csv,
+            raw_model=raw_model,
+            tran_id=self.backend.get_binary_sql("`TRAN_ID`"),
+            raw_tran_id=self.backend.get_binary_sql("r.`TRAN_ID`"),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            latest_table,
+            sql,
+            primary_key="id"
         )
-        self.cursor.execute(sql)
-
-        INHEADERS = [
-            "FILING_ID",
-            "AMEND_ID",
-            "LINE_ITEM",
-            "REC_TYPE",
-            "FORM_TYPE",
-            "TRAN_ID",
-            "ENTITY_CD",
-            "ENTY_NAML",
-            "ENTY_NAMF",
-            "ENTY_NAMT",
-            "ENTY_NAMS",
-            "ENTY_CITY",
-            "ENTY_ST",
-            "ENTY_ZIP4",
-            "CTRIB_EMP",
-            "CTRIB_OCC",
-            "CTRIB_SELF",
-            "ELEC_DATE",
-            "CTRIB_DATE",
-            "DATE_THRU",
-            "AMOUNT",
-            "CMTE_ID",
-            "CAND_NAML",
-            "CAND_NAMF",
-            "CAND_NAMT",
-            "CAND_NAMS",
-            "OFFICE_CD",
-            "OFFIC_DSCR",
-            "JURIS_CD",
-            "JURIS_DSCR",
-            "DIST_NO",
-            "OFF_S_H_CD",
-            "BAL_NAME",
-            "BAL_NUM",
-            "BAL_JURIS",
-            "MEMO_CODE",
-            "MEMO_REFNO",
-            "BAL_ID",
-            "CAND_ID",
-            "SUP_OFF_CD",
-            "SUP_OPP_CD"
-        ]
-        OUTHEADERS = copy.copy(INHEADERS)
-        OUTHEADERS.append("IS_DUPLICATE")
 
-        self.log("   Marking duplicates in a new CSV")
-        with open(self.late_tmp_csv, 'r') as fin:
-            fout = csv.DictWriter(
-                open(self.late_target_csv, 'wb'),
-                fieldnames=OUTHEADERS
+    def get_merge_sql(self, raw_model, latest_table=None, delta=False):
+        """
+        Returns the SQL fragments that flag duplicates during a merge,
+        either from the IS_DUPLICATE column of a transformed CSV or from
+        a table of surviving raw ids.
+
+        Incremental merges only take raw records that have not been loaded
+        yet. Their duplicates are marked afterwards by `mark_new_duplicates`.
+        """
+        if delta:
+            return dict(
+                is_duplicate="false",
+                latest_join="",
+                delta=HighWaterMark.objects.get_delta_sql(
+                    raw_model,
+                    Contribution._meta.db_table
+                )
             )
-            fout.writeheader()
-            last_uid = ''
-            for r in csv.DictReader(fin, fieldnames=INHEADERS):
-                r.pop(None, None)
-                uid = '%s-%s' % (r['FILING_ID'], r['TRAN_ID'])
-                if uid != last_uid:
-                    r['IS_DUPLICATE'] = 0
-                    last_uid = uid
-                else:
-                    r['IS_DUPLICATE'] = 1
-                try:
-                    fout.writerow(r)
-                except ValueError:
-                    continue
-
-    def load_late_contributions(self):
-        self.log("  Loading CSV")
+        if not latest_table:
+            return dict(
+                is_duplicate="r.`IS_DUPLICATE`",
+                latest_join="",
+                delta="true"
+            )
+        return dict(
+            is_duplicate="latest.`id` IS NULL",
+            latest_join="""LEFT OUTER JOIN %s as latest
+            ON r.`id` = latest.`id`""" % latest_table,
+            delta="true"
+        )
 
-        self.cursor.execute("DROP TABLE IF EXISTS %s" % self.late_tmp_table)
+    def get_filing_id_range(self):
+        """
+        Returns the lowest and highest FILING_ID the merges can join to.
+        """
+        self.cursor.execute("""
+            SELECT MIN(`filing_id_raw`), MAX(`filing_id_raw`)
+            FROM %s as f
+            WHERE %s
+        """ % (Filing._meta.db_table, self.get_filing_filter_sql("f")))
+        return self.cursor.fetchone()
 
+    def mark_new_duplicates(self, last_id):
+        """
+        Recomputes duplicates after an incremental load, only within the
+        filings that gained contributions.
+        """
+        self.log(" Marking duplicates in new filings")
+        self.cursor.execute("DROP TABLE IF EXISTS tmp_touched_contributions")
         sql = """
-        CREATE TABLE `%(tmp_table)s` (
-          `FILING_ID` int(11) NOT NULL,
-          `AMEND_ID` int(11) NOT NULL,
-          `LINE_ITEM` int(11) NOT NULL,
-          `REC_TYPE` varchar(4) NOT NULL,
-          `FORM_TYPE` varchar(6) NOT NULL,
-          `TRAN_ID` varchar(20) NOT NULL,
-          `ENTITY_CD` varchar(3) NOT NULL,
-          `ENTY_NAML` varchar(200) NOT NULL,
-          `ENTY_NAMF` varchar(45) NOT NULL,
-          `ENTY_NAMT` varchar(10) NOT NULL,
-          `ENTY_NAMS` varchar(10) NOT NULL,
-          `ENTY_CITY` varchar(30) NOT NULL,
-          `ENTY_ST` varchar(2) NOT NULL,
-          `ENTY_ZIP4` varchar(10) NOT NULL,
-          `CTRIB_EMP` varchar(200) NOT NULL,
-          `CTRIB_OCC` varchar(60) NOT NULL,
-          `CTRIB_SELF` varchar(1) NOT NULL,
-          `ELEC_DATE` date NOT NULL,
-          `CTRIB_DATE` date NOT NULL,
-          `DATE_THRU` date NOT NULL,
-          `AMOUNT` decimal(16,2) NOT NULL,
-          `CMTE_ID` varchar(9) NOT NULL,
-          `CAND_NAML` varchar(200) NOT NULL,
-          `CAND_NAMF` varchar(45) NOT NULL,
-          `CAND_NAMT` varchar(10) NOT NULL,
-          `CAND_NAMS` varchar(10) NOT NULL,
-          `OFFICE_CD` varchar(3) NOT NULL,
-          `OFFIC_DSCR` varchar(40) NOT NULL,
-          `JURIS_CD` varchar(3) NOT NULL,
-          `JURIS_DSCR` varchar(40) NOT NULL,
-          `DIST_NO` varchar(3) NOT NULL,
-          `OFF_S_H_CD` varchar(1) NOT NULL,
-          `BAL_NAME` varchar(200) NOT NULL,
-          `BAL_NUM` varchar(7) NOT NULL,
-          `BAL_JURIS` varchar(40) NOT NULL,
-          `MEMO_CODE` varchar(1) NOT NULL,
-          `MEMO_REFNO` varchar(20) NOT NULL,
-          `BAL_ID` varchar(9) NOT NULL,
-          `CAND_ID` varchar(9) NOT NULL,
-          `SUP_OFF_CD` varchar(1) NOT NULL,
-          `SUP_OPP_CD` varchar(1) NOT NULL,
-          `IS_DUPLICATE` bool
+            SELECT DISTINCT `filing_id_raw`
+            FROM %(contribs_model)s
+            WHERE `id` > %(last_id)s
+        """ % dict(
+            contribs_model=Contribution._meta.db_table,
+            last_id=int(last_id),
         )
+        self.backend.create_table_as(
+            self.cursor,
+            "tmp_touched_contributions",
+            sql,
+            primary_key="filing_id_raw"
+        )
+
+        # Find the one record from the latest amendment in each group
+        self.cursor.execute("DROP TABLE IF EXISTS tmp_latest_contributions")
+        sql = """
+            SELECT MIN(c.`id`) as `id`, f.`is_real` as `filing_is_real`
+            FROM %(contribs_model)s as c
+            INNER JOIN %(filing_model)s as f
+            ON c.`filing_id` = f.`id`
+            INNER JOIN (
+                SELECT
+                    c.`filing_id_raw`,
+                    %(tran_id)s as `transaction_id`,
+                    MAX(c.`amend_id`) as `amend_id`
+                FROM %(contribs_model)s as c
+                INNER JOIN tmp_touched_contributions as t
+                ON c.`filing_id_raw` = t.`filing_id_raw`
+                GROUP BY 1, 2
+            ) as max
+            ON c.`filing_id_raw` = max.`filing_id_raw`
+            AND %(tran_id)s = max.`transaction_id`
+            AND c.`amend_id` = max.`amend_id`
+            GROUP BY c.`filing_id_raw`, %(tran_id)s, f.`is_real`
         """ % dict(
-            tmp_table=self.late_tmp_table,
+            contribs_model=Contribution._meta.db_table,
+            filing_model=Filing._meta.db_table,
+            tran_id=self.backend.get_binary_sql("c.`transaction_id`"),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            "tmp_latest_contributions",
+            sql,
+            primary_key="id"
         )
-        self.cursor.execute(sql)
 
+        # Everything in the touched filings is a duplicate
+        # except the latest record in each group, which is as real
+        # as its filing
+        self.backend.update_join(
+            self.cursor,
+            Contribution._meta.db_table, "c",
+            "tmp_touched_contributions", "t",
+            "c.`filing_id_raw` = t.`filing_id_raw`",
+            "is_duplicate = true, is_real = false"
+        )
+        self.backend.update_join(
+            self.cursor,
+            Contribution._meta.db_table, "c",
+            "tmp_latest_contributions", "latest",
+            "c.`id` = latest.`id`",
+            "is_duplicate = false, is_real = latest.`filing_is_real`"
+        )
+
+        self.cursor.execute("DROP TABLE tmp_touched_contributions")
+        self.cursor.execute("DROP TABLE tmp_latest_contributions")
+
+    def get_chunk_count(self):
+        """
+        Returns how many pieces the CSV dumps are split into for marking
+        duplicates, which is one for dumps that can't be split safely.
+        """
+        if self.backend.splittable_dumps:
+            return None
+        return 1
+
+    def create_staging_table(self, raw_model, tmp_table, headers):
+        """
+        Creates an empty table with the types of the raw columns in a dump,
+        plus the IS_DUPLICATE flag the CSV transformation adds.
+        """
+        self.cursor.execute("DROP TABLE IF EXISTS `%s`" % tmp_table)
         sql = """
-            LOAD DATA LOCAL INFILE '%(target_csv)s'
-            INTO TABLE %(tmp_table)s
-            FIELDS TERMINATED BY ','
-            OPTIONALLY ENCLOSED BY '"'
-            LINES TERMINATED BY '\\n'
-            IGNORE 1 LINES (
-                `FILING_ID`,
-                `AMEND_ID`,
-                `LINE_ITEM`,
-                `REC_TYPE`,
-                `FORM_TYPE`,
-                `TRAN_ID`,
-                `ENTITY_CD`,
-                `ENTY_NAML`,
-                `ENTY_NAMF`,
-                `ENTY_NAMT`,
-                `ENTY_NAMS`,
-                `ENTY_CITY`,
-                `ENTY_ST`,
-                `ENTY_ZIP4`,
-                `CTRIB_EMP`,
-                `CTRIB_OCC`,
-                `CTRIB_SELF`,
-                `ELEC_DATE`,
-                `CTRIB_DATE`,
-                `DATE_THRU`,
-                `AMOUNT`,
-                `CMTE_ID`,
-                `CAND_NAML`,
-                `CAND_NAMF`,
-                `CAND_NAMT`,
-                `CAND_NAMS`,
-                `OFFICE_CD`,
-                `OFFIC_DSCR`,
-                `JURIS_CD`,
-                `JURIS_DSCR`,
-                `DIST_NO`,
-                `OFF_S_H_CD`,
-                `BAL_NAME`,
-                `BAL_NUM`,
-                `BAL_JURIS`,
-                `MEMO_CODE`,
-                `MEMO_REFNO`,
-                `BAL_ID`,
-                `CAND_ID`,
-                `SUP_OFF_CD`,
-                `SUP_OPP_CD`,
-                `IS_DUPLICATE`
+            SELECT %(columns)s, false as `IS_DUPLICATE`
+            FROM `%(raw_model)s`
+            WHERE 1 = 0
+        """ % dict(
+            columns=", ".join("`%s`" % h for h in headers),
+            raw_model=raw_model,
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            tmp_table,
+            sql,
+            index_list=[("FILING_ID", "AMEND_ID")],
+            temporary=False
+        )
+
+    def is_staged(self, table):
+        """
+        Returns whether a table of transformed receipts was already staged
+        by an earlier load in this build.
+        """
+        return table in self.staging.get_table_list()
+
+    def load_staging_table(self, raw_model, tmp_table, headers, path):
+        """
+        Loads a transformed CSV into a table for the merges.
+
+        It is loaded under a temporary name and only renamed to the staging
+        table once it is complete, so a failed load is never reused.
+        """
+        loading_table = "TMP_%s" % raw_model
+        self.create_staging_table(raw_model, loading_table, headers)
+        self.backend.load_csv(
+            self.cursor,
+            loading_table,
+            path,
+            headers + ["IS_DUPLICATE"]
+        )
+        if loading_table != tmp_table:
+            self.backend.rename_tables(
+                self.cursor,
+                [(loading_table, tmp_table)]
             )
+
+    def transform_late_contributions_csv(self):
+        self.log("  Marking duplicates")
+        self.log("   Dumping CSV sorted by unique identifier")
+        sql = """
+        SELECT %(columns)s
+        FROM `%(raw_model)s` as r
+        WHERE %(filings)s
+        ORDER BY `FILING_ID`, %(tran_id)s, `AMEND_ID` DESC
         """ % dict(
-            tmp_table=self.late_tmp_table,
-            target_csv=self.late_target_csv,
+            columns=", ".join("`%s`" % h for h in self.late_headers),
+            tran_id=self.backend.get_binary_sql("`TRAN_ID`"),
+            filings=self.get_raw_filter_sql("r"),
+            raw_model=S497Cd._meta.db_table,
         )
-        self.cursor.execute(sql)
+        self.backend.dump_query(self.cursor, sql, self.late_tmp_csv)
+        # A dry run only explains the dump
+        if self.explain:
+            return
 
-        self.log("  Merging CSV data with other tables")
+        self.log("   Marking duplicates in a new CSV")
+        mark_duplicates_csv(
+            self.late_tmp_csv,
+            self.late_target_csv,
+            self.late_headers,
+            processes=self.processes,
+            chunk_count=self.get_chunk_count()
+        )
+
+    def load_late_contributions_csv(self):
+        self.log("  Loading CSV")
+        self.load_staging_table(
+            S497Cd._meta.db_table,
+            self.late_tmp_table,
+            self.late_headers,
+            self.late_target_csv
+        )
+
+    def load_late_contributions(self, raw_model=None, latest_table=None,
+                                delta=False):
+        self.log("  Merging with other tables")
         sql = """
             INSERT INTO %(contribs_model)s (
                 cycle_id,
                 committee_id,
                 filing_id,
                 filing_id_raw,
+                committee_name,
+                committee_filer_id_raw,
+                filer_name,
+                filer_id_raw,
+                filing_start_date,
+                filing_end_date,
                 transaction_id,
                 amend_id,
                 is_duplicate,
+                is_real,
                 date_received,
                 amount,
                 contributor_full_name,
@@ -306,392 +614,181 @@ class Command(CalAccessCommand):
                 contributor_occupation,
                 contributor_employer,
                 contributor_selfemployed,
-                contributor_entity_type
+                contributor_entity_type,
+                backreference_transaction_id,
+                is_crossreference,
+                crossreference_schedule,
+                transaction_type,
+                contribution_description,
+                contributor_address_1,
+                contributor_address_2,
+                intermediary_prefix,
+                intermediary_first_name,
+                intermediary_last_name,
+                intermediary_suffix,
+                intermediary_address_1,
+                intermediary_address_2,
+                intermediary_city,
+                intermediary_state,
+                intermediary_zipcode,
+                intermediary_occupation,
+                intermediary_employer,
+                intermediary_selfemployed,
+                intermediary_committee_id
             )
             SELECT
                 f.cycle_id as cycle_id,
                 f.committee_id as committee_id,
                 f.id as filing_id,
                 f.filing_id_raw,
-                r.tran_id,
-                r.amend_id,
-                r.is_duplicate,
-                r.ctrib_date,
-                r.amount,
+                cmte.clean_name,
+                cmte.filer_id_raw,
+                filer.clean_name,
+                filer.filer_id_raw,
+                f.start_date,
+                f.end_date,
+                r.`TRAN_ID`,
+                r.`AMEND_ID`,
+                %(is_duplicate)s,
+                f.is_real AND NOT (%(is_duplicate)s),
+                r.`CTRIB_DATE`,
+                r.`AMOUNT`,
                 CASE
-                    WHEN r.enty_namf <> '' THEN r.ctrib_emp
-                    ELSE r.enty_naml
+                    WHEN r.`ENTY_NAMF` <> '' THEN r.`CTRIB_EMP`
+                    ELSE r.`ENTY_NAML`
                 END as contributor_full_name,
                 CASE
-                    WHEN r.enty_namf <> '' THEN true
+                    WHEN r.`ENTY_NAMF` <> '' THEN true
                     ELSE false
                 END as contributor_is_person,
                 c.id,
-                r.enty_namt,
-                r.enty_namf,
-                r.enty_naml,
-                r.enty_nams,
-                r.enty_city,
-                r.enty_st,
-                r.enty_zip4,
-                r.ctrib_occ,
-                r.ctrib_emp,
-                r.ctrib_self,
-                r.entity_cd
+                r.`ENTY_NAMT`,
+                r.`ENTY_NAMF`,
+                r.`ENTY_NAML`,
+                r.`ENTY_NAMS`,
+                r.`ENTY_CITY`,
+                r.`ENTY_ST`,
+                r.`ENTY_ZIP4`,
+                r.`CTRIB_OCC`,
+                r.`CTRIB_EMP`,
+                r.`CTRIB_SELF`,
+                r.`ENTITY_CD`,
+                '' as backreference_transaction_id,
+                '' as is_crossreference,
+                '' as crossreference_schedule,
+                '' as transaction_type,
+                '' as contribution_description,
+                '' as contributor_address_1,
+                '' as contributor_address_2,
+                '' as intermediary_prefix,
+                '' as intermediary_first_name,
+                '' as intermediary_last_name,
+                '' as intermediary_suffix,
+                '' as intermediary_address_1,
+                '' as intermediary_address_2,
+                '' as intermediary_city,
+                '' as intermediary_state,
+                '' as intermediary_zipcode,
+                '' as intermediary_occupation,
+                '' as intermediary_employer,
+                '' as intermediary_selfemployed,
+                '' as intermediary_committee_id
             FROM %(filing_model)s as f
-            INNER JOIN %(raw_model)s as r
-            ON f.filing_id_raw = r.filing_id
-            AND f.amend_id = r.amend_id
+            INNER JOIN `%(raw_model)s` as r
+            ON f.filing_id_raw = r.`FILING_ID`
+            AND f.amend_id = r.`AMEND_ID`
+            INNER JOIN %(committee_model)s as cmte
+            ON f.committee_id = cmte.id
+            INNER JOIN %(filer_model)s as filer
+            ON cmte.filer_id = filer.id
             LEFT OUTER JOIN %(committee_model)s as c
-            ON r.cmte_id = c.xref_filer_id
+            ON r.`CMTE_ID` = c.xref_filer_id
+            %(latest_join)s
             WHERE r.`FORM_TYPE` = 'F497P1'
+            AND f.filing_id_raw >= %%(chunk_start)s
+            AND f.filing_id_raw < %%(chunk_end)s
+            AND %(filings)s
+            AND %(delta)s
         """ % dict(
             contribs_model=Contribution._meta.db_table,
             filing_model=Filing._meta.db_table,
-            raw_model=self.late_tmp_table,
+            raw_model=raw_model or self.late_tmp_table,
             committee_model=Committee._meta.db_table,
+            filer_model=Filer._meta.db_table,
+            filings=self.get_filing_filter_sql("f"),
+            **self.get_merge_sql(raw_model, latest_table, delta)
+        )
+        # The raw S497_CD table has no FILING_ID index, so each chunk
+        # would scan all of it. It is merged in one pass instead.
+        self.execute_in_chunks(
+            sql,
+            *self.get_filing_id_range(),
+            chunk_size=None if raw_model else self.chunk_size
         )
-        self.cursor.execute(sql)
-        self.cursor.execute("DROP TABLE %s" % self.late_tmp_table)
+        if latest_table:
+            self.cursor.execute("DROP TABLE %s" % latest_table)
+        elif not raw_model and not self.is_staged(self.late_tmp_table):
+            self.cursor.execute("DROP TABLE `%s`" % self.late_tmp_table)
 
     def transform_quarterly_contributions_csv(self):
         self.log("  Marking duplicates")
         self.log("   Dumping CSV sorted by unique identifier")
         sql = """
-        SELECT
-            `FILING_ID`,
-            `AMEND_ID`,
-            `LINE_ITEM`,
-            `REC_TYPE`,
-            `FORM_TYPE`,
-            `TRAN_ID`,
-            `ENTITY_CD`,
-            `CTRIB_NAML`,
-            `CTRIB_NAMF`,
-            `CTRIB_NAMT`,
-            `CTRIB_NAMS`,
-            `CTRIB_CITY`,
-            `CTRIB_ST`,
-            `CTRIB_ZIP4`,
-            `CTRIB_EMP`,
-            `CTRIB_OCC`,
-            `CTRIB_SELF`,
-            `TRAN_TYPE`,
-            `RCPT_DATE`,
-            `DATE_THRU`,
-            `AMOUNT`,
-            `CUM_YTD`,
-            `CUM_OTH`,
-            `CTRIB_DSCR`,
-            `CMTE_ID`,
-            `TRES_NAML`,
-            `TRES_NAMF`,
-            `TRES_NAMT`,
-            `TRES_NAMS`,
-            `TRES_CITY`,
-            `TRES_ST`,
-            `TRES_ZIP4`,
-            `INTR_NAML`,
-            `INTR_NAMF`,
-            `INTR_NAMT`,
-            `INTR_NAMS`,
-            `INTR_CITY`,
-            `INTR_ST`,
-            `INTR_ZIP4`,
-            `INTR_EMP`,
-            `INTR_OCC`,
-            `INTR_SELF`,
-            `CAND_NAML`,
-            `CAND_NAMF`,
-            `CAND_NAMT`,
-            `CAND_NAMS`,
-            `OFFICE_CD`,
-            `OFFIC_DSCR`,
-            `JURIS_CD`,
-            `JURIS_DSCR`,
-            `DIST_NO`,
-            `OFF_S_H_CD`,
-            `BAL_NAME`,
-            `BAL_NUM`,
-            `BAL_JURIS`,
-            `SUP_OPP_CD`,
-            `MEMO_CODE`,
-            `MEMO_REFNO`,
-            `BAKREF_TID`,
-            `XREF_SCHNM`,
-            `XREF_MATCH`,
-            `INT_RATE`,
-            `INTR_CMTEID`
-        FROM %(raw_model)s
-        ORDER BY FILING_ID, TRAN_ID, AMEND_ID DESC
-        INTO OUTFILE '%(tmp_csv)s'
-        FIELDS TERMINATED BY ','
-        ENCLOSED BY '"'
-        LINES TERMINATED BY '\n'
+        SELECT %(columns)s
+        FROM `%(raw_model)s` as r
+        WHERE %(filings)s
+        ORDER BY `FILING_ID`, %(tran_id)s, `AMEND_ID` DESC
         """ % dict(
+            columns=", ".join("`%s`" % h for h in self.quarterly_headers),
+            tran_id=self.backend.get_binary_sql("`TRAN_ID`"),
+            filings=self.get_raw_filter_sql("r"),
             raw_model=RcptCd._meta.db_table,
-            tmp_csv=self.quarterly_tmp_csv,
         )
-        self.cursor.execute(sql)
-
-        INHEADERS = [
-            "FILING_ID",
-            "AMEND_ID",
-            "LINE_ITEM",
-            "REC_TYPE",
-            "FORM_TYPE",
-            "TRAN_ID",
-            "ENTITY_CD",
-            "CTRIB_NAML",
-            "CTRIB_NAMF",
-            "CTRIB_NAMT",
-            "CTRIB_NAMS",
-            "CTRIB_CITY",
-            "CTRIB_ST",
-            "CTRIB_ZIP4",
-            "CTRIB_EMP",
-            "CTRIB_OCC",
-            "CTRIB_SELF",
-            "TRAN_TYPE",
-            "RCPT_DATE",
-            "DATE_THRU",
-            "AMOUNT",
-            "CUM_YTD",
-            "CUM_OTH",
-            "CTRIB_DSCR",
-            "CMTE_ID",
-            "TRES_NAML",
-            "TRES_NAMF",
-            "TRES_NAMT",
-            "TRES_NAMS",
-            "TRES_CITY",
-            "TRES_ST",
-            "TRES_ZIP4",
-            "INTR_NAML",
-            "INTR_NAMF",
-            "INTR_NAMT",
-            "INTR_NAMS",
-            "INTR_CITY",
-            "INTR_ST",
-            "INTR_ZIP4",
-            "INTR_EMP",
-            "INTR_OCC",
-            "INTR_SELF",
-            "CAND_NAML",
-            "CAND_NAMF",
-            "CAND_NAMT",
-            "CAND_NAMS",
-            "OFFICE_CD",
-            "OFFIC_DSCR",
-            "JURIS_CD",
-            "JURIS_DSCR",
-            "DIST_NO",
-            "OFF_S_H_CD",
-            "BAL_NAME",
-            "BAL_NUM",
-            "BAL_JURIS",
-            "SUP_OPP_CD",
-            "MEMO_CODE",
-            "MEMO_REFNO",
-            "BAKREF_TID",
-            "XREF_SCHNM",
-            "XREF_MATCH",
-            "INT_RATE",
-            "INTR_CMTEID"
-        ]
-        OUTHEADERS = copy.copy(INHEADERS)
-        OUTHEADERS.append("IS_DUPLICATE")
+        self.backend.dump_query(self.cursor, sql, self.quarterly_tmp_csv)
+        # A dry run only explains the dump
+        if self.explain:
+            return
 
         self.log("   Marking duplicates in a new CSV")
-        with open(self.quarterly_tmp_csv, 'r') as fin:
-            fout = csv.DictWriter(
-                open(self.quarterly_target_csv, 'wb'),
-                fieldnames=OUTHEADERS
-            )
-            fout.writeheader()
-            last_uid = ''
-            for r in csv.DictReader(fin, fieldnames=INHEADERS):
-                r.pop(None, None)
-                uid = '%s-%s' % (r['FILING_ID'], r['TRAN_ID'])
-                if uid != last_uid:
-                    r['IS_DUPLICATE'] = 0
-                    last_uid = uid
-                else:
-                    r['IS_DUPLICATE'] = 1
-                try:
-                    fout.writerow(r)
-                except ValueError:
-                    continue
-
-    def load_quarterly_contributions(self):
-        self.log("  Loading CSV")
-        self.cursor.execute("DROP TABLE IF EXISTS TMP_RCPT_CD;")
-        sql = """
-        CREATE TABLE `TMP_RCPT_CD` (
-          `AMEND_ID` int(11),
-          `AMOUNT` decimal(14,2),
-          `BAKREF_TID` varchar(20),
-          `BAL_JURIS` varchar(40),
-          `BAL_NAME` varchar(200),
-          `BAL_NUM` varchar(7),
-          `CAND_NAMF` varchar(45),
-          `CAND_NAML` varchar(200),
-          `CAND_NAMS` varchar(10),
-          `CAND_NAMT` varchar(10),
-          `CMTE_ID` varchar(9),
-          `CTRIB_ADR1` varchar(55),
-          `CTRIB_ADR2` varchar(55),
-          `CTRIB_CITY` varchar(30),
-          `CTRIB_DSCR` varchar(90),
-          `CTRIB_EMP` varchar(200),
-          `CTRIB_NAMF` varchar(45),
-          `CTRIB_NAML` varchar(200),
-          `CTRIB_NAMS` varchar(10),
-          `CTRIB_NAMT` varchar(10),
-          `CTRIB_OCC` varchar(60),
-          `CTRIB_SELF` varchar(1),
-          `CTRIB_ST` varchar(2),
-          `CTRIB_ZIP4` varchar(10),
-          `CUM_OTH` decimal(14,2) DEFAULT NULL,
-          `CUM_YTD` decimal(14,2) DEFAULT NULL,
-          `DATE_THRU` date DEFAULT NULL,
-          `DIST_NO` varchar(3),
-          `ENTITY_CD` varchar(3),
-          `FILING_ID` int(11),
-          `FORM_TYPE` varchar(9),
-          `INT_RATE` varchar(9),
-          `INTR_ADR1` varchar(55),
-          `INTR_ADR2` varchar(55),
-          `INTR_CITY` varchar(30),
-          `INTR_CMTEID` varchar(9),
-          `INTR_EMP` varchar(200),
-          `INTR_NAMF` varchar(45),
-          `INTR_NAML` varchar(200),
-          `INTR_NAMS` varchar(10),
-          `INTR_NAMT` varchar(10),
-          `INTR_OCC` varchar(60),
-          `INTR_SELF` varchar(1),
-          `INTR_ST` varchar(2),
-          `INTR_ZIP4` varchar(10),
-          `JURIS_CD` varchar(3),
-          `JURIS_DSCR` varchar(40),
-          `LINE_ITEM` int(11),
-          `MEMO_CODE` varchar(1),
-          `MEMO_REFNO` varchar(20),
-          `OFF_S_H_CD` varchar(1),
-          `OFFIC_DSCR` varchar(40),
-          `OFFICE_CD` varchar(3),
-          `RCPT_DATE` date,
-          `REC_TYPE` varchar(4),
-          `SUP_OPP_CD` varchar(1),
-          `TRAN_ID` varchar(20),
-          `TRAN_TYPE` varchar(1),
-          `TRES_ADR1` varchar(55),
-          `TRES_ADR2` varchar(55),
-          `TRES_CITY` varchar(30),
-          `TRES_NAMF` varchar(45),
-          `TRES_NAML` varchar(200),
-          `TRES_NAMS` varchar(10),
-          `TRES_NAMT` varchar(10),
-          `TRES_ST` varchar(2),
-          `TRES_ZIP4` int(11) DEFAULT NULL,
-          `XREF_MATCH` varchar(1),
-          `XREF_SCHNM` varchar(2),
-          `IS_DUPLICATE` bool
+        mark_duplicates_csv(
+            self.quarterly_tmp_csv,
+            self.quarterly_target_csv,
+            self.quarterly_headers,
+            processes=self.processes,
+            chunk_count=self.get_chunk_count()
         )
-        """
-        self.cursor.execute(sql)
 
-        sql = """
-            LOAD DATA LOCAL INFILE '%s'
-            INTO TABLE TMP_RCPT_CD
-            FIELDS TERMINATED BY ','
-            OPTIONALLY ENCLOSED BY '"'
-            LINES TERMINATED BY '\\n'
-            IGNORE 1 LINES (
-            `FILING_ID`,
-            `AMEND_ID`,
-            `LINE_ITEM`,
-            `REC_TYPE`,
-            `FORM_TYPE`,
-            `TRAN_ID`,
-            `ENTITY_CD`,
-            `CTRIB_NAML`,
-            `CTRIB_NAMF`,
-            `CTRIB_NAMT`,
-            `CTRIB_NAMS`,
-            `CTRIB_CITY`,
-            `CTRIB_ST`,
-            `CTRIB_ZIP4`,
-            `CTRIB_EMP`,
-            `CTRIB_OCC`,
-            `CTRIB_SELF`,
-            `TRAN_TYPE`,
-            `RCPT_DATE`,
-            `DATE_THRU`,
-            `AMOUNT`,
-            `CUM_YTD`,
-            `CUM_OTH`,
-            `CTRIB_DSCR`,
-            `CMTE_ID`,
-            `TRES_NAML`,
-            `TRES_NAMF`,
-            `TRES_NAMT`,
-            `TRES_NAMS`,
-            `TRES_CITY`,
-            `TRES_ST`,
-            `TRES_ZIP4`,
-            `INTR_NAML`,
-            `INTR_NAMF`,
-            `INTR_NAMT`,
-            `INTR_NAMS`,
-            `INTR_CITY`,
-            `INTR_ST`,
-            `INTR_ZIP4`,
-            `INTR_EMP`,
-            `INTR_OCC`,
-            `INTR_SELF`,
-            `CAND_NAML`,
-            `CAND_NAMF`,
-            `CAND_NAMT`,
-            `CAND_NAMS`,
-            `OFFICE_CD`,
-            `OFFIC_DSCR`,
-            `JURIS_CD`,
-            `JURIS_DSCR`,
-            `DIST_NO`,
-            `OFF_S_H_CD`,
-            `BAL_NAME`,
-            `BAL_NUM`,
-            `BAL_JURIS`,
-            `SUP_OPP_CD`,
-            `MEMO_CODE`,
-            `MEMO_REFNO`,
-            `BAKREF_TID`,
-            `XREF_SCHNM`,
-            `XREF_MATCH`,
-            `INT_RATE`,
-            `INTR_CMTEID`,
-            `IS_DUPLICATE`
-            )
-        """ % (
-            self.quarterly_target_csv,
+    def load_quarterly_contributions_csv(self):
+        self.log("  Loading CSV")
+        self.load_staging_table(
+            RcptCd._meta.db_table,
+            self.quarterly_tmp_table,
+            self.quarterly_headers,
+            self.quarterly_target_csv
         )
-        self.cursor.execute(sql)
 
-        self.log("  Merging CSV data with other tables")
+    def load_quarterly_contributions(self, raw_model=None, latest_table=None,
+                                     delta=False):
+        self.log("  Merging with other tables")
         sql = """
             INSERT INTO %(contribs_model)s (
                 cycle_id,
                 committee_id,
                 filing_id,
                 filing_id_raw,
+                committee_name,
+                committee_filer_id_raw,
+                filer_name,
+                filer_id_raw,
+                filing_start_date,
+                filing_end_date,
                 transaction_id,
                 amend_id,
                 backreference_transaction_id,
                 is_crossreference,
                 crossreference_schedule,
                 is_duplicate,
+                is_real,
                 transaction_type,
                 date_received,
                 contribution_description,
@@ -731,62 +828,88 @@ class Command(CalAccessCommand):
                 f.committee_id as committee_id,
                 f.id as filing_id,
                 f.filing_id_raw,
-                r.tran_id,
-                r.amend_id,
-                r.bakref_tid,
-                r.xref_match,
-                r.xref_schnm,
-                r.is_duplicate,
-                r.tran_type,
-                r.rcpt_date,
-                r.ctrib_dscr,
-                r.amount,
+                cmte.clean_name,
+                cmte.filer_id_raw,
+                filer.clean_name,
+                filer.filer_id_raw,
+                f.start_date,
+                f.end_date,
+                r.`TRAN_ID`,
+                r.`AMEND_ID`,
+                r.`BAKREF_TID`,
+                r.`XREF_MATCH`,
+                r.`XREF_SCHNM`,
+                %(is_duplicate)s,
+                f.is_real AND NOT (%(is_duplicate)s),
+                r.`TRAN_TYPE`,
+                r.`RCPT_DATE`,
+                r.`CTRIB_DSCR`,
+                r.`AMOUNT`,
                 CASE
-                    WHEN r.ctrib_namf <> '' THEN r.ctrib_emp
-                    ELSE r.ctrib_naml
+                    WHEN r.`CTRIB_NAMF` <> '' THEN r.`CTRIB_EMP`
+                    ELSE r.`CTRIB_NAML`
                 END as contributor_full_name,
                 CASE
-                    WHEN r.ctrib_namf <> '' THEN true
+                    WHEN r.`CTRIB_NAMF` <> '' THEN true
                     ELSE false
                 END as contributor_is_person,
                 c.id,
-                COALESCE(r.ctrib_namt, ''),
-                COALESCE(r.ctrib_namf, ''),
-                COALESCE(r.ctrib_naml, ''),
-                COALESCE(r.ctrib_nams, ''),
-                COALESCE(r.ctrib_adr1, ''),
-                COALESCE(r.ctrib_adr2, ''),
-                COALESCE(r.ctrib_city, ''),
-                COALESCE(r.ctrib_st, ''),
-                COALESCE(r.ctrib_zip4, ''),
-                COALESCE(r.ctrib_occ, ''),
-                COALESCE(r.ctrib_emp, ''),
-                COALESCE(r.ctrib_self, ''),
-                COALESCE(r.entity_cd, ''),
-                COALESCE(r.intr_namt, ''),
-                COALESCE(r.intr_namf, ''),
-                COALESCE(r.intr_naml, ''),
-                COALESCE(r.intr_nams, ''),
-                COALESCE(r.intr_adr1, ''),
-                COALESCE(r.intr_adr2, ''),
-                COALESCE(r.intr_city, ''),
-                COALESCE(r.intr_st, ''),
-                COALESCE(r.intr_zip4, ''),
-                COALESCE(r.intr_occ, ''),
-                COALESCE(r.intr_emp, ''),
-                COALESCE(r.intr_self, ''),
-                COALESCE(r.intr_cmteid, '')
+                COALESCE(r.`CTRIB_NAMT`, ''),
+                COALESCE(r.`CTRIB_NAMF`, ''),
+                COALESCE(r.`CTRIB_NAML`, ''),
+                COALESCE(r.`CTRIB_NAMS`, ''),
+                COALESCE(r.`CTRIB_ADR1`, ''),
+                COALESCE(r.`CTRIB_ADR2`, ''),
+                COALESCE(r.`CTRIB_CITY`, ''),
+                COALESCE(r.`CTRIB_ST`, ''),
+                COALESCE(r.`CTRIB_ZIP4`, ''),
+                COALESCE(r.`CTRIB_OCC`, ''),
+                COALESCE(r.`CTRIB_EMP`, ''),
+                COALESCE(r.`CTRIB_SELF`, ''),
+                COALESCE(r.`ENTITY_CD`, ''),
+                COALESCE(r.`INTR_NAMT`, ''),
+                COALESCE(r.`INTR_NAMF`, ''),
+                COALESCE(r.`INTR_NAML`, ''),
+                COALESCE(r.`INTR_NAMS`, ''),
+                COALESCE(r.`INTR_ADR1`, ''),
+                COALESCE(r.`INTR_ADR2`, ''),
+                COALESCE(r.`INTR_CITY`, ''),
+                COALESCE(r.`INTR_ST`, ''),
+                COALESCE(r.`INTR_ZIP4`, ''),
+                COALESCE(r.`INTR_OCC`, ''),
+                COALESCE(r.`INTR_EMP`, ''),
+                COALESCE(r.`INTR_SELF`, ''),
+                COALESCE(r.`INTR_CMTEID`, '')
             FROM %(filing_model)s as f
-            INNER JOIN %(raw_model)s as r
-            ON f.filing_id_raw = r.filing_id
-            AND f.amend_id = r.amend_id
+            INNER JOIN `%(raw_model)s` as r
+            ON f.filing_id_raw = r.`FILING_ID`
+            AND f.amend_id = r.`AMEND_ID`
+            INNER JOIN %(committee_model)s as cmte
+            ON f.committee_id = cmte.id
+            INNER JOIN %(filer_model)s as filer
+            ON cmte.filer_id = filer.id
             LEFT OUTER JOIN %(committee_model)s as c
-            ON r.cmte_id = c.xref_filer_id
+            ON r.`CMTE_ID` = c.xref_filer_id
+            %(latest_join)s
+            WHERE f.filing_id_raw >= %%(chunk_start)s
+            AND f.filing_id_raw < %%(chunk_end)s
+            AND %(filings)s
+            AND %(delta)s
         """ % dict(
             contribs_model=Contribution._meta.db_table,
             filing_model=Filing._meta.db_table,
-            raw_model="TMP_RCPT_CD",
+            raw_model=raw_model or self.quarterly_tmp_table,
             committee_model=Committee._meta.db_table,
+            filer_model=Filer._meta.db_table,
+            filings=self.get_filing_filter_sql("f"),
+            **self.get_merge_sql(raw_model, latest_table, delta)
+        )
+        self.execute_in_chunks(
+            sql,
+            *self.get_filing_id_range(),
+            chunk_size=self.chunk_size
         )
-        self.cursor.execute(sql)
-        self.cursor.execute("DROP TABLE TMP_RCPT_CD;")
+        if latest_table:
+            self.cursor.execute("DROP TABLE %s" % latest_table)
+        elif not raw_model and not self.is_staged(self.quarterly_tmp_table):
+            self.cursor.execute("DROP TABLE `%s`" % self.quarterly_tmp_table)
@@ -1,19 +1,292 @@
-from django.db import connection
+from optparse import make_option
+from django.db.models import Max
+from django.core.management.base import CommandError
+from calaccess_raw.models import ExpnCd
+from calaccess_campaign_browser.models import (
+    Committee,
+    Expenditure,
+    Filer,
+    Filing,
+    HighWaterMark
+)
 from calaccess_campaign_browser.management.commands import CalAccessCommand
+from calaccess_campaign_browser.utils.indexes import DeferredIndexes
+
+
+custom_options = (
+    make_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Only load expenditures added since the last load"
+    ),
+    make_option(
+        "--chunk-size",
+        action="store",
+        type="int",
+        dest="chunk_size",
+        default=10000,
+        help="Number of FILING_IDs merged in each INSERT statement"
+    ),
+    make_option(
+        "--cycle",
+        action="store",
+        type="int",
+        dest="cycle",
+        default=None,
+        help="Empty and reload the expenditures of a single election cycle"
+    ),
+    make_option(
+        "--changed-only",
+        action="store_true",
+        dest="changed_only",
+        default=False,
+        help="Only reload the filings whose raw records changed"
+    ),
+    make_option(
+        "--keep-indexes",
+        action="store_true",
+        dest="keep_indexes",
+        default=False,
+        help="Maintain secondary indexes during the load instead of \
+rebuilding them afterwards"
+    ),
+    make_option(
+        "--time-budget",
+        action="store",
+        type="int",
+        dest="time_budget",
+        default=None,
+        help="Minutes the merge may take before the load is stopped"
+    ),
+    make_option(
+        "--explain",
+        action="store_true",
+        dest="explain",
+        default=False,
+        help="Explain each statement against the current tables instead of \
+running it"
+    ),
+)
 
 
 class Command(CalAccessCommand):
     help = "Load refined campaign expenditures from CAL-ACCESS raw data"
+    option_list = CalAccessCommand.option_list + custom_options
+    latest_table = "tmp_latest_expn_cd"
 
     def handle(self, *args, **options):
         self.header("Loading expenditures")
-        c = connection.cursor()
+        self.backend.ignore_warnings()
+        self.explain = options.get('explain', False)
+        self.chunk_size = options.get('chunk_size') or 10000
+        self.time_budget = options.get('time_budget')
+        self.incremental = options.get('incremental', False)
+        self.cycle = options.get('cycle')
+        self.changed_only = options.get('changed_only', False)
+        if (self.cycle or self.changed_only) and self.incremental:
+            raise CommandError(
+                "Reloaded filings are loaded in full and can't be loaded \
+incrementally"
+            )
+        self.cursor = self.get_cursor()
+
+        if self.cycle:
+            self.truncate_cycle(Expenditure)
+        if self.changed_only:
+            self.delete_changed(Expenditure)
+        last_id = Expenditure.objects.aggregate(max=Max('id'))['max'] or 0
+        # A partial load is small enough to load through the indexes, and
+        # an incremental one reads them to find what's new
+        if (options.get('keep_indexes') or self.incremental or self.cycle or
+                self.changed_only or self.explain):
+            self.load()
+        else:
+            indexes = DeferredIndexes(Expenditure)
+            self.log(" Dropping secondary indexes")
+            indexes.drop()
+            try:
+                self.load()
+            finally:
+                self.log(" Rebuilding secondary indexes")
+                indexes.rebuild()
+
+        if self.incremental:
+            self.mark_new_duplicates(last_id)
+        if self.explain:
+            self.cursor.summarize()
+            return
+        # The mark covers every filing, so a partial load leaves it alone
+        if self.cycle or self.changed_only:
+            return
+        HighWaterMark.objects.update_mark(ExpnCd._meta.db_table)
+
+    def load(self):
+        # Incremental loads only merge raw records that have not been
+        # loaded yet, and mark their duplicates afterwards
+        if self.incremental:
+            self.load_expenditures(delta=True)
+            return
+        self.mark_duplicates()
+        self.load_expenditures()
+        self.cursor.execute("DROP TABLE %s" % self.latest_table)
+
+    def mark_duplicates(self):
+        """
+        Collects the id of the one raw record that survives in each
+        FILING_ID and TRAN_ID group, which is the latest amendment,
+        the same way contributions are deduplicated. A partial load only
+        collects the groups of the filings it reloads.
+        """
+        self.log(" Marking duplicates")
+        self.cursor.execute("DROP TABLE IF EXISTS %s" % self.latest_table)
+        sql = """
+            SELECT MIN(e.`id`) as `id`
+            FROM `%(raw_model)s` as e
+            INNER JOIN (
+                SELECT
+                    `FILING_ID`,
+                    %(tran_id)s as `TRAN_ID`,
+                    MAX(`AMEND_ID`) as `AMEND_ID`
+                FROM `%(raw_model)s` as r
+                WHERE %(filings)s
+                GROUP BY 1, 2
+            ) as max
+            ON e.`FILING_ID` = max.`FILING_ID`
+            AND %(raw_tran_id)s = max.`TRAN_ID`
+            AND e.`AMEND_ID` = max.`AMEND_ID`
+            GROUP BY e.`FILING_ID`, %(raw_tran_id)s
+        """ % dict(
+            raw_model=ExpnCd._meta.db_table,
+            filings=self.get_raw_filter_sql("r"),
+            tran_id=self.backend.get_binary_sql("`TRAN_ID`"),
+            raw_tran_id=self.backend.get_binary_sql("e.`TRAN_ID`"),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            self.latest_table,
+            sql,
+            primary_key="id"
+        )
+
+    def mark_new_duplicates(self, last_id):
+        """
+        Recomputes duplicates after an incremental load, only within the
+        filings that gained expenditures.
+        """
+        self.log(" Marking duplicates in new filings")
+        self.cursor.execute("DROP TABLE IF EXISTS tmp_touched_expenditures")
+        sql = """
+            SELECT DISTINCT `filing_id_raw`
+            FROM %(expenditure_table)s
+            WHERE `id` > %(last_id)s
+        """ % dict(
+            expenditure_table=Expenditure._meta.db_table,
+            last_id=int(last_id),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            "tmp_touched_expenditures",
+            sql,
+            primary_key="filing_id_raw"
+        )
+
+        # Find the one record from the latest amendment in each group
+        self.cursor.execute("DROP TABLE IF EXISTS tmp_latest_expenditures")
         sql = """
-        INSERT INTO calaccess_campaign_browser_expenditure (
+            SELECT MIN(e.`id`) as `id`
+            FROM %(expenditure_table)s as e
+            INNER JOIN (
+                SELECT
+                    e.`filing_id_raw`,
+                    %(tran_id)s as `tran_id`,
+                    MAX(e.`amend_id`) as `amend_id`
+                FROM %(expenditure_table)s as e
+                INNER JOIN tmp_touched_expenditures as t
+                ON e.`filing_id_raw` = t.`filing_id_raw`
+                GROUP BY 1, 2
+            ) as max
+            ON e.`filing_id_raw` = max.`filing_id_raw`
+            AND %(tran_id)s = max.`tran_id`
+            AND e.`amend_id` = max.`amend_id`
+            GROUP BY e.`filing_id_raw`, %(tran_id)s
+        """ % dict(
+            expenditure_table=Expenditure._meta.db_table,
+            tran_id=self.backend.get_binary_sql("e.`tran_id`"),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            "tmp_latest_expenditures",
+            sql,
+            primary_key="id"
+        )
+
+        # Everything in the touched filings is a duplicate
+        # except the latest record in each group
+        self.backend.update_join(
+            self.cursor,
+            Expenditure._meta.db_table, "e",
+            "tmp_touched_expenditures", "t",
+            "e.`filing_id_raw` = t.`filing_id_raw`",
+            "is_duplicate = true"
+        )
+        self.backend.update_join(
+            self.cursor,
+            Expenditure._meta.db_table, "e",
+            "tmp_latest_expenditures", "latest",
+            "e.`id` = latest.`id`",
+            "is_duplicate = false"
+        )
+
+        self.cursor.execute("DROP TABLE tmp_touched_expenditures")
+        self.cursor.execute("DROP TABLE tmp_latest_expenditures")
+
+    def get_merge_sql(self, delta=False):
+        """
+        Returns the SQL fragments that flag duplicates during the merge
+        from the table of surviving raw ids, or that only take the raw
+        records that have not been loaded yet.
+        """
+        if delta:
+            return dict(
+                is_duplicate="false",
+                latest_join="",
+                delta=HighWaterMark.objects.get_delta_sql(
+                    ExpnCd._meta.db_table,
+                    Expenditure._meta.db_table,
+                    alias="e"
+                )
+            )
+        return dict(
+            is_duplicate="latest.`id` IS NULL",
+            latest_join="""LEFT OUTER JOIN %s as latest
+        ON e.`id` = latest.`id`""" % self.latest_table,
+            delta="true"
+        )
+
+    def load_expenditures(self, delta=False):
+        self.log(" Merging with filings")
+        self.cursor.execute("""
+            SELECT MIN(`filing_id_raw`), MAX(`filing_id_raw`)
+            FROM %s as f
+            WHERE %s
+        """ % (Filing._meta.db_table, self.get_filing_filter_sql("f")))
+        start, end = self.cursor.fetchone()
+        sql = """
+        INSERT INTO %(expenditure_table)s (
             cycle_id,
             committee_id,
             filing_id,
-            dupe,
+            filing_id_raw,
+            committee_name,
+            committee_filer_id_raw,
+            filer_name,
+            filer_id_raw,
+            filing_start_date,
+            filing_end_date,
+            amend_id,
+            is_duplicate,
             line_item,
             payee_namt,
             payee_namf,
@@ -48,88 +321,98 @@ class Command(CalAccessCommand):
             f.cycle_id as cycle_id,
             f.committee_id as committee_id,
             f.id as filing_id,
-            f.is_duplicate,
-            e.line_item,
-            e.payee_namt,
-            e.payee_namf,
-            e.payee_naml,
-            e.payee_nams,
-            e.expn_dscr,
-            e.payee_zip4,
-            e.g_from_e_f,
-            e.payee_city,
-            e.amount,
-            e.memo_refno,
-            e.expn_code,
-            e.memo_code,
-            e.entity_cd,
-            e.bakref_tid,
-            e.payee_adr1,
-            e.payee_adr2,
-            e.expn_chkno,
-            e.form_type,
-            e.cmte_id,
-            e.xref_schnm,
-            e.xref_match,
-            e.expn_date,
-            e.cum_ytd,
-            e.payee_st,
-            e.tran_id,
+            f.filing_id_raw,
+            cmte.clean_name,
+            cmte.filer_id_raw,
+            filer.clean_name,
+            filer.filer_id_raw,
+            f.start_date,
+            f.end_date,
+            f.amend_id,
+            %(is_duplicate)s,
+            e.`LINE_ITEM`,
+            e.`PAYEE_NAMT`,
+            e.`PAYEE_NAMF`,
+            e.`PAYEE_NAML`,
+            e.`PAYEE_NAMS`,
+            e.`EXPN_DSCR`,
+            e.`PAYEE_ZIP4`,
+            e.`G_FROM_E_F`,
+            e.`PAYEE_CITY`,
+            e.`AMOUNT`,
+            e.`MEMO_REFNO`,
+            e.`EXPN_CODE`,
+            e.`MEMO_CODE`,
+            e.`ENTITY_CD`,
+            e.`BAKREF_TID`,
+            e.`PAYEE_ADR1`,
+            e.`PAYEE_ADR2`,
+            e.`EXPN_CHKNO`,
+            e.`FORM_TYPE`,
+            e.`CMTE_ID`,
+            e.`XREF_SCHNM`,
+            e.`XREF_MATCH`,
+            e.`EXPN_DATE`,
+            e.`CUM_YTD`,
+            e.`PAYEE_ST`,
+            e.`TRAN_ID`,
             TRIM(
                 CASE
-                    WHEN e.payee_naml = '' THEN
-                        REPLACE(CONCAT(
-                            e.bal_name,
-                            " ",
-                            REPLACE(TRIM(
-                                CONCAT(
-                                    e.`cand_namt`,
-                                    " ",
-                                    e.`cand_namf`,
-                                    " ",
-                                    e.`cand_naml`,
-                                    " ",
-                                    e.`cand_nams`
-                                )
-                            ), '  ', ' '),
-                            " ",
-                            e.juris_dscr,
-                            " ",
-                            e.offic_dscr
+                    WHEN e.`PAYEE_NAML` = '' THEN
+                        REPLACE(CONCAT_WS(
+                            ' ',
+                            e.`BAL_NAME`,
+                            REPLACE(TRIM(CONCAT_WS(
+                                ' ',
+                                e.`CAND_NAMT`,
+                                e.`CAND_NAMF`,
+                                e.`CAND_NAML`,
+                                e.`CAND_NAMS`
+                            )), '  ', ' '),
+                            e.`JURIS_DSCR`,
+                            e.`OFFIC_DSCR`
                         ), '  ', ' ')
                     ELSE
-                        REPLACE(TRIM(
-                            CONCAT(
-                                e.`payee_namt`,
-                                " ",
-                                e.`payee_namf`,
-                                " ",
-                                e.`payee_naml`,
-                                " ",
-                                e.`payee_nams`
-                            )
-                        ), '  ', ' ')
+                        REPLACE(TRIM(CONCAT_WS(
+                            ' ',
+                            e.`PAYEE_NAMT`,
+                            e.`PAYEE_NAMF`,
+                            e.`PAYEE_NAML`,
+                            e.`PAYEE_NAMS`
+                        )), '  ', ' ')
                 END
             ) as `name`,
+            e.`PAYEE_NAML` <> '' AND e.`PAYEE_NAMF` <> '' as `person_flag`,
             CASE
-                WHEN e.payee_naml = '' THEN
-                    false
-                WHEN e.payee_naml <> '' AND e.payee_namf = '' THEN
-                    false
-                ELSE
-                    true
-            END as `person_flag`,
-            CASE
-                WHEN e.payee_naml = '' THEN
-                    ''
-                WHEN e.payee_naml <> '' AND e.payee_namf = '' THEN
-                    e.payee_naml
-                ELSE
-                    ''
+                WHEN e.`PAYEE_NAMF` = '' THEN e.`PAYEE_NAML`
+                ELSE ''
             END as `raw_org_name`
-        FROM calaccess_campaign_browser_filing as f
-        INNER JOIN EXPN_CD as e
-        ON f.filing_id_raw = e.filing_id
-        AND f.amend_id = e.amend_id
-        """
-        c.execute(sql)
+        FROM %(filing_table)s as f
+        INNER JOIN `%(raw_model)s` as e
+        ON f.filing_id_raw = e.`FILING_ID`
+        AND f.amend_id = e.`AMEND_ID`
+        INNER JOIN %(committee_model)s as cmte
+        ON f.committee_id = cmte.id
+        INNER JOIN %(filer_model)s as filer
+        ON cmte.filer_id = filer.id
+        %(latest_join)s
+        WHERE f.filing_id_raw >= %%(chunk_start)s
+        AND f.filing_id_raw < %%(chunk_end)s
+        AND %(filings)s
+        AND %(delta)s
+        """ % dict(
+            expenditure_table=Expenditure._meta.db_table,
+            filings=self.get_filing_filter_sql("f"),
+            filing_table=Filing._meta.db_table,
+            raw_model=ExpnCd._meta.db_table,
+            committee_model=Committee._meta.db_table,
+            filer_model=Filer._meta.db_table,
+            **self.get_merge_sql(delta)
+        )
+        self.execute_in_chunks(
+            sql,
+            start,
+            end,
+            chunk_size=self.chunk_size,
+            budget=self.time_budget * 60 if self.time_budget else None
+        )
@@ -1,23 +1,38 @@
-import MySQLdb
-import warnings
-from django.db import connection
+from optparse import make_option
 from calaccess_campaign_browser import models
 from calaccess_campaign_browser.management.commands import CalAccessCommand
+from calaccess_campaign_browser.utils.staging import StagingTables
+from calaccess_campaign_browser.utils.models import clean_all_caps_name
+
+
+custom_options = (
+    make_option(
+        "--explain",
+        action="store_true",
+        dest="explain",
+        default=False,
+        help="Explain each statement against the current tables instead of \
+running it"
+    ),
+)
 
 
 class Command(CalAccessCommand):
     help = "Load refined CAL-ACCESS campaign filers and committees"
+    option_list = CalAccessCommand.option_list + custom_options
+    # Number of names cleaned and written back at a time
+    chunk_size = 10000
 
     def handle(self, *args, **options):
         self.header("Loading filers and committees")
 
-        # Ignore MySQL warnings so this can be run with DEBUG=True
-        warnings.filterwarnings("ignore", category=MySQLdb.Warning)
-
-        self.conn = connection.cursor()
+        self.backend.ignore_warnings()
+        self.explain = options.get('explain', False)
+        self.conn = self.get_cursor()
+        self.staging = StagingTables(self.conn)
 
         self.drop_temp_tables()
-        self.create_temp_tables()
+        self.create_staging_tables()
         self.load_cycles()
         self.load_candidate_filers()
         self.create_temp_candidate_committee_tables()
@@ -25,21 +40,64 @@ class Command(CalAccessCommand):
         self.create_temp_pac_tables()
         self.load_pac_filers()
         self.load_pac_committees()
+        if not self.explain:
+            self.load_clean_names()
         self.drop_temp_tables()
+        if self.explain:
+            self.conn.summarize()
+
+    def load_clean_names(self):
+        """
+        Cleans up the ALL CAPS names of every filer and committee in one
+        pass, so pages don't have to each time they show one.
+
+        The cleaned names are collected in a temporary table and written
+        back with a single UPDATE for each model.
+        """
+        self.log(" Cleaning names")
+        table = "tmp_clean_names"
+        for m in [models.Filer, models.Committee]:
+            self.conn.execute("DROP TABLE IF EXISTS %s;" % table)
+            self.conn.execute("""
+                CREATE TEMPORARY TABLE %s (
+                    id integer NOT NULL PRIMARY KEY,
+                    clean_name varchar(255) NOT NULL
+                );
+            """ % table)
+            c = self.get_cursor()
+            c.execute("SELECT `id`, `name` FROM %s;" % m._meta.db_table)
+            while True:
+                row_list = c.fetchmany(self.chunk_size)
+                if not row_list:
+                    break
+                self.conn.executemany(
+                    "INSERT INTO %s (id, clean_name) VALUES (%%s, %%s)" % (
+                        table
+                    ),
+                    [(pk, clean_all_caps_name(name)) for pk, name in row_list]
+                )
+            self.backend.update_join(
+                self.conn,
+                m._meta.db_table, "m",
+                table, "c",
+                "m.`id` = c.`id`",
+                "clean_name = c.`clean_name`"
+            )
+        self.conn.execute("DROP TABLE %s;" % table)
 
     def load_cycles(self):
         self.log(" Loading cycles")
-        c = connection.cursor()
+        c = self.get_cursor()
         sql = """
             INSERT INTO %(cycle_table)s (`name`)
             SELECT DISTINCT
                 CASE
-                    WHEN `session_id` %% 2 = 0 THEN `session_id`
-                    ELSE `session_id` + 1
+                    WHEN `SESSION_ID` %% 2 = 0 THEN `SESSION_ID`
+                    ELSE `SESSION_ID` + 1
                 END as cycle
             FROM (
-                SELECT `session_id`
-                FROM FILER_TO_FILER_TYPE_CD
+                SELECT `SESSION_ID`
+                FROM `FILER_TO_FILER_TYPE_CD`
                 GROUP BY 1
                 ORDER BY 1 DESC
             ) as sessions;
@@ -47,75 +105,64 @@ class Command(CalAccessCommand):
         sql = sql % dict(cycle_table=models.Cycle._meta.db_table)
         c.execute(sql)
 
-    def create_temp_tables(self):
+    def create_staging_tables(self):
         """
-        Create temporary tables we will use as part of this loader.
+        Create the staging tables with the latest name and type of each
+        filer, unless this build already has them.
         """
-        self.log(" Creating temporary tables")
+        self.log(" Creating staging tables")
 
         # Create table with unique filers that eliminates
         # dupes and only keeps the one with the highest incremental ID.
         # We do this because we have not determined any logical way to
         # better infer the most complete record.
+        #
+        # The latest committee record is picked out in the same scan
+        # for the PACs, which can also have been candidates.
         sql = """
-        CREATE TEMPORARY TABLE tmp_max_filers (
-            INDEX(`filer_id`),
-            INDEX(`max_id`)
-        ) AS (
             SELECT
                 fn.`FILER_ID` as `filer_id`,
-                MAX(fn.`id`) as `max_id`
-            FROM FILERNAME_CD as fn
+                MAX(fn.`id`) as `max_id`,
+                MAX(
+                    CASE
+                        WHEN fn.`FILER_TYPE` = 'RECIPIENT COMMITTEE'
+                        THEN fn.`id`
+                    END
+                ) as `max_committee_id`
+            FROM `FILERNAME_CD` as fn
             WHERE fn.`FILER_TYPE` = 'CANDIDATE/OFFICEHOLDER'
             OR fn.`FILER_TYPE` = 'RECIPIENT COMMITTEE'
             GROUP BY 1
-        );
         """
-        self.conn.execute(sql)
+        self.latest_name_table = self.staging.create_table_as(
+            "latest_filer_name",
+            sql,
+            index_list=[("max_id",), ("max_committee_id",)],
+            primary_key="filer_id"
+        )
 
         # Create a table with the party affiliation recorded by each filer.
         # This requires brutal removal of duplicates as above.
         sql = """
-        CREATE TEMPORARY TABLE tmp_max_filer_metadata (
-            INDEX(`filer_id`),
-            INDEX(`party`)
-        ) AS (
             SELECT
                 ft.`FILER_ID` as `filer_id`,
                 ft.`PARTY_CD` as `party`,
                 ft.`CATEGORY_TYPE` as `level_of_government`,
                 ft.`EFFECT_DT` as `effective_date`,
                 ft.`ACTIVE` as `status`
-            FROM FILER_TO_FILER_TYPE_CD as ft
+            FROM `FILER_TO_FILER_TYPE_CD` as ft
             INNER JOIN (
-                SELECT FILER_ID, MAX(`id`) as `id`
-                FROM FILER_TO_FILER_TYPE_CD
+                SELECT `FILER_ID`, MAX(`id`) as `id`
+                FROM `FILER_TO_FILER_TYPE_CD`
                 GROUP BY 1
             ) as maxft
             ON ft.`id` = maxft.`id`
-        );
         """
-        self.conn.execute(sql)
-
-        # Create table that combines the two
-        sql = """
-        CREATE TEMPORARY TABLE tmp_max_filers_with_metadata (
-            INDEX(`filer_id`),
-            INDEX(`max_id`)
-        ) AS (
-            SELECT
-                max.`filer_id` as `filer_id`,
-                max.`max_id` as `max_id`,
-                metadata.party as `party`,
-                metadata.level_of_government as `level_of_government`,
-                metadata.effective_date as `effective_date`,
-                metadata.status as `status`
-            FROM tmp_max_filers as max
-            INNER JOIN tmp_max_filer_metadata as metadata
-            ON max.`filer_id` = metadata.`filer_id`
-        );
-        """
-        self.conn.execute(sql)
+        self.latest_type_table = self.staging.create_table_as(
+            "latest_filer_type",
+            sql,
+            primary_key="filer_id"
+        )
 
     def drop_temp_tables(self):
         """
@@ -123,12 +170,8 @@ class Command(CalAccessCommand):
         """
         self.log(" Dropping temporary tables")
         table_list = [
-            "tmp_max_filers",
-            "tmp_max_filer_metadata",
-            "tmp_max_filers_with_metadata",
             "tmp_cand2cmte",
             "tmp_other_filers",
-            "tmp_max_other_filers",
         ]
         sql = """DROP TABLE IF EXISTS %s;"""
         for t in table_list:
@@ -148,6 +191,7 @@ class Command(CalAccessCommand):
             xref_filer_id,
             filer_type,
             name,
+            clean_name,
             party
         )
         SELECT
@@ -158,18 +202,23 @@ class Command(CalAccessCommand):
             'cand' as filer_type,
             REPLACE(
                 TRIM(
-                    CONCAT(`NAMT`, " ", `NAMF`, " ", `NAML`, " ", `NAMS`)
+                    CONCAT(`NAMT`, ' ', `NAMF`, ' ', `NAML`, ' ', `NAMS`)
                 ),
                 '  ',
                 ' '
             ) as name,
-            max.`party`
-        FROM FILERNAME_CD as fn
-        INNER JOIN tmp_max_filers_with_metadata as max
+            '' as clean_name,
+            metadata.`party`
+        FROM `FILERNAME_CD` as fn
+        INNER JOIN %s as max
         ON fn.`id` = max.`max_id`
+        INNER JOIN %s as metadata
+        ON max.`filer_id` = metadata.`filer_id`
         WHERE fn.`FILER_TYPE` = 'CANDIDATE/OFFICEHOLDER';
         """ % (
             models.Filer._meta.db_table,
+            self.latest_name_table,
+            self.latest_type_table,
         )
 
         self.conn.execute(sql)
@@ -179,11 +228,6 @@ class Command(CalAccessCommand):
         # Join together via a UNION to return the committee filer ids linked
         # to candidate filer records from either direction (i.e. A or B)
         sql = """
-            CREATE TEMPORARY TABLE tmp_cand2cmte (
-                INDEX(`candidate_filer_pk`),
-                INDEX(`candidate_filer_id`),
-                INDEX(`committee_filer_id`)
-            )
             SELECT
                 f.`id` as candidate_filer_pk,
                 f.`filer_id_raw` as candidate_filer_id,
@@ -191,8 +235,8 @@ class Command(CalAccessCommand):
             FROM %(filer_model)s f
             INNER JOIN (
                 SELECT DISTINCT `FILER_ID_A`, `FILER_ID_B`
-                FROM FILER_LINKS_CD
-                WHERE LINK_TYPE = '12011'
+                FROM `FILER_LINKS_CD`
+                WHERE `LINK_TYPE` = '12011'
                 AND `FILER_ID_A` IS NOT NULL
             ) as committee_filer_id_a
             ON f.`filer_id_raw` = committee_filer_id_a.`FILER_ID_B`
@@ -207,15 +251,23 @@ class Command(CalAccessCommand):
             FROM %(filer_model)s f
             INNER JOIN (
                 SELECT DISTINCT `FILER_ID_A`, `FILER_ID_B`
-                FROM FILER_LINKS_CD
-                WHERE LINK_TYPE = '12011'
+                FROM `FILER_LINKS_CD`
+                WHERE `LINK_TYPE` = '12011'
                 AND `FILER_ID_B` IS NOT NULL
             ) as committee_filer_id_a
             ON f.`filer_id_raw` = committee_filer_id_a.`FILER_ID_A`
-            AND f.`filer_id_raw` <> committee_filer_id_a.`FILER_ID_B`;
+            AND f.`filer_id_raw` <> committee_filer_id_a.`FILER_ID_B`
         """ % dict(filer_model=models.Filer._meta.db_table,)
-
-        self.conn.execute(sql)
+        self.backend.create_table_as(
+            self.conn,
+            "tmp_cand2cmte",
+            sql,
+            index_list=[
+                ("candidate_filer_pk",),
+                ("candidate_filer_id",),
+                ("committee_filer_id",),
+            ]
+        )
 
     def load_candidate_committees(self):
         """
@@ -230,6 +282,7 @@ class Command(CalAccessCommand):
             filer_id_raw,
             xref_filer_id,
             name,
+            clean_name,
             committee_type,
             party,
             level_of_government,
@@ -241,6 +294,7 @@ class Command(CalAccessCommand):
             distinct_filers.`filer_id` as filer_id_raw,
             distinct_filers.`xref_filer_id` as xref_filer_id,
             distinct_filers.`name` as name,
+            '' as clean_name,
             'cand' as committee_type,
             distinct_filers.`party` as party,
             distinct_filers.`level_of_government` as level_of_government,
@@ -253,30 +307,36 @@ class Command(CalAccessCommand):
                 fn.`XREF_FILER_ID` as xref_filer_id,
                 REPLACE(
                     TRIM(
-                        CONCAT(`NAMT`, " ", `NAMF`, " ", `NAML`, " ", `NAMS`)
+                        CONCAT(`NAMT`, ' ', `NAMF`, ' ', `NAML`, ' ', `NAMS`)
                     ),
                     '  ',
                     ' '
                 ) as name,
-                max.`party`,
-                max.`level_of_government`,
-                max.`effective_date`,
-                max.`status`
-            FROM FILERNAME_CD as fn
-            INNER JOIN tmp_max_filers_with_metadata as max
+                metadata.`party`,
+                metadata.`level_of_government`,
+                metadata.`effective_date`,
+                metadata.`status`
+            FROM `FILERNAME_CD` as fn
+            INNER JOIN %s as max
             ON fn.`id` = max.`max_id`
+            INNER JOIN %s as metadata
+            ON max.`filer_id` = metadata.`filer_id`
         ) as distinct_filers
         ON tmp_cand2cmte.`committee_filer_id` = distinct_filers.`filer_id`;
-        """ % (models.Committee._meta.db_table,)
+        """ % (
+            models.Committee._meta.db_table,
+            self.latest_name_table,
+            self.latest_type_table,
+        )
 
         self.conn.execute(sql)
 
     def create_temp_pac_tables(self):
         """
-        Another set of temporary tables that can't be created until the
+        Another temporary table that can't be created until the
         candidates are loaded into our clean models.
         """
-        self.log(" Creating yet more temporary tables")
+        self.log(" Creating another temporary table")
 
         # Create a table of all committee filer ids that are not
         # linked to candidates.
@@ -289,38 +349,20 @@ class Command(CalAccessCommand):
         #   B) Filed form F460 or F450
         #
         sql = """
-            CREATE TEMPORARY TABLE tmp_other_filers (
-                index(`filer_id`)
-            ) AS (
-                SELECT
-                    DISTINCT f.`FILER_ID`
-                FROM FILER_FILINGS_CD as f
-                LEFT OUTER JOIN %(committee_model)s as c
-                ON f.`FILER_ID` = c.`filer_id_raw`
-                WHERE `FORM_ID` IN ('F460', 'F450')
-                AND c.id IS NULL
-            );
-        """ % dict(committee_model=models.Committee._meta.db_table,)
-        self.conn.execute(sql)
-
-        # Now connect those with the FILERNAME_CD table and get
-        # the maximum PK there to kill the duplicates
-        sql = """
-        CREATE TEMPORARY TABLE tmp_max_other_filers (
-            index(`filer_id`),
-            index(`max_id`)
-        ) AS (
             SELECT
-                f.`FILER_ID`,
-                MAX(`id`) as `max_id`
-            FROM FILERNAME_CD as f
-            INNER JOIN tmp_other_filers as t
-            ON f.`FILER_ID` = t.`filer_id`
-            WHERE f.`FILER_TYPE` = 'RECIPIENT COMMITTEE'
-            GROUP BY 1
-        );
-        """
-        self.conn.execute(sql)
+                DISTINCT f.`FILER_ID` as `filer_id`
+            FROM `FILER_FILINGS_CD` as f
+            LEFT OUTER JOIN %(committee_model)s as c
+            ON f.`FILER_ID` = c.`filer_id_raw`
+            WHERE `FORM_ID` IN ('F460', 'F450')
+            AND c.id IS NULL
+        """ % dict(committee_model=models.Committee._meta.db_table,)
+        self.backend.create_table_as(
+            self.conn,
+            "tmp_other_filers",
+            sql,
+            index_list=[("filer_id",)]
+        )
 
     def load_pac_filers(self):
         self.log(" Loading PAC filers")
@@ -332,6 +374,7 @@ class Command(CalAccessCommand):
             xref_filer_id,
             filer_type,
             name,
+            clean_name,
             party
         )
         SELECT
@@ -342,19 +385,26 @@ class Command(CalAccessCommand):
             'pac' as filer_type,
             REPLACE(
                 TRIM(
-                    CONCAT(`NAMT`, " ", `NAMF`, " ", `NAML`, " ", `NAMS`)
+                    CONCAT(`NAMT`, ' ', `NAMF`, ' ', `NAML`, ' ', `NAMS`)
                 ),
                 '  ',
                 ' '
             ) as name,
-            tmp_max_filer_metadata.`party`
-        FROM FILERNAME_CD as fn
-        INNER JOIN tmp_max_other_filers as max
-        ON fn.`id` = max.`max_id`
-        LEFT OUTER JOIN tmp_max_filer_metadata
-        ON fn.`FILER_ID` = tmp_max_filer_metadata.`filer_id`
+            '' as clean_name,
+            metadata.`party`
+        FROM `FILERNAME_CD` as fn
+        INNER JOIN %s as max
+        ON fn.`id` = max.`max_committee_id`
+        INNER JOIN tmp_other_filers as t
+        ON max.`filer_id` = t.`filer_id`
+        LEFT OUTER JOIN %s as metadata
+        ON fn.`FILER_ID` = metadata.`filer_id`
         WHERE fn.`FILER_TYPE` = 'RECIPIENT COMMITTEE';
-        """ % (models.Filer._meta.db_table,)
+        """ % (
+            models.Filer._meta.db_table,
+            self.latest_name_table,
+            self.latest_type_table,
+        )
 
         self.conn.execute(sql)
 
@@ -370,6 +420,7 @@ class Command(CalAccessCommand):
                 filer_id_raw,
                 xref_filer_id,
                 name,
+                clean_name,
                 committee_type,
                 party,
                 level_of_government,
@@ -381,18 +432,20 @@ class Command(CalAccessCommand):
                 %(filer_model)s.`filer_id_raw`,
                 %(filer_model)s.`xref_filer_id`,
                 %(filer_model)s.`name`,
+                '',
                 %(filer_model)s.`filer_type`,
                 %(filer_model)s.`party`,
                 metadata.`level_of_government`,
                 metadata.`effective_date`,
                 metadata.`status`
             FROM %(filer_model)s
-            LEFT OUTER JOIN tmp_max_filer_metadata as metadata
+            LEFT OUTER JOIN %(latest_type_table)s as metadata
             ON %(filer_model)s.`filer_id_raw` = metadata.`filer_id`
             WHERE filer_type = 'pac';
         """ % dict(
             committee_model=models.Committee._meta.db_table,
             filer_model=models.Filer._meta.db_table,
+            latest_type_table=self.latest_type_table,
         )
 
         self.conn.execute(sql)
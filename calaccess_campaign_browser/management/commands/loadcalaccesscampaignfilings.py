@@ -1,8 +1,15 @@
-import MySQLdb
-import warnings
-from django.db import connection
 from optparse import make_option
-from calaccess_campaign_browser.models import Filing, FilingPeriod
+from django.db.models import Max
+from django.core.management.base import CommandError
+from calaccess_campaign_browser.models import (
+    Cycle,
+    Contribution,
+    Expenditure,
+    Filing,
+    FilingPeriod,
+    Committee,
+    HighWaterMark
+)
 from calaccess_campaign_browser.management.commands import CalAccessCommand
 
 
@@ -14,6 +21,29 @@ custom_options = (
         default=False,
         help="Flush table before loading data"
     ),
+    make_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Only load filings added since the last load"
+    ),
+    make_option(
+        "--cycle",
+        action="store",
+        type="int",
+        dest="cycle",
+        default=None,
+        help="Empty and reload the filings of a single election cycle"
+    ),
+    make_option(
+        "--explain",
+        action="store_true",
+        dest="explain",
+        default=False,
+        help="Explain each statement against the current tables instead of \
+running it"
+    ),
 )
 
 
@@ -26,17 +56,50 @@ class Command(CalAccessCommand):
         Loads raw filings into consolidated tables
         """
         self.header("Loading filings")
-        # Ignore MySQL warnings so this can be run with DEBUG=True
-        warnings.filterwarnings("ignore", category=MySQLdb.Warning)
+        self.backend.ignore_warnings()
+        self.incremental = options.get('incremental', False)
+        self.explain = options.get('explain', False)
+        self.cycle = options.get('cycle')
+        if self.cycle and (self.incremental or options['flush']):
+            raise CommandError(
+                "A cycle is reloaded in full and can't be flushed or loaded \
+incrementally"
+            )
         if options['flush']:
             self.flush()
+        if self.cycle:
+            # The cycle's contributions and expenditures point at the
+            # filings being replaced, and are reloaded after them
+            self.truncate_cycle(Contribution)
+            self.truncate_cycle(Expenditure)
+            self.truncate_cycle(Filing)
+        last_id = Filing.objects.aggregate(max=Max('id'))['max'] or 0
         self.load_periods()
         self.load_filings()
+        if self.incremental:
+            self.create_touched_table("`id` > %s" % int(last_id))
+        elif self.cycle:
+            self.create_touched_table("`cycle_id` = %s" % self.cycle)
         self.mark_duplicates()
+        self.mark_real()
+        if self.incremental or self.cycle:
+            self.get_cursor().execute("""DROP TABLE tmp_touched_filings;""")
+        if self.explain:
+            self.get_cursor().summarize()
+            return
+        # The mark covers every cycle, so a single cycle leaves it alone
+        if self.cycle:
+            # The cycle's filings were given new ids
+            self.link_summaries()
+            return
+        HighWaterMark.objects.update_mark(
+            'FILER_FILINGS_CD',
+            amend_id_column='FILING_SEQUENCE'
+        )
 
     def load_periods(self):
         self.log(" Loading filing periods")
-        c = connection.cursor()
+        c = self.get_cursor()
         sql = """
             INSERT INTO %(clean_table)s (
                 `period_id`,
@@ -46,34 +109,42 @@ class Command(CalAccessCommand):
                 `deadline`
             )
             SELECT DISTINCT
-                p.`period_id`,
-                p.`period_desc`,
-                p.`start_date`,
-                p.`end_date`,
-                p.`deadline`
-            FROM FILING_PERIOD_CD as p
-            INNER JOIN FILER_FILINGS_CD as ff
-            ON p.period_id = ff.period_id
+                p.`PERIOD_ID`,
+                p.`PERIOD_DESC`,
+                p.`START_DATE`,
+                p.`END_DATE`,
+                p.`DEADLINE`
+            FROM `FILING_PERIOD_CD` as p
+            INNER JOIN `FILER_FILINGS_CD` as ff
+            ON p.`PERIOD_ID` = ff.`PERIOD_ID`
             WHERE ff.`FORM_ID` IN ('F450', 'F460', 'F497')
+            %(delta)s
         """
-        sql = sql % dict(clean_table=FilingPeriod._meta.db_table)
+        if self.incremental or self.cycle:
+            # Periods already loaded will be found again
+            delta = """AND NOT EXISTS (
+                SELECT 1
+                FROM %s as loaded
+                WHERE loaded.`period_id` = p.`PERIOD_ID`
+            )""" % FilingPeriod._meta.db_table
+        else:
+            delta = ""
+        sql = sql % dict(
+            clean_table=FilingPeriod._meta.db_table,
+            delta=delta,
+        )
         c.execute(sql)
 
     def flush(self):
         self.log(" Flushing filings and filing periods")
-        c = connection.cursor()
-        c.execute("""SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0;""")
-        c.execute("""SET FOREIGN_KEY_CHECKS = 0;""")
-        sql = """TRUNCATE `%s`;""" % (FilingPeriod._meta.db_table)
-        c.execute(sql)
-        sql = """TRUNCATE `%s`;""" % (Filing._meta.db_table)
-        c.execute(sql)
-        c.execute("""SET SQL_NOTES=@OLD_SQL_NOTES;""")
-        c.execute("""SET FOREIGN_KEY_CHECKS = 1;""")
+        self.backend.truncate(self.get_cursor(), [
+            FilingPeriod._meta.db_table,
+            Filing._meta.db_table,
+        ])
 
     def load_filings(self):
         self.log(" Loading form 450, 460, 497 filings")
-        c = connection.cursor()
+        c = self.get_cursor()
         sql = """
         INSERT INTO %(filing_table)s (
           cycle_id,
@@ -86,94 +157,212 @@ class Command(CalAccessCommand):
           end_date,
           date_received,
           date_filed,
-          is_duplicate
+          is_duplicate,
+          is_real
         )
         SELECT
           cycle.name as cycle_id,
           c.id as committee_id,
-          ff.FILING_ID as filing_id_raw,
-          ff.form_id as form_type,
-          ff.filing_sequence as amend_id,
+          ff.`FILING_ID` as filing_id_raw,
+          ff.`FORM_ID` as form_type,
+          ff.`FILING_SEQUENCE` as amend_id,
           ff.real_period_id as period_id,
-          ff.rpt_start as start_date,
-          ff.rpt_end as end_date,
-          ff.rpt_date as date_received,
-          ff.filing_date as date_filed,
+          ff.`RPT_START` as start_date,
+          ff.`RPT_END` as end_date,
+          ff.`RPT_DATE` as date_received,
+          ff.`FILING_DATE` as date_filed,
+          false,
           false
         FROM (
             SELECT
                 *,
                 CASE
-                    WHEN `session_id` %% 2 = 0 THEN `session_id`
-                    ELSE `session_id` + 1
+                    WHEN `SESSION_ID` %% 2 = 0 THEN `SESSION_ID`
+                    ELSE `SESSION_ID` + 1
                 END as cycle,
                 CASE
-                    WHEN `period_id` = 0 THEN null
-                    ELSE `period_id`
+                    WHEN `PERIOD_ID` = 0 THEN null
+                    ELSE `PERIOD_ID`
                 END as real_period_id
-            FROM FILER_FILINGS_CD
+            FROM `FILER_FILINGS_CD`
         ) as ff
-        INNER JOIN calaccess_campaign_browser_committee as c
-        ON ff.`filer_id` = c.`filer_id_raw`
-        INNER JOIN calaccess_campaign_browser_cycle as cycle
+        INNER JOIN %(committee_table)s as c
+        ON ff.`FILER_ID` = c.`filer_id_raw`
+        INNER JOIN %(cycle_table)s as cycle
         ON ff.cycle = cycle.name
         WHERE `FORM_ID` IN ('F450', 'F460', 'F497')
+        %(delta)s
         """
-        sql = sql % dict(filing_table=Filing._meta.db_table)
+        if self.cycle:
+            delta = "AND cycle.name = %d" % self.cycle
+        elif self.incremental:
+            delta = "AND %s" % HighWaterMark.objects.get_delta_sql(
+                'FILER_FILINGS_CD',
+                Filing._meta.db_table,
+                alias='ff',
+                amend_id_column='FILING_SEQUENCE'
+            )
+        else:
+            delta = ""
+        sql = sql % dict(
+            filing_table=Filing._meta.db_table,
+            committee_table=Committee._meta.db_table,
+            cycle_table=Cycle._meta.db_table,
+            delta=delta
+        )
         c.execute(sql)
 
+    def create_touched_table(self, where):
+        """
+        Collects the filing ids that gained a record in an incremental or
+        single cycle load, so duplicates are only recomputed for those groups.
+        """
+        self.log(" Collecting new filings")
+        c = self.get_cursor()
+        c.execute("""DROP TABLE IF EXISTS tmp_touched_filings;""")
+        sql = """
+            SELECT DISTINCT `filing_id_raw`
+            FROM %(filing_table)s
+            WHERE %(where)s
+        """ % dict(filing_table=Filing._meta.db_table, where=where)
+        self.backend.create_table_as(
+            c,
+            "tmp_touched_filings",
+            sql,
+            primary_key="filing_id_raw"
+        )
+
     def mark_duplicates(self):
+        """
+        Marks every filing that isn't the latest amendment of its FILING_ID,
+        along with any filing without a period.
+
+        The latest amendment of each group is found in one grouped scan and
+        every filing is then updated with its final flag in one more pass.
+        """
         self.log(" Marking duplicates")
-        c = connection.cursor()
+        c = self.get_cursor()
+
+        # Incremental and single cycle loads only change the groups they load
+        touched_only = self.incremental or self.cycle
+        if touched_only:
+            touched = """WHERE `filing_id_raw` IN (
+                SELECT `filing_id_raw` FROM tmp_touched_filings
+            )"""
+        else:
+            touched = ""
 
         sql = """
-        CREATE TEMPORARY TABLE tmp_filing_dupes (
-            index(`filing_id_raw`)
-        ) AS (
-            SELECT filing_id_raw
-            FROM calaccess_campaign_browser_filing
+            SELECT `filing_id_raw`, MAX(`amend_id`) as max_amend_id
+            FROM %(filing_table)s
+            %(touched)s
             GROUP BY 1
-            HAVING COUNT(*) > 1
-        );
+        """ % dict(filing_table=Filing._meta.db_table, touched=touched)
+        self.backend.create_table_as(
+            c,
+            "tmp_filing_max_amends",
+            sql,
+            primary_key="filing_id_raw"
+        )
+
+        self.backend.update_join(
+            c,
+            Filing._meta.db_table, "f",
+            "tmp_filing_max_amends", "m",
+            "f.`filing_id_raw` = m.`filing_id_raw`",
+            "is_duplicate = ("
+            "f.`amend_id` < m.`max_amend_id` OR f.`period_id` IS NULL"
+            ")"
+        )
+
+        c.execute("""DROP TABLE tmp_filing_max_amends;""")
+
+    def mark_real(self):
         """
-        c.execute(sql)
+        Marks the filings that count toward their committee's totals and
+        copies the flag onto the contributions already loaded from them.
 
-        sql = """
-        UPDATE calaccess_campaign_browser_filing as f
-        INNER JOIN tmp_filing_dupes as d
-        ON f.`filing_id_raw` = d.`filing_id_raw`
-        SET is_duplicate = true;
+        A filing is real unless it's a duplicate or an F497 late filing that
+        starts before the end of its committee's most recent quarterly
+        filing, which reports the same money again. Incremental and single
+        cycle loads only recompute the committees they loaded filings for.
         """
-        c.execute(sql)
+        self.log(" Marking real filings")
+        c = self.get_cursor()
 
-        sql = """DROP TABLE tmp_filing_dupes;"""
-        c.execute(sql)
+        touched_only = self.incremental or self.cycle
+        if touched_only:
+            c.execute("""DROP TABLE IF EXISTS tmp_touched_committees;""")
+            sql = """
+                SELECT DISTINCT f.`committee_id`
+                FROM %(filing_table)s as f
+                INNER JOIN tmp_touched_filings as t
+                ON f.`filing_id_raw` = t.`filing_id_raw`
+            """ % dict(filing_table=Filing._meta.db_table)
+            self.backend.create_table_as(
+                c,
+                "tmp_touched_committees",
+                sql,
+                primary_key="committee_id"
+            )
+            touched = """`committee_id` IN (
+                SELECT `committee_id` FROM tmp_touched_committees
+            )"""
+        else:
+            touched = "true"
+
+        c.execute("""
+            UPDATE %(filing_table)s
+            SET `is_real` = NOT `is_duplicate`
+            WHERE %(touched)s
+        """ % dict(filing_table=Filing._meta.db_table, touched=touched))
 
-        # Unmark all those with the maximum id number among their set
         sql = """
-        CREATE TEMPORARY TABLE tmp_filing_max_dupes (
-            index(`filing_id_raw`),
-            index(`max_id`)
-        ) AS (
-            SELECT f.`filing_id_raw`, MAX(`amend_id`) as max_id
-            FROM calaccess_campaign_browser_filing as f
-            WHERE is_duplicate = true
+            SELECT `committee_id`, MAX(`end_date`) as `end_date`
+            FROM %(filing_table)s
+            WHERE `form_type` IN ('F450', 'F460')
+            AND `is_duplicate` = false
+            AND %(touched)s
             GROUP BY 1
-        );
-        """
-        c.execute(sql)
+        """ % dict(filing_table=Filing._meta.db_table, touched=touched)
+        self.backend.create_table_as(
+            c,
+            "tmp_latest_quarterlies",
+            sql,
+            primary_key="committee_id"
+        )
+        self.backend.update_join(
+            c,
+            Filing._meta.db_table, "f",
+            "tmp_latest_quarterlies", "q",
+            "f.`committee_id` = q.`committee_id` "
+            "AND f.`form_type` = 'F497' "
+            "AND f.`start_date` <= q.`end_date`",
+            "is_real = false"
+        )
 
+        # The flags go through a table of their own because both tables
+        # have an is_real column for the update to confuse
         sql = """
-        UPDATE calaccess_campaign_browser_filing as f
-        INNER JOIN tmp_filing_max_dupes as d
-        ON f.`filing_id_raw` = d.`filing_id_raw`
-        AND f.`amend_id` = d.`max_id`
-        SET is_duplicate = false;
-        """
-        c.execute(sql)
-
-        sql = """DROP TABLE tmp_filing_max_dupes;"""
-        c.execute(sql)
+            SELECT `id` as `filing_id`, `is_real` as `filing_is_real`
+            FROM %(filing_table)s
+            WHERE %(touched)s
+        """ % dict(filing_table=Filing._meta.db_table, touched=touched)
+        self.backend.create_table_as(
+            c,
+            "tmp_real_filings",
+            sql,
+            primary_key="filing_id"
+        )
+        self.backend.update_join(
+            c,
+            Contribution._meta.db_table, "c",
+            "tmp_real_filings", "r",
+            "c.`filing_id` = r.`filing_id`",
+            "is_real = (r.`filing_is_real` AND NOT c.`is_duplicate`)"
+        )
 
-        # And then anything without a period should go down as a dupe too
-        Filing.objects.filter(period_id=None).update(is_duplicate=True)
+        c.execute("""DROP TABLE tmp_latest_quarterlies;""")
+        c.execute("""DROP TABLE tmp_real_filings;""")
+        if touched_only:
+            c.execute("""DROP TABLE tmp_touched_committees;""")
@@ -0,0 +1,469 @@
+import os
+import csv
+import tempfile
+from optparse import make_option
+from django.core.management import call_command
+from calaccess_raw import get_download_directory
+from calaccess_campaign_browser.management.commands import CalAccessCommand
+from calaccess_campaign_browser.models import (
+    Contribution,
+    Expenditure,
+    Filing,
+    Committee
+)
+from calaccess_campaign_browser.utils.streaming import (
+    RawFile,
+    external_sort,
+    mark_latest,
+    to_date,
+    to_number
+)
+
+
+custom_options = (
+    make_option(
+        "--run-size",
+        action="store",
+        type="int",
+        dest="run_size",
+        default=250000,
+        help="Number of raw rows sorted in memory at once"
+    ),
+)
+
+
+class Command(CalAccessCommand):
+    help = "Load refined summaries, contributions and expenditures straight \
+from the raw CAL-ACCESS TSV files"
+    option_list = CalAccessCommand.option_list + custom_options
+
+    def handle(self, *args, **options):
+        self.header("Loading refined tables from raw files")
+        self.data_dir = os.path.join(get_download_directory(), 'tsv')
+        self.run_size = options.get('run_size') or 250000
+        self.backend.ignore_warnings()
+        self.cursor = self.get_cursor()
+
+        self.log(" Reading filings and committees")
+        self.filings = dict(
+            ((f[0], f[1]), f[2:]) for f in Filing.objects.values_list(
+                'filing_id_raw',
+                'amend_id',
+                'id',
+                'cycle_id',
+                'committee_id',
+                'is_real',
+                'committee__clean_name',
+                'committee__filer_id_raw',
+                'committee__filer__clean_name',
+                'committee__filer__filer_id_raw',
+                'start_date',
+                'end_date'
+            )
+        )
+        self.committees = dict(
+            Committee.objects.values_list('xref_filer_id', 'id')
+        )
+
+        self.log(" Quarterly contributions")
+        self.load_rows(
+            Contribution,
+            self.quarterly_headers,
+            self.transform_quarterly_contributions(self.read('RCPT_CD'))
+        )
+        self.log(" Late contributions")
+        self.load_rows(
+            Contribution,
+            self.late_headers,
+            self.transform_late_contributions(self.read('S497_CD'))
+        )
+        self.log(" Expenditures")
+        self.load_rows(
+            Expenditure,
+            self.expenditure_headers,
+            self.transform_expenditures(self.read('EXPN_CD'))
+        )
+        call_command(
+            "loadcalaccesscampaignsummaries",
+            from_tsv=True,
+            stdout=self.stdout
+        )
+        self.success("Done!")
+
+    def read(self, table):
+        """
+        Yields the rows of a raw file sorted with the latest amendment
+        first in each FILING_ID and TRAN_ID group, along with a flag for
+        the duplicates that follow it.
+        """
+        raw = RawFile(os.path.join(self.data_dir, "%s.TSV" % table))
+        filing_id = raw.index['FILING_ID']
+        tran_id = raw.index['TRAN_ID']
+        amend_id = raw.index['AMEND_ID']
+        # Skip the broken lines that don't start with a filing. Repeated
+        # rows keep their order in the file, so the first one is kept, the
+        # same as when duplicates are marked in the database.
+        rows = external_sort(
+            (
+                r for r in raw
+                if r[filing_id].isdigit() and r[amend_id].isdigit()
+            ),
+            key=lambda r: (int(r[filing_id]), r[tran_id], -int(r[amend_id])),
+            run_size=self.run_size
+        )
+        for row, is_duplicate in mark_latest(
+            rows,
+            key=lambda r: (r[filing_id], r[tran_id])
+        ):
+            yield dict(zip(raw.headers, row)), is_duplicate
+
+    def get_filing(self, r):
+        """
+        Returns the id, cycle, committee and real flag of the filing a raw
+        record belongs to, followed by its identity values, or None if it
+        isn't loaded.
+        """
+        return self.filings.get((int(r['FILING_ID']), int(r['AMEND_ID'])))
+
+    def get_identity(self, filing):
+        """
+        Returns the committee, filer and period values copied onto each
+        record of a filing, in the order of identity_headers.
+        """
+        value_list = []
+        for v in filing[4:]:
+            if v is None:
+                v = '\\N'
+            elif isinstance(v, unicode):
+                v = v.encode('utf-8')
+            value_list.append(v)
+        return value_list
+
+    identity_headers = [
+        "committee_name",
+        "committee_filer_id_raw",
+        "filer_name",
+        "filer_id_raw",
+        "filing_start_date",
+        "filing_end_date",
+    ]
+
+    def load_rows(self, model, headers, rows):
+        """
+        Writes reshaped rows to a CSV and bulk loads it into a model's table.
+        """
+        path = tempfile.NamedTemporaryFile(suffix='.csv').name
+        count = 0
+        with open(path, 'wb') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        self.log("  Loading %s rows" % count)
+        self.backend.load_csv(self.cursor, model._meta.db_table, path, headers)
+        os.remove(path)
+
+    quarterly_headers = [
+        "cycle_id",
+        "committee_id",
+        "filing_id",
+        "filing_id_raw",
+        "transaction_id",
+        "amend_id",
+        "backreference_transaction_id",
+        "is_crossreference",
+        "crossreference_schedule",
+        "is_duplicate",
+        "is_real",
+        "transaction_type",
+        "date_received",
+        "contribution_description",
+        "amount",
+        "contributor_full_name",
+        "contributor_is_person",
+        "contributor_committee_id",
+        "contributor_prefix",
+        "contributor_first_name",
+        "contributor_last_name",
+        "contributor_suffix",
+        "contributor_address_1",
+        "contributor_address_2",
+        "contributor_city",
+        "contributor_state",
+        "contributor_zipcode",
+        "contributor_occupation",
+        "contributor_employer",
+        "contributor_selfemployed",
+        "contributor_entity_type",
+        "intermediary_prefix",
+        "intermediary_first_name",
+        "intermediary_last_name",
+        "intermediary_suffix",
+        "intermediary_address_1",
+        "intermediary_address_2",
+        "intermediary_city",
+        "intermediary_state",
+        "intermediary_zipcode",
+        "intermediary_occupation",
+        "intermediary_employer",
+        "intermediary_selfemployed",
+        "intermediary_committee_id"
+    ] + identity_headers
+
+    def transform_quarterly_contributions(self, rows):
+        """
+        Reshapes RCPT_CD records the way the quarterly merge does.
+        """
+        for r, is_duplicate in rows:
+            filing = self.get_filing(r)
+            if not filing:
+                continue
+            filing_id, cycle_id, committee_id, is_real = filing[:4]
+            yield [
+                cycle_id,
+                committee_id,
+                filing_id,
+                r['FILING_ID'],
+                r['TRAN_ID'],
+                r['AMEND_ID'],
+                r['BAKREF_TID'],
+                r['XREF_MATCH'],
+                r['XREF_SCHNM'],
+                int(is_duplicate),
+                int(is_real and not is_duplicate),
+                r['TRAN_TYPE'],
+                to_date(r['RCPT_DATE']),
+                r['CTRIB_DSCR'],
+                to_number(r['AMOUNT'], '0'),
+                r['CTRIB_EMP'] if r['CTRIB_NAMF'] else r['CTRIB_NAML'],
+                int(bool(r['CTRIB_NAMF'])),
+                self.committees.get(r['CMTE_ID'], '\\N'),
+                r['CTRIB_NAMT'],
+                r['CTRIB_NAMF'],
+                r['CTRIB_NAML'],
+                r['CTRIB_NAMS'],
+                r['CTRIB_ADR1'],
+                r['CTRIB_ADR2'],
+                r['CTRIB_CITY'],
+                r['CTRIB_ST'],
+                r['CTRIB_ZIP4'],
+                r['CTRIB_OCC'],
+                r['CTRIB_EMP'],
+                r['CTRIB_SELF'],
+                r['ENTITY_CD'],
+                r['INTR_NAMT'],
+                r['INTR_NAMF'],
+                r['INTR_NAML'],
+                r['INTR_NAMS'],
+                r['INTR_ADR1'],
+                r['INTR_ADR2'],
+                r['INTR_CITY'],
+                r['INTR_ST'],
+                r['INTR_ZIP4'],
+                r['INTR_OCC'],
+                r['INTR_EMP'],
+                r['INTR_SELF'],
+                r['INTR_CMTEID'],
+            ] + self.get_identity(filing)
+
+    # Only quarterly receipts report these, so late ones leave them blank
+    late_blank_headers = [
+        "backreference_transaction_id",
+        "is_crossreference",
+        "crossreference_schedule",
+        "transaction_type",
+        "contribution_description",
+        "contributor_address_1",
+        "contributor_address_2",
+        "intermediary_prefix",
+        "intermediary_first_name",
+        "intermediary_last_name",
+        "intermediary_suffix",
+        "intermediary_address_1",
+        "intermediary_address_2",
+        "intermediary_city",
+        "intermediary_state",
+        "intermediary_zipcode",
+        "intermediary_occupation",
+        "intermediary_employer",
+        "intermediary_selfemployed",
+        "intermediary_committee_id",
+    ]
+
+    late_headers = [
+        "cycle_id",
+        "committee_id",
+        "filing_id",
+        "filing_id_raw",
+        "transaction_id",
+        "amend_id",
+        "is_duplicate",
+        "is_real",
+        "date_received",
+        "amount",
+        "contributor_full_name",
+        "contributor_is_person",
+        "contributor_committee_id",
+        "contributor_prefix",
+        "contributor_first_name",
+        "contributor_last_name",
+        "contributor_suffix",
+        "contributor_city",
+        "contributor_state",
+        "contributor_zipcode",
+        "contributor_occupation",
+        "contributor_employer",
+        "contributor_selfemployed",
+        "contributor_entity_type"
+    ] + late_blank_headers + identity_headers
+
+    def transform_late_contributions(self, rows):
+        """
+        Reshapes the contributions reported in S497_CD the way the late
+        merge does.
+        """
+        blank_list = [''] * len(self.late_blank_headers)
+        for r, is_duplicate in rows:
+            if r['FORM_TYPE'] != 'F497P1':
+                continue
+            filing = self.get_filing(r)
+            if not filing:
+                continue
+            filing_id, cycle_id, committee_id, is_real = filing[:4]
+            yield [
+                cycle_id,
+                committee_id,
+                filing_id,
+                r['FILING_ID'],
+                r['TRAN_ID'],
+                r['AMEND_ID'],
+                int(is_duplicate),
+                int(is_real and not is_duplicate),
+                to_date(r['CTRIB_DATE']),
+                to_number(r['AMOUNT'], '0'),
+                r['CTRIB_EMP'] if r['ENTY_NAMF'] else r['ENTY_NAML'],
+                int(bool(r['ENTY_NAMF'])),
+                self.committees.get(r['CMTE_ID'], '\\N'),
+                r['ENTY_NAMT'],
+                r['ENTY_NAMF'],
+                r['ENTY_NAML'],
+                r['ENTY_NAMS'],
+                r['ENTY_CITY'],
+                r['ENTY_ST'],
+                r['ENTY_ZIP4'],
+                r['CTRIB_OCC'],
+                r['CTRIB_EMP'],
+                r['CTRIB_SELF'],
+                r['ENTITY_CD'],
+            ] + blank_list + self.get_identity(filing)
+
+    expenditure_headers = [
+        "cycle_id",
+        "committee_id",
+        "filing_id",
+        "filing_id_raw",
+        "amend_id",
+        "is_duplicate",
+        "line_item",
+        "payee_namt",
+        "payee_namf",
+        "payee_naml",
+        "payee_nams",
+        "expn_dscr",
+        "payee_zip4",
+        "g_from_e_f",
+        "payee_city",
+        "amount",
+        "memo_refno",
+        "expn_code",
+        "memo_code",
+        "entity_cd",
+        "bakref_tid",
+        "payee_adr1",
+        "payee_adr2",
+        "expn_chkno",
+        "form_type",
+        "cmte_id",
+        "xref_schnm",
+        "xref_match",
+        "expn_date",
+        "cum_ytd",
+        "payee_st",
+        "tran_id",
+        "name",
+        "person_flag",
+        "raw_org_name"
+    ] + identity_headers
+
+    def transform_expenditures(self, rows):
+        """
+        Reshapes EXPN_CD records the way the expenditure merge does.
+        """
+        for r, is_duplicate in rows:
+            filing = self.get_filing(r)
+            if not filing:
+                continue
+            filing_id, cycle_id, committee_id = filing[:3]
+            if r['PAYEE_NAML']:
+                name = " ".join([
+                    r['PAYEE_NAMT'],
+                    r['PAYEE_NAMF'],
+                    r['PAYEE_NAML'],
+                    r['PAYEE_NAMS'],
+                ]).strip().replace('  ', ' ').strip()
+            else:
+                candidate = " ".join([
+                    r['CAND_NAMT'],
+                    r['CAND_NAMF'],
+                    r['CAND_NAML'],
+                    r['CAND_NAMS'],
+                ]).strip().replace('  ', ' ')
+                name = " ".join([
+                    r['BAL_NAME'],
+                    candidate,
+                    r['JURIS_DSCR'],
+                    r['OFFIC_DSCR'],
+                ]).replace('  ', ' ').strip()
+            is_person = bool(r['PAYEE_NAML'] and r['PAYEE_NAMF'])
+            if r['PAYEE_NAML'] and not r['PAYEE_NAMF']:
+                raw_org_name = r['PAYEE_NAML']
+            else:
+                raw_org_name = ''
+            yield [
+                cycle_id,
+                committee_id,
+                filing_id,
+                r['FILING_ID'],
+                r['AMEND_ID'],
+                int(is_duplicate),
+                to_number(r['LINE_ITEM'], '0'),
+                r['PAYEE_NAMT'],
+                r['PAYEE_NAMF'],
+                r['PAYEE_NAML'],
+                r['PAYEE_NAMS'],
+                r['EXPN_DSCR'],
+                r['PAYEE_ZIP4'],
+                r['G_FROM_E_F'],
+                r['PAYEE_CITY'],
+                to_number(r['AMOUNT'], '0'),
+                r['MEMO_REFNO'],
+                r['EXPN_CODE'],
+                r['MEMO_CODE'],
+                r['ENTITY_CD'],
+                r['BAKREF_TID'],
+                r['PAYEE_ADR1'],
+                r['PAYEE_ADR2'],
+                r['EXPN_CHKNO'],
+                r['FORM_TYPE'],
+                r['CMTE_ID'],
+                r['XREF_SCHNM'],
+                r['XREF_MATCH'],
+                to_date(r['EXPN_DATE']),
+                to_number(r['CUM_YTD']),
+                r['PAYEE_ST'],
+                r['TRAN_ID'],
+                name,
+                int(is_person),
+                raw_org_name,
+            ] + self.get_identity(filing)
@@ -1,124 +1,369 @@
 import os
+import sys
 import csv
-import MySQLdb
-import warnings
-from django.db import connection
+from optparse import make_option
+from django.core.management.base import CommandError
 from calaccess_raw import get_download_directory
 from django.utils.datastructures import SortedDict
-from calaccess_campaign_browser.models import Summary
+from calaccess_campaign_browser.models import Summary, HighWaterMark
 from calaccess_campaign_browser.management.commands import CalAccessCommand
+from calaccess_campaign_browser.utils.streaming import RawFile, external_sort
+
+
+custom_options = (
+    make_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Only load summaries added since the last load, pivoting \
+them in the database"
+    ),
+    make_option(
+        "--from-tsv",
+        action="store_true",
+        dest="from_tsv",
+        default=False,
+        help="Read SMRY_CD straight from the downloaded TSV file"
+    ),
+    make_option(
+        "--pivot-in-database",
+        action="store_true",
+        dest="in_database",
+        default=False,
+        help="Pivot the raw SMRY_CD table with a grouped query instead of \
+regrouping the CSV"
+    ),
+    make_option(
+        "--changed-only",
+        action="store_true",
+        dest="changed_only",
+        default=False,
+        help="Only reload the summaries of filings whose raw records \
+changed, pivoting them in the database"
+    ),
+    make_option(
+        "--cycle",
+        action="store",
+        type="int",
+        dest="cycle",
+        default=None,
+        help="Empty and reload the summaries of a single election cycle, \
+pivoting them in the database"
+    ),
+    make_option(
+        "--max-memory",
+        action="store",
+        type="int",
+        dest="max_memory",
+        default=256,
+        help="Megabytes of line items held in memory while regrouping the \
+CSV before sorting spills to disk"
+    ),
+)
+
+
+class LineItem(object):
+    """
+    One raw line item on its way into a summary, kept in fixed slots
+    so millions of them can be sorted in a small amount of memory.
+    """
+    __slots__ = ('filing_id', 'amend_id', 'line', 'field', 'amount')
+
+    def __init__(self, filing_id, amend_id, line, field, amount):
+        self.filing_id = filing_id
+        self.amend_id = amend_id
+        self.line = line
+        self.field = field
+        self.amount = amount
+
+    # Sorted runs are written to disk as CSV rows, which must be sequences
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __getitem__(self, i):
+        return getattr(self, self.__slots__[i])
+
+    def get_key(self):
+        return (self.filing_id, self.amend_id, self.line)
+
+    @classmethod
+    def load(cls, row):
+        """
+        Rebuilds a line item from a row of a sorted run on disk.
+        """
+        return cls(int(row[0]), int(row[1]), int(row[2]), int(row[3]), row[4])
+
+    @classmethod
+    def get_size(cls):
+        """
+        Returns roughly how many bytes a line item takes up in memory,
+        counting the reference to it held by a list.
+
+        Sorting with a key function also holds the key tuple of every item
+        and a wrapper object with a reference to the key and the item.
+        """
+        item = cls(10 ** 7, 10, 10 ** 7, 1, "1000000.00")
+        item_size = sys.getsizeof(item) + 8 + sum(
+            sys.getsizeof(value) for value in item
+        )
+        sort_size = sys.getsizeof(item.get_key()) + \
+            sys.getsizeof(object()) + 2 * 8
+        return item_size + sort_size
 
 
 class Command(CalAccessCommand):
     help = "Load refined CAL-ACCESS campaign filing summaries"
+    option_list = CalAccessCommand.option_list + custom_options
+    outheaders = (
+        "filing_id_raw",
+        "amend_id",
+        "itemized_monetary_contributions",
+        "unitemized_monetary_contributions",
+        "total_monetary_contributions",
+        "non_monetary_contributions",
+        "total_contributions",
+        "itemized_expenditures",
+        "unitemized_expenditures",
+        "total_expenditures",
+        "ending_cash_balance",
+        "outstanding_debts"
+    )
+    # The summary field each raw form and line item is reported in
+    form2field = {
+        # F460
+        'A-1': 'itemized_monetary_contributions',
+        'A-2': 'unitemized_monetary_contributions',
+        'A-3': 'total_monetary_contributions',
+        'F460-4': 'non_monetary_contributions',
+        'F460-5': 'total_contributions',
+        'E-1': 'itemized_expenditures',
+        'E-2': 'unitemized_expenditures',
+        'E-4': 'total_expenditures',
+        'F460-16': 'ending_cash_balance',
+        'F460-19': 'outstanding_debts',
+        # F450
+        'F450-7': 'total_monetary_contributions',
+        'F450-8': 'non_monetary_contributions',
+        'F450-10': 'total_contributions',
+        'F450-1': 'itemized_expenditures',
+        'F450-2': 'unitemized_expenditures',
+        'E-6': 'total_expenditures',
+    }
 
     def handle(self, *args, **options):
         self.header("Loading summary totals")
+        self.incremental = options.get('incremental', False)
+        self.from_tsv = options.get('from_tsv', False)
+        self.in_database = options.get('in_database', False)
+        self.changed_only = options.get('changed_only', False)
+        self.cycle = options.get('cycle')
+        self.max_memory = options.get('max_memory') or 256
         self.data_dir = get_download_directory()
         self.source_csv = os.path.join(self.data_dir, 'csv', 'smry_cd.csv')
+        self.source_tsv = os.path.join(self.data_dir, 'tsv', 'SMRY_CD.TSV')
         self.target_csv = os.path.join(
             self.data_dir,
             'csv',
             'smry_cd_transformed.csv'
         )
+        if (self.incremental or self.cycle) and self.from_tsv:
+            raise CommandError(
+                "New summaries and those of a cycle are found in the raw \
+SMRY_CD table and can't be read from the TSV file"
+            )
+        if self.cycle and self.incremental:
+            raise CommandError(
+                "A cycle is reloaded in full and can't be loaded incrementally"
+            )
+        # The mark covers every cycle, so a single cycle leaves it alone
+        if self.cycle or self.changed_only:
+            if self.cycle:
+                self.delete_cycle(Summary)
+            if self.changed_only:
+                self.delete_changed(Summary)
+            self.pivot_in_database()
+            self.link_summaries()
+            return
+        # Only the new filings are pivoted, rather than regrouping
+        # every line item in the CSV
+        if self.in_database or self.incremental:
+            self.pivot_in_database()
+            self.link_summaries()
+            HighWaterMark.objects.update_mark('SMRY_CD')
+            return
         self.transform_csv()
         self.load_csv()
+        self.link_summaries()
+        # The raw table isn't loaded when reading the TSV
+        if not self.from_tsv:
+            HighWaterMark.objects.update_mark('SMRY_CD')
 
     def load_csv(self):
         self.log(" Loading transformed CSV")
         # Ignore MySQL warnings so this can be run with DEBUG=True
-        warnings.filterwarnings("ignore", category=MySQLdb.Warning)
-        c = connection.cursor()
-        sql = """
-            LOAD DATA LOCAL INFILE '%s'
-            INTO TABLE %s
-            FIELDS TERMINATED BY ','
-            OPTIONALLY ENCLOSED BY '"'
-            LINES TERMINATED BY '\\r\\n'
-            IGNORE 1 LINES (
-                filing_id_raw,
-                amend_id,
-                itemized_monetary_contributions,
-                unitemized_monetary_contributions,
-                total_monetary_contributions,
-                non_monetary_contributions,
-                total_contributions,
-                itemized_expenditures,
-                unitemized_expenditures,
-                total_expenditures,
-                ending_cash_balance,
-                outstanding_debts
+        self.backend.ignore_warnings()
+        self.backend.load_csv(
+            self.get_cursor(),
+            Summary._meta.db_table,
+            self.target_csv,
+            self.outheaders,
+            line_terminator='\\r\\n'
+        )
+
+    def get_pivot_sql(self, alias="r"):
+        """
+        Returns the select list of a grouped query that pivots the line items
+        of each filing into summary fields, the condition that picks the
+        line items it needs and an expression naming the field of each one.
+
+        When a filing reports a field more than once the last line item in
+        the raw table is kept, the same as when the CSV is regrouped.
+        """
+        field_lines = SortedDict((f, []) for f in self.outheaders[2:])
+        for formkey, field in sorted(self.form2field.items()):
+            form_type, line_item = formkey.rsplit('-', 1)
+            field_lines[field].append(
+                "(%s.`FORM_TYPE` = '%s' AND %s.`LINE_ITEM` = '%s')" % (
+                    alias,
+                    form_type,
+                    alias,
+                    line_item
+                )
+            )
+        columns = [
+            "MAX(CASE WHEN %s THEN %s.`AMOUNT_A` END) as `%s`" % (
+                " OR ".join(lines),
+                alias,
+                field
             )
-        """ % (self.target_csv, Summary._meta.db_table)
-        c.execute(sql)
+            for field, lines in field_lines.items()
+        ]
+        condition = " OR ".join(
+            line for lines in field_lines.values() for line in lines
+        )
+        field_sql = "CASE %s END" % " ".join(
+            "WHEN %s THEN '%s'" % (" OR ".join(lines), field)
+            for field, lines in field_lines.items()
+        )
+        return ",\n".join(columns), condition, field_sql
+
+    def pivot_in_database(self):
+        """
+        Loads the summaries with one grouped query, so nothing is held in
+        memory however many filings there are.
+        """
+        self.log(" Pivoting line items in the database")
+        columns = self.get_pivot_sql()[0]
+        condition, field_sql = self.get_pivot_sql("l")[1:]
+        if self.cycle or self.changed_only:
+            delta = self.get_raw_filter_sql("l")
+        elif self.incremental:
+            delta = HighWaterMark.objects.get_delta_sql(
+                'SMRY_CD',
+                Summary._meta.db_table,
+                alias='l'
+            )
+        else:
+            delta = "true"
+        # Only the last line item of each field is pivoted
+        sql = """
+            INSERT INTO %(summary_table)s (%(fields)s)
+            SELECT
+                r.`FILING_ID`,
+                r.`AMEND_ID`,
+                %(columns)s
+            FROM `SMRY_CD` as r
+            INNER JOIN (
+                SELECT MAX(l.`id`) as `id`
+                FROM `SMRY_CD` as l
+                WHERE (%(condition)s)
+                AND %(delta)s
+                GROUP BY l.`FILING_ID`, l.`AMEND_ID`, %(field)s
+            ) as last_item
+            ON r.`id` = last_item.`id`
+            GROUP BY r.`FILING_ID`, r.`AMEND_ID`
+        """ % dict(
+            summary_table=Summary._meta.db_table,
+            fields=", ".join(self.outheaders),
+            columns=columns,
+            condition=condition,
+            field=field_sql,
+            delta=delta,
+        )
+        self.get_cursor().execute(sql)
 
     def transform_csv(self):
+        """
+        Regroups the line items of each filing into a summary row.
+
+        Line items are sorted on disk by filing and amendment, so only
+        one filing's summary is being filled in at a time. Ties keep their
+        order in the file, so the last amount reported for a field wins.
+        """
         self.log(" Transforming source CSV")
-        grouped = {}
-        form2field = {
-            # F460
-            'A-1': 'itemized_monetary_contributions',
-            'A-2': 'unitemized_monetary_contributions',
-            'A-3': 'total_monetary_contributions',
-            'F460-4': 'non_monetary_contributions',
-            'F460-5': 'total_contributions',
-            'E-1': 'itemized_expenditures',
-            'E-2': 'unitemized_expenditures',
-            'E-4': 'total_expenditures',
-            'F460-16': 'ending_cash_balance',
-            'F460-19': 'outstanding_debts',
-            # F450
-            'F450-7': 'total_monetary_contributions',
-            'F450-8': 'non_monetary_contributions',
-            'F450-10': 'total_contributions',
-            'F450-1': 'itemized_expenditures',
-            'F450-2': 'unitemized_expenditures',
-            'E-6': 'total_expenditures',
-        }
-        self.log("  Regrouping")
-        for r in csv.DictReader(open(self.source_csv, 'rb')):
-            uid = "%s-%s" % (r['FILING_ID'], r['AMEND_ID'])
+        self.log("  Sorting line items")
+        run_size = max(
+            self.max_memory * 1024 * 1024 // LineItem.get_size(),
+            1000
+        )
+        line_items = external_sort(
+            self.get_line_items(),
+            key=LineItem.get_key,
+            run_size=run_size,
+            load=LineItem.load
+        )
+        self.log("  Writing to filesystem")
+        out = csv.writer(open(self.target_csv, "wb"))
+        out.writerow(self.outheaders)
+        for row in self.group_line_items(line_items):
+            out.writerow(row)
+
+    def get_line_items(self):
+        """
+        Yields the raw line items that map to a summary field.
+        """
+        if self.from_tsv:
+            reader = RawFile(self.source_tsv).iterdicts()
+        else:
+            reader = csv.DictReader(open(self.source_csv, 'rb'))
+        field_index = dict(
+            (field, i) for i, field in enumerate(self.outheaders[2:])
+        )
+        for line, r in enumerate(reader):
             formkey = "%s-%s" % (r['FORM_TYPE'], r['LINE_ITEM'])
             try:
-                field = form2field[formkey]
+                field = field_index[self.form2field[formkey]]
             except KeyError:
                 continue
-            try:
-                grouped[uid][field] = self.safeamt(r['AMOUNT_A'])
-            except KeyError:
-                grouped[uid] = SortedDict((
-                    ("itemized_monetary_contributions", "\N"),
-                    ("unitemized_monetary_contributions", "\N"),
-                    ("total_monetary_contributions", "\N"),
-                    ("non_monetary_contributions", "\N"),
-                    ("total_contributions", "\N"),
-                    ("itemized_expenditures", "\N"),
-                    ("unitemized_expenditures", "\N"),
-                    ("total_expenditures", "\N"),
-                    ("ending_cash_balance", "\N"),
-                    ("outstanding_debts", "\N")
-                ))
-                grouped[uid][field] = self.safeamt(r['AMOUNT_A'])
-        self.log("  Writing to filesystem")
-        out = csv.writer(open(self.target_csv, "wb"))
-        outheaders = (
-            "filing_id_raw",
-            "amend_id",
-            "itemized_monetary_contributions",
-            "unitemized_monetary_contributions",
-            "total_monetary_contributions",
-            "non_monetary_contributions",
-            "total_contributions",
-            "itemized_expenditures",
-            "unitemized_expenditures",
-            "total_expenditures",
-            "ending_cash_balance",
-            "outstanding_debts"
-        )
-        out.writerow(outheaders)
-        for uid, data in grouped.items():
-            outrow = uid.split("-") + data.values()
-            out.writerow(outrow)
+            if not (r['FILING_ID'].isdigit() and r['AMEND_ID'].isdigit()):
+                continue
+            yield LineItem(
+                int(r['FILING_ID']),
+                int(r['AMEND_ID']),
+                line,
+                field,
+                self.safeamt(r['AMOUNT_A'])
+            )
+
+    def group_line_items(self, line_items):
+        """
+        Yields a summary row each time the sorted line items move on to
+        a new filing or amendment.
+
+        """
+        field_count = len(self.outheaders) - 2
+        uid = None
+        amounts = None
+        for item in line_items:
+            if (item.filing_id, item.amend_id) != uid:
+                if uid:
+                    yield list(uid) + amounts
+                uid = (item.filing_id, item.amend_id)
+                amounts = ["\N"] * field_count
+            amounts[item.field] = item.amount
+        if uid:
+            yield list(uid) + amounts
 
     def safeamt(self, num):
         if not num:
@@ -0,0 +1,46 @@
+from django.core.management.base import CommandError
+from calaccess_campaign_browser.models import (
+    Cycle,
+    Filing,
+    Contribution,
+    Expenditure
+)
+from calaccess_campaign_browser.management.commands import CalAccessCommand
+
+
+class Command(CalAccessCommand):
+    help = "Partition the largest CAL-ACCESS campaign browser tables by cycle"
+    model_list = [
+        Filing,
+        Contribution,
+        Expenditure,
+    ]
+
+    def handle(self, *args, **options):
+        """
+        Gives each election cycle its own partition, so one cycle can be
+        emptied and reloaded with the --cycle option of the loaders without
+        touching the others.
+
+        Run it again after new cycles are loaded to give them partitions.
+        """
+        self.header("Partitioning tables by cycle")
+        self.backend.ignore_warnings()
+        cycle_list = list(Cycle.objects.values_list('name', flat=True))
+        if not cycle_list:
+            raise CommandError("Load the cycles before partitioning by them")
+        c = self.get_cursor()
+        for m in self.model_list:
+            new_list = self.backend.partition_by_cycle(
+                c,
+                m._meta.db_table,
+                cycle_list
+            )
+            if new_list:
+                self.log(" %s: %s" % (
+                    m.__name__,
+                    ", ".join(str(cycle) for cycle in new_list)
+                ))
+            else:
+                self.log(" %s: up to date" % m.__name__)
+        self.success("Done!")
@@ -0,0 +1,183 @@
+from optparse import make_option
+from django.core.management import call_command
+from calaccess_raw.models import RcptCd, S497Cd, SmryCd, ExpnCd
+from calaccess_campaign_browser.models import Filing
+from calaccess_campaign_browser.management.commands import CalAccessCommand
+
+
+custom_options = (
+    make_option(
+        "--record-only",
+        action="store_true",
+        dest="record_only",
+        default=False,
+        help="Store the hashes of the loaded filings without reloading any"
+    ),
+)
+
+
+class Command(CalAccessCommand):
+    help = "Reload the summaries, contributions and expenditures of filings \
+whose raw records changed"
+    option_list = CalAccessCommand.option_list + custom_options
+    raw_model_list = [RcptCd, S497Cd, SmryCd, ExpnCd]
+    hash_table = "tmp_filing_hashes"
+    changed_table = "tmp_changed_filings"
+
+    def handle(self, *args, **options):
+        """
+        Compares a hash of each filing's raw records with the one stored
+        by the last load, and rewrites only the filings that don't match.
+
+        Filings that haven't been hashed yet count as changed, so
+        --record-only should be run once after a full build.
+        """
+        self.header("Refreshing changed filings")
+        self.backend.ignore_warnings()
+        self.cursor = self.get_cursor()
+
+        self.hash_filings()
+        changed = self.find_changed()
+        self.log(" %s of %s filings changed" % (
+            changed,
+            Filing.objects.count()
+        ))
+        if changed and not options.get('record_only'):
+            self.clear_changed()
+            call_command("loadcalaccesscampaignsummaries", changed_only=True)
+            call_command(
+                "loadcalaccesscampaigncontributions",
+                changed_only=True
+            )
+            call_command(
+                "loadcalaccesscampaignexpenditures",
+                changed_only=True
+            )
+        self.store_hashes()
+
+        self.cursor.execute("DROP TABLE %s" % self.changed_table)
+        self.cursor.execute("DROP TABLE %s" % self.hash_table)
+        self.success("Done!")
+
+    def get_columns(self, model):
+        return [f.column for f in model._meta.fields if f.column != 'id']
+
+    def hash_filings(self):
+        """
+        Hashes the raw records of every loaded filing, with one grouped
+        scan of each raw table.
+        """
+        self.log(" Hashing raw records")
+        join_list = []
+        hash_list = []
+        for model in self.raw_model_list:
+            table = "tmp_%s_hashes" % model._meta.db_table.lower()
+            self.cursor.execute("DROP TABLE IF EXISTS %s" % table)
+            sql = """
+                SELECT
+                    r.`FILING_ID`,
+                    r.`AMEND_ID`,
+                    %(hash)s as `content_hash`
+                FROM `%(raw_model)s` as r
+                GROUP BY 1, 2
+            """ % dict(
+                hash=self.backend.get_hash_sql(self.get_columns(model)),
+                raw_model=model._meta.db_table,
+            )
+            self.backend.create_table_as(
+                self.cursor,
+                table,
+                sql,
+                index_list=[("FILING_ID", "AMEND_ID")]
+            )
+            join_list.append("""LEFT OUTER JOIN %(table)s
+            ON f.`filing_id_raw` = %(table)s.`FILING_ID`
+            AND f.`amend_id` = %(table)s.`AMEND_ID`""" % dict(table=table))
+            hash_list.append("COALESCE(%s.`content_hash`, '')" % table)
+
+        self.cursor.execute("DROP TABLE IF EXISTS %s" % self.hash_table)
+        sql = """
+            SELECT
+                f.`id`,
+                f.`filing_id_raw`,
+                MD5(CONCAT_WS('|', %(hashes)s)) as `raw_hash`
+            FROM %(filing_table)s as f
+            %(joins)s
+        """ % dict(
+            hashes=", ".join(hash_list),
+            filing_table=Filing._meta.db_table,
+            joins="\n".join(join_list),
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            self.hash_table,
+            sql,
+            primary_key="id"
+        )
+        for model in self.raw_model_list:
+            self.cursor.execute(
+                "DROP TABLE tmp_%s_hashes" % model._meta.db_table.lower()
+            )
+
+    def find_changed(self):
+        """
+        Collects the FILING_IDs with an amendment whose hash changed, and
+        returns how many filings they cover.
+
+        Every amendment of a changed FILING_ID is reloaded, so duplicates
+        are marked the same way they would be by a full load.
+        """
+        self.cursor.execute("DROP TABLE IF EXISTS %s" % self.changed_table)
+        sql = """
+            SELECT DISTINCT f.`filing_id_raw`
+            FROM %(filing_table)s as f
+            INNER JOIN %(hash_table)s as h
+            ON f.`id` = h.`id`
+            WHERE f.`content_hash` IS NULL
+            OR f.`content_hash` <> h.`raw_hash`
+        """ % dict(
+            filing_table=Filing._meta.db_table,
+            hash_table=self.hash_table,
+        )
+        self.backend.create_table_as(
+            self.cursor,
+            self.changed_table,
+            sql,
+            primary_key="filing_id_raw"
+        )
+        self.cursor.execute("""
+            SELECT COUNT(*)
+            FROM %s as f
+            INNER JOIN %s as c
+            ON f.`filing_id_raw` = c.`filing_id_raw`
+        """ % (Filing._meta.db_table, self.changed_table))
+        return self.cursor.fetchone()[0]
+
+    def clear_changed(self):
+        """
+        Clears the stored hash of every changed filing, which is how the
+        loaders' --changed-only option finds them.
+        """
+        self.backend.update_join(
+            self.cursor,
+            Filing._meta.db_table, "f",
+            self.changed_table, "c",
+            "f.`filing_id_raw` = c.`filing_id_raw`",
+            "content_hash = NULL"
+        )
+
+    def store_hashes(self):
+        """
+        Stores each filing's hash. The hashes are kept under another name
+        until then, since MySQL won't update a column that both tables in
+        the join have without a table name.
+        """
+        self.log(" Storing hashes")
+        self.backend.update_join(
+            self.cursor,
+            Filing._meta.db_table, "f",
+            self.hash_table, "h",
+            "f.`id` = h.`id` AND (f.`content_hash` IS NULL "
+            "OR f.`content_hash` <> h.`raw_hash`)",
+            "content_hash = h.`raw_hash`"
+        )
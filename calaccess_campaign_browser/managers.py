@@ -43,29 +43,14 @@ class RealFilingManager(BaseRealManager):
     def by_committee(self, obj_or_id):
         """
         Returns the "real" or valid filings for a particular committee.
+
+        Those are the filings that aren't duplicates, leaving out the F497
+        late filings that start before the end of the committee's most
+        recent quarterly filing. The rule is applied by the filings loader,
+        which stores it in the ``is_real`` field.
         """
         cmte = self.get_committee(obj_or_id)
-
-        # Filer to only filings by this committee
-        qs = self.get_queryset().filter(committee=cmte)
-
-        # Get most recent end date for quarterly filings
-        try:
-            most_recent_quarterly = qs.filter(
-                form_type__in=['F450', 'F460']
-            ).order_by("-end_date")[0]
-        except (qs.model.DoesNotExist, IndexError):
-            # If there are none, just return everything
-            return qs
-
-        # Exclude all F497 late filings that come before that date
-        qs = qs.exclude(
-            form_type='F497',
-            start_date__lte=most_recent_quarterly.end_date
-        )
-
-        # Retun the result
-        return qs
+        return self.get_queryset().filter(committee=cmte, is_real=True)
 
 
 class RealContributionManager(BaseRealManager):
@@ -77,50 +62,130 @@ class RealContributionManager(BaseRealManager):
         Returns the "real" or valid contributions received by
         a particular committee.
         """
-        from .models import Filing
-
-        # Pull the committee object
         cmte = self.get_committee(obj_or_id)
-
-        # Get a list of the valid filings for this committee
-        filing_list = Filing.real.by_committee(cmte)
-
-        # Filer to only contributions from real filings by this committee
-        qs = self.get_queryset().filter(
-            committee=cmte,
-            filing__in=filing_list
-        )
-
-        # Retun the result
-        return qs
+        return self.get_queryset().filter(committee=cmte, is_real=True)
 
     def by_committee_from(self, obj_or_id):
         """
         Returns the "real" or valid contributions made by
         a particular committee.
         """
-        from .models import Filing
-
-        # Pull the committee object
         cmte = self.get_committee(obj_or_id)
-
-        # Get a list of the valid filings for this committee
-        filing_list = Filing.real.by_committee(cmte)
-
-        # Filer to only contributions from real filings by this committee
-        qs = self.get_queryset().filter(
+        return self.get_queryset().filter(
             contributor_committee=cmte,
-            filing__in=filing_list
+            is_real=True
         )
 
-        # Retun the result
-        return qs
-
 
-class RealExpenditureManager(models.Manager):
+class RealExpenditureManager(BaseRealManager):
     """
     Only returns records that are not duplicates.
     """
-    def get_queryset(self):
-        qs = super(RealExpenditureManager, self).get_queryset()
-        return qs.exclude(dupe=True)
+
+
+class HighWaterMarkManager(models.Manager):
+    """
+    Tracks the latest FILING_ID and AMEND_ID loaded from each raw table.
+    """
+    def get_mark(self, source_table):
+        """
+        Returns the mark for a raw table, or an empty one that lets
+        everything through if the table has never been loaded.
+        """
+        try:
+            return self.get(source_table=source_table)
+        except self.model.DoesNotExist:
+            return self.model(source_table=source_table, filing_id=0)
+
+    def update_mark(self, source_table, filing_id_column='FILING_ID',
+                    amend_id_column='AMEND_ID'):
+        """
+        Records the latest filing currently found in a raw table.
+        """
+        from .utils.backends import get_backend
+        c = get_backend().cursor()
+        sql = """
+            SELECT `%(filing_id)s`, MAX(`%(amend_id)s`)
+            FROM `%(source_table)s`
+            WHERE `%(filing_id)s` = (
+                SELECT MAX(`%(filing_id)s`) FROM `%(source_table)s`
+            )
+            GROUP BY 1
+        """ % dict(
+            source_table=source_table,
+            filing_id=filing_id_column,
+            amend_id=amend_id_column,
+        )
+        c.execute(sql)
+        row = c.fetchone()
+        if not row:
+            return None
+        mark = self.get_mark(source_table)
+        mark.filing_id, mark.amend_id = row
+        mark.save()
+        return mark
+
+    def get_delta_sql(self, source_table, target_table, alias='r',
+                      filing_id_column='FILING_ID',
+                      amend_id_column='AMEND_ID'):
+        """
+        Returns a WHERE condition that matches the raw records that have not
+        yet been loaded into the target table.
+
+        That covers new filings beyond the mark as well as amendments to
+        older filings, which reuse their original FILING_ID. The filing and
+        amendment ids still missing from the target are collected once into
+        a temporary table, so the target is checked once for each amendment
+        rather than once for each of its raw records.
+        """
+        from .utils.backends import get_backend
+        backend = get_backend()
+        c = backend.cursor()
+        mark = self.get_mark(source_table)
+        delta_table = "tmp_delta_%s" % source_table.lower()
+        c.execute("DROP TABLE IF EXISTS %s" % delta_table)
+        sql = """
+            SELECT `filing_id`, `amend_id`
+            FROM (
+                SELECT DISTINCT
+                    `%(filing_id)s` as `filing_id`,
+                    `%(amend_id)s` as `amend_id`
+                FROM `%(source_table)s`
+                WHERE `%(filing_id)s` > %(mark_filing_id)s
+                OR (
+                    `%(filing_id)s` = %(mark_filing_id)s
+                    AND `%(amend_id)s` > %(mark_amend_id)s
+                )
+                OR `%(amend_id)s` > 0
+            ) as raw
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM %(target_table)s as loaded
+                WHERE loaded.`filing_id_raw` = raw.`filing_id`
+                AND loaded.`amend_id` = raw.`amend_id`
+            )
+        """ % dict(
+            source_table=source_table,
+            filing_id=filing_id_column,
+            amend_id=amend_id_column,
+            mark_filing_id=int(mark.filing_id),
+            mark_amend_id=int(mark.amend_id),
+            target_table=target_table,
+        )
+        backend.create_table_as(
+            c,
+            delta_table,
+            sql,
+            index_list=[("filing_id", "amend_id")]
+        )
+        return """EXISTS (
+            SELECT 1
+            FROM %(delta_table)s as delta
+            WHERE delta.`filing_id` = %(alias)s.`%(filing_id)s`
+            AND delta.`amend_id` = %(alias)s.`%(amend_id)s`
+        )""" % dict(
+            alias=alias,
+            filing_id=filing_id_column,
+            amend_id=amend_id_column,
+            delta_table=delta_table,
+        )
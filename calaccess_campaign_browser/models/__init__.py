@@ -1,3 +1,4 @@
+from builds import HighWaterMark, BuildRun, BuildStage, BuildChange
 from contributions import Contribution
 from elections import (
     Election,
@@ -11,6 +12,10 @@ from filers import Filer, Committee
 from filings import Filing, Cycle, FilingPeriod, Summary
 
 __all__ = (
+    'HighWaterMark',
+    'BuildRun',
+    'BuildStage',
+    'BuildChange',
     'Contribution',
     'Election',
     'Candidate',
@@ -0,0 +1,198 @@
+import json
+from django.db import models
+from calaccess_campaign_browser import managers
+from calaccess_campaign_browser.utils.models import BaseModel
+
+
+class HighWaterMark(BaseModel):
+    """
+    The most recent filing loaded from a raw CAL-ACCESS table.
+
+    Used by incremental builds to pick out the records that have been
+    added to the raw data since the last load.
+    """
+    source_table = models.CharField(max_length=50, unique=True)
+    filing_id = models.IntegerField('filing ID', default=0)
+    amend_id = models.IntegerField('amendment', default=0)
+    updated = models.DateTimeField(auto_now=True)
+    objects = managers.HighWaterMarkManager()
+
+    class Meta:
+        ordering = ("source_table",)
+        app_label = 'calaccess_campaign_browser'
+
+    def __unicode__(self):
+        return u'%s: %s-%s' % (
+            self.source_table,
+            self.filing_id,
+            self.amend_id
+        )
+
+
+class BuildRun(BaseModel):
+    """
+    A run of the buildcalaccesscampaignbrowser command.
+    """
+    MODE_CHOICES = (
+        ('full', 'Full'),
+        ('incremental', 'Incremental'),
+        ('shadow', 'Shadow'),
+    )
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    from_files = models.BooleanField(
+        default=False,
+        help_text="Loaded from the raw TSV files instead of the raw tables"
+    )
+    optimize = models.BooleanField(
+        default=False,
+        help_text="Rebuilt fragmented tables when refreshing the statistics"
+    )
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+        ('complete', 'Complete'),
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='running'
+    )
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ("-started",)
+        get_latest_by = "started"
+        app_label = 'calaccess_campaign_browser'
+
+    def __unicode__(self):
+        return u'%s build %s' % (self.get_mode_display(), self.started)
+
+    def get_telemetry(self):
+        """
+        Returns the run and the measurements of each of its stages
+        as a dictionary that can be serialized to JSON.
+        """
+        return dict(
+            mode=self.mode,
+            from_files=self.from_files,
+            optimize=self.optimize,
+            status=self.status,
+            started=self.started.isoformat(),
+            finished=self.finished.isoformat() if self.finished else None,
+            stages=[s.get_telemetry() for s in self.stages.all()],
+        )
+
+
+class BuildStage(BaseModel):
+    """
+    A stage of a build run, recorded so a failed run can be resumed
+    and so its cost can be compared from one build to the next.
+    """
+    build_run = models.ForeignKey('BuildRun', related_name='stages')
+    name = models.CharField(max_length=50)
+    status = models.CharField(
+        max_length=20,
+        choices=BuildRun.STATUS_CHOICES,
+        default='running'
+    )
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    row_counts = models.TextField(
+        blank=True,
+        help_text="JSON object with the rows in each table the stage loads"
+    )
+    duration = models.FloatField(
+        null=True,
+        help_text="Wall clock seconds"
+    )
+    db_time = models.FloatField(
+        'database time',
+        null=True,
+        help_text="Seconds spent waiting on database queries"
+    )
+    rows_in = models.BigIntegerField(
+        null=True,
+        help_text="Rows in the raw tables the stage reads"
+    )
+    rows_out = models.BigIntegerField(
+        null=True,
+        help_text="Rows the stage added to the tables it loads"
+    )
+    peak_rss = models.BigIntegerField(
+        'peak RSS',
+        null=True,
+        help_text="Most memory the build process held while the stage ran, \
+in bytes"
+    )
+
+    class Meta:
+        ordering = ("build_run", "started")
+        unique_together = (("build_run", "name"),)
+        app_label = 'calaccess_campaign_browser'
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.name, self.get_status_display())
+
+    @property
+    def row_count_dict(self):
+        if not self.row_counts:
+            return {}
+        return json.loads(self.row_counts)
+
+    def get_telemetry(self):
+        return dict(
+            name=self.name,
+            status=self.status,
+            duration=self.duration,
+            db_time=self.db_time,
+            rows_in=self.rows_in,
+            rows_out=self.rows_out,
+            peak_rss=self.peak_rss,
+            row_counts=self.row_count_dict,
+        )
+
+
+class BuildChange(BaseModel):
+    """
+    A filing or contribution that a build added, amended or superseded,
+    compared with the generation of tables before it.
+    """
+    build_run = models.ForeignKey('BuildRun', related_name='changes')
+    MODEL_CHOICES = (
+        ('Filing', 'Filing'),
+        ('Contribution', 'Contribution'),
+    )
+    model_name = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    CHANGE_CHOICES = (
+        ('new', 'New'),
+        ('amended', 'Amended'),
+        ('superseded', 'Superseded'),
+    )
+    change_type = models.CharField(
+        max_length=20,
+        choices=CHANGE_CHOICES,
+        help_text="New records weren't reported before, amended ones are \
+a new amendment of a record that was, and superseded ones are no longer the \
+latest amendment"
+    )
+    filing_id_raw = models.IntegerField('filing ID')
+    amend_id = models.IntegerField('amendment')
+    transaction_id = models.CharField(
+        'transaction ID',
+        max_length=20,
+        blank=True,
+        help_text="Blank for filings"
+    )
+
+    class Meta:
+        ordering = ("build_run", "model_name", "filing_id_raw", "amend_id")
+        app_label = 'calaccess_campaign_browser'
+
+    def __unicode__(self):
+        return u'%s %s %s-%s' % (
+            self.get_change_type_display(),
+            self.model_name,
+            self.filing_id_raw,
+            self.amend_id,
+        )
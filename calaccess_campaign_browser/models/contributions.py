@@ -15,6 +15,15 @@ class Contribution(BaseModel):
     )
     filing = models.ForeignKey('Filing')
 
+    # Copied from the filing, its committee and the committee's filer when
+    # the record is loaded, so lists and exports don't need to join them
+    committee_name = models.CharField(max_length=255, blank=True)
+    committee_filer_id_raw = models.IntegerField(null=True)
+    filer_name = models.CharField(max_length=255, blank=True)
+    filer_id_raw = models.IntegerField(null=True)
+    filing_start_date = models.DateField(null=True)
+    filing_end_date = models.DateField(null=True)
+
     # CAL-ACCESS ids
     filing_id_raw = models.IntegerField(db_index=True)
     transaction_id = models.CharField(
@@ -33,6 +42,11 @@ class Contribution(BaseModel):
 
     # Basics about the contrib
     is_duplicate = models.BooleanField(default=False)
+    is_real = models.BooleanField(
+        default=False,
+        db_index=True,
+        help_text="Not a duplicate, and reported in a real filing"
+    )
     transaction_type = models.CharField(max_length=1, blank=True)
     date_received = models.DateField(null=True)
     contribution_description = models.CharField(max_length=90, blank=True)
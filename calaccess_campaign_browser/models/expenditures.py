@@ -41,6 +41,20 @@ class Expenditure(BaseModel):
     committee = models.ForeignKey('Committee')
     filing = models.ForeignKey('Filing')
 
+    # Copied from the filing, its committee and the committee's filer when
+    # the record is loaded, so lists and exports don't need to join them
+    committee_name = models.CharField(max_length=255, blank=True)
+    committee_filer_id_raw = models.IntegerField(null=True)
+    filer_name = models.CharField(max_length=255, blank=True)
+    filer_id_raw = models.IntegerField(null=True)
+    filing_start_date = models.DateField(null=True)
+    filing_end_date = models.DateField(null=True)
+
+    # CAL-ACCESS ids
+    filing_id_raw = models.IntegerField(db_index=True)
+    amend_id = models.IntegerField('amendment', db_index=True)
+    is_duplicate = models.BooleanField(default=False)
+
     # Raw data fields
     amount = models.DecimalField(max_digits=16, decimal_places=2)
     bakref_tid = models.CharField(max_length=50L, blank=True)
@@ -84,7 +98,6 @@ class Expenditure(BaseModel):
     org_id = models.IntegerField(null=True)
     individual_id = models.IntegerField(null=True)
 
-    dupe = models.BooleanField(default=False)
     objects = models.Manager()
     real = managers.RealExpenditureManager()
 
@@ -100,7 +113,7 @@ class Expenditure(BaseModel):
         from calaccess_raw.models import ExpnCd
         return ExpnCd.objects.get(
             amend_id=self.amend_id,
-            filing_id=self.filing_id,
+            filing_id=self.filing_id_raw,
             tran_id=self.tran_id,
             bakref_tid=self.bakref_tid
         )
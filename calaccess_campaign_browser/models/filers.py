@@ -84,7 +84,10 @@ class Filer(AllCapsNameMixin):
 
     @property
     def total_contributions(self):
-        summaries = [f.summary for f in self.real_filings]
+        summaries = [
+            f.get_summary()
+            for f in self.real_filings.select_related("linked_summary")
+        ]
         summaries = [s for s in summaries if s]
         return sum([
             s.total_contributions for s in summaries if s.total_contributions
@@ -188,7 +191,10 @@ class Committee(AllCapsNameMixin):
 
     @property
     def real_filings(self):
-        return Filing.real.by_committee(self).select_related("cycle")
+        return Filing.real.by_committee(self).select_related(
+            "cycle",
+            "linked_summary"
+        )
 
     @property
     def total_contributions(self):
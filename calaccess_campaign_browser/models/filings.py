@@ -67,6 +67,19 @@ class Filing(models.Model):
         db_index=True,
         help_text="A record that has either been superceded by an amendment \
 or was filed unnecessarily. Should be excluded from most analysis."
+    )
+    is_real = models.BooleanField(
+        default=False,
+        db_index=True,
+        help_text="A record that counts toward its committee's totals. It \
+isn't a duplicate, and isn't a late filing covered by a later quarterly one."
+    )
+    content_hash = models.CharField(
+        max_length=32,
+        null=True,
+        db_index=True,
+        help_text="A hash of the raw records reported in the filing, used to \
+find the filings that changed since the last load."
     )
     objects = models.Manager()
     real = managers.RealFilingManager()
@@ -83,7 +96,7 @@ or was filed unnecessarily. Should be excluded from most analysis."
 
     def to_json(self):
         js = json.loads(jsonify(self))
-        s = self.summary or {}
+        s = self.get_summary() or {}
         if s:
             s = json.loads(jsonify(s))
         js['summary'] = s
@@ -101,16 +114,19 @@ or was filed unnecessarily. Should be excluded from most analysis."
         return self.committee.short_name
     committee_short_name.short_description = "committee"
 
-    @property
-    def summary(self):
+    def get_summary(self):
+        """
+        Returns the summary linked to this filing, or None if it has none.
+        """
         try:
-            return Summary.objects.get(
-                filing_id_raw=self.filing_id_raw,
-                amend_id=self.amend_id
-            )
+            return self.linked_summary
         except Summary.DoesNotExist:
             return None
 
+    @property
+    def summary(self):
+        return self.get_summary()
+
     @property
     def is_amendment(self):
         return self.amend_id > 0
@@ -126,7 +142,7 @@ or was filed unnecessarily. Should be excluded from most analysis."
     @property
     def total_contributions(self):
         if self.is_quarterly:
-            summary = self.summary
+            summary = self.get_summary()
             if summary:
                 return summary.total_contributions
             else:
@@ -139,7 +155,7 @@ or was filed unnecessarily. Should be excluded from most analysis."
     @property
     def total_expenditures(self):
         if self.is_quarterly:
-            summary = self.summary
+            summary = self.get_summary()
             if summary:
                 return summary.total_expenditures
             else:
@@ -154,6 +170,14 @@ class Summary(BaseModel):
     """
     A set of summary totals provided by a filing's cover sheet.
     """
+    filing = models.OneToOneField(
+        'Filing',
+        null=True,
+        related_name='linked_summary',
+        db_constraint=False,
+        help_text="Linked by the loader, which matches the filing ID and \
+amendment"
+    )
     filing_id_raw = models.IntegerField(db_index=True)
     amend_id = models.IntegerField(db_index=True)
     itemized_monetary_contributions = models.DecimalField(
@@ -237,13 +261,3 @@ class Summary(BaseModel):
             return self.filing.committee
         except:
             return None
-
-    @property
-    def filing(self):
-        try:
-            return Filing.objects.get(
-                filing_id_raw=self.filing_id_raw,
-                amend_id=self.amend_id
-            )
-        except Filing.DoesNotExist:
-            return None
@@ -1,6 +1,37 @@
-from datetime import datetime
-from django.test import TestCase
+import os
+import csv
+import time
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import skipUnless
+from datetime import date, datetime
+from django.test import TestCase, TransactionTestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from calaccess_campaign_browser import models
+from calaccess_campaign_browser.utils import duplicates, streaming
+from calaccess_campaign_browser.utils.shadow import ShadowTables
+from calaccess_campaign_browser.utils.indexes import DeferredIndexes
+from calaccess_campaign_browser.utils.explain import ExplainCursor
+from calaccess_campaign_browser.utils import backends
+from calaccess_campaign_browser.utils.staging import StagingTables
+from calaccess_campaign_browser.utils.changes import BuildChanges
+from calaccess_campaign_browser.utils.models import clean_all_caps_name
+from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+from calaccess_campaign_browser.management.commands import (
+    CalAccessCommand,
+    buildcalaccesscampaignbrowser,
+    loadcalaccesscampaignsummaries
+)
+from calaccess_campaign_browser.utils.pipeline import (
+    Stage,
+    Pipeline,
+    CheckpointPipeline,
+    MemoryMonitor,
+    get_rss
+)
 
 
 class ModelTest(TestCase):
@@ -51,6 +82,20 @@ class ModelTest(TestCase):
             effective_date=filer.effective_date,
         )
         committee.__unicode__()
+        self.assertEqual(committee.clean_name, 'Nixon for Governor')
+
+    def test_clean_name(self):
+        self.assertEqual(
+            clean_all_caps_name(
+                'CALIFORNIANS FOR A. D. SMITH POLITICAL ACTION COMMITTEE'
+            ),
+            'Californians for A.D. Smith PAC'
+        )
+        self.assertEqual(
+            clean_all_caps_name('CBPA-PAC TO RE-ELECT USAF AKA PACIFIC'),
+            'CBPA-PAC to Re-elect USAF AKA Pacific'
+        )
+        self.assertEqual(clean_all_caps_name(None), '')
 
     def test_cycle(self):
         pass
@@ -62,7 +107,77 @@ class ModelTest(TestCase):
         pass
 
     def test_summary(self):
-        pass
+        filer = models.Filer.objects.create(
+            name="FooPAC",
+            filer_id_raw=1,
+            xref_filer_id=1,
+            filer_type="pac",
+            effective_date=datetime.now()
+        )
+        filing = models.Filing.objects.create(
+            cycle=models.Cycle.objects.create(name=2014),
+            committee=models.Committee.objects.create(
+                name="FooPAC",
+                filer=filer,
+                filer_id_raw=1,
+                xref_filer_id=1,
+                committee_type="pac",
+                effective_date=datetime.now()
+            ),
+            filing_id_raw=1,
+            amend_id=0,
+            form_type="F460"
+        )
+        self.assertEqual(filing.get_summary(), None)
+        summary = models.Summary.objects.create(
+            filing=filing,
+            filing_id_raw=1,
+            amend_id=0,
+            total_contributions=100
+        )
+        filing = models.Filing.objects.select_related("linked_summary").get()
+        with self.assertNumQueries(0):
+            self.assertEqual(filing.get_summary(), summary)
+            self.assertEqual(filing.summary, summary)
+            self.assertEqual(filing.total_contributions, 100)
+        # A filing without a summary still has None for it
+        summary.delete()
+        filing = models.Filing.objects.get()
+        self.assertEqual(filing.summary, None)
+        self.assertEqual(summary.cycle.name, 2014)
+
+    def test_real_filings(self):
+        filer = models.Filer.objects.create(
+            name="FooPAC",
+            filer_id_raw=1,
+            xref_filer_id=1,
+            filer_type="pac",
+            effective_date=datetime.now()
+        )
+        committee = models.Committee.objects.create(
+            name="FooPAC",
+            filer=filer,
+            filer_id_raw=1,
+            xref_filer_id=1,
+            committee_type="pac",
+            effective_date=datetime.now()
+        )
+        cycle = models.Cycle.objects.create(name=2014)
+        for filing_id_raw, is_real in [(1, True), (2, False)]:
+            models.Filing.objects.create(
+                cycle=cycle,
+                committee=committee,
+                filing_id_raw=filing_id_raw,
+                amend_id=0,
+                form_type="F497",
+                is_real=is_real
+            )
+        qs = models.Filing.real.by_committee(committee)
+        self.assertEqual([f.filing_id_raw for f in qs], [1])
+        self.assertEqual(
+            models.Contribution.real.by_committee_to(committee).count(),
+            0
+        )
 
     def test_contribution(self):
         pass
@@ -78,3 +193,1363 @@ class ModelTest(TestCase):
 
     def test_propositionfiler(self):
         pass
+
+
+class DuplicatesTest(TestCase):
+    """
+    Mark duplicates in a sorted raw dump and compare against the original
+    single-pass transformation.
+    """
+    headers = ["FILING_ID", "AMEND_ID", "TRAN_ID", "AMOUNT"]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_csv = os.path.join(self.tmp_dir, 'dump.csv')
+        with open(self.source_csv, 'wb') as f:
+            for filing_id in range(1, 40):
+                for tran_id in range(filing_id % 4):
+                    for amend_id in reversed(range(filing_id % 3 + 1)):
+                        f.write('"%s","%s","T%s","1.00"\n' % (
+                            filing_id,
+                            amend_id,
+                            tran_id
+                        ))
+            f.write('"40","0","T0","multi\\\nline"\n')
+            f.write('"40","0","T0","2.00","extra"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def transform_serially(self, target_csv):
+        fout = csv.DictWriter(
+            open(target_csv, 'wb'),
+            fieldnames=self.headers + ["IS_DUPLICATE"]
+        )
+        fout.writeheader()
+        last_uid = ''
+        for r in csv.DictReader(
+            open(self.source_csv, 'r'),
+            fieldnames=self.headers
+        ):
+            r.pop(None, None)
+            uid = '%s-%s' % (r['FILING_ID'], r['TRAN_ID'])
+            if uid != last_uid:
+                r['IS_DUPLICATE'] = 0
+                last_uid = uid
+            else:
+                r['IS_DUPLICATE'] = 1
+            fout.writerow(r)
+
+    def test_chunk_offsets(self):
+        offsets = duplicates.find_chunk_offsets(self.source_csv, 7)
+        self.assertEqual(offsets[0][0], 0)
+        self.assertEqual(offsets[-1][1], os.path.getsize(self.source_csv))
+        for (start, end), (next_start, next_end) in zip(offsets, offsets[1:]):
+            self.assertEqual(end, next_start)
+
+    def test_mark_duplicates_csv(self):
+        expected_csv = os.path.join(self.tmp_dir, 'expected.csv')
+        self.transform_serially(expected_csv)
+        # More than one process runs the chunks in a pool of workers
+        for processes, chunk_count in [
+            (1, 1), (1, 3), (1, 7), (1, 100), (2, None), (3, 7)
+        ]:
+            target_csv = os.path.join(self.tmp_dir, 'target.csv')
+            duplicates.mark_duplicates_csv(
+                self.source_csv,
+                target_csv,
+                self.headers,
+                processes=processes,
+                chunk_count=chunk_count
+            )
+            self.assertEqual(
+                open(target_csv, 'rb').read(),
+                open(expected_csv, 'rb').read()
+            )
+
+
+class StreamingTest(TestCase):
+    """
+    Read, sort and deduplicate raw TSV rows without loading them first.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_tsv = os.path.join(self.tmp_dir, 'RCPT_CD.TSV')
+        with open(self.source_tsv, 'wb') as f:
+            f.write("FILING_ID\tAMEND_ID\tTRAN_ID\tRCPT_DATE\r\n")
+            f.write("2\t0\tT1\t5/2/2012 12:00:00 AM\r\n")
+            f.write("1\t0\tT1\t\r\n")
+            f.write("2\t1\tT1\t5/3/2012 12:00:00 AM\textra\r\n")
+            f.write("1\t0\tT2\r\n")
+            f.write("2\t0\tT2\t5/2/2012 12:00:00 AM\r\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_raw_file(self):
+        raw = streaming.RawFile(self.source_tsv)
+        self.assertEqual(raw.index['TRAN_ID'], 2)
+        row_list = list(raw)
+        self.assertEqual(row_list[2], ["2", "1", "T1", "5/3/2012 12:00:00 AM"])
+        self.assertEqual(row_list[3], ["1", "0", "T2", ""])
+        self.assertEqual(streaming.to_date(row_list[0][3]), "2012-05-02")
+        self.assertEqual(streaming.to_date(row_list[1][3]), "\\N")
+
+    def test_dedupe(self):
+        raw = streaming.RawFile(self.source_tsv)
+
+        def key(r):
+            return (int(r[0]), r[2], -int(r[1]))
+        # Runs of two rows force a merge of several sorted files
+        row_list = list(streaming.external_sort(raw, key, run_size=2))
+        self.assertEqual(row_list, sorted(raw, key=key))
+        marked = [
+            (r[0], r[1], r[2], is_duplicate)
+            for r, is_duplicate in streaming.mark_latest(
+                row_list,
+                key=lambda r: (r[0], r[2])
+            )
+        ]
+        self.assertEqual(marked, [
+            ("1", "0", "T1", False),
+            ("1", "0", "T2", False),
+            ("2", "1", "T1", False),
+            ("2", "0", "T1", True),
+            ("2", "0", "T2", False),
+        ])
+
+    def test_load(self):
+        row_list = [(i % 7, "x%s" % i) for i in range(20)]
+        sorted_list = list(streaming.external_sort(
+            row_list,
+            key=lambda r: (r[0], r[1]),
+            run_size=3,
+            load=lambda r: (int(r[0]), r[1])
+        ))
+        self.assertEqual(sorted_list, sorted(row_list))
+
+    def test_stable(self):
+        # Rows with the same key are merged in the order they were read,
+        # not by comparing the rest of the row
+        row_list = [(i % 3, "x%s" % (20 - i)) for i in range(20)]
+        sorted_list = list(streaming.external_sort(
+            row_list,
+            key=lambda r: r[0],
+            run_size=3,
+            load=lambda r: (int(r[0]), r[1])
+        ))
+        self.assertEqual(sorted_list, sorted(row_list, key=lambda r: r[0]))
+
+    def test_group_line_items(self):
+        LineItem = loadcalaccesscampaignsummaries.LineItem
+        command = loadcalaccesscampaignsummaries.Command()
+        item_list = [
+            LineItem(i % 5, i % 2, i, i % 10, "%s.00" % i)
+            for i in range(40)
+        ]
+        in_memory = list(command.group_line_items(
+            sorted(item_list, key=LineItem.get_key)
+        ))
+        # Runs of three line items force a merge of several sorted files
+        spilled = list(command.group_line_items(streaming.external_sort(
+            item_list,
+            key=LineItem.get_key,
+            run_size=3,
+            load=LineItem.load
+        )))
+        self.assertEqual(len(in_memory), 10)
+        self.assertEqual(spilled, in_memory)
+
+    def test_last_line_item_wins(self):
+        LineItem = loadcalaccesscampaignsummaries.LineItem
+        command = loadcalaccesscampaignsummaries.Command()
+        # A line item reported twice keeps the amount that comes last,
+        # even when it is smaller
+        item_list = [
+            LineItem(1, 0, 0, 0, "120.00"),
+            LineItem(1, 0, 1, 1, "50.00"),
+            LineItem(1, 0, 2, 0, "100.00"),
+        ]
+        row_list = list(command.group_line_items(
+            sorted(item_list, key=LineItem.get_key)
+        ))
+        self.assertEqual(row_list, [
+            [1, 0, "100.00", "50.00"] + ["\N"] * 8
+        ])
+
+
+class HighWaterMarkTest(TestCase):
+    """
+    Check the marks used by incremental loads.
+    """
+    def test_get_mark(self):
+        mark = models.HighWaterMark.objects.get_mark('RCPT_CD')
+        self.assertEqual(mark.filing_id, 0)
+        self.assertEqual(mark.pk, None)
+        models.HighWaterMark.objects.create(
+            source_table='RCPT_CD',
+            filing_id=10,
+            amend_id=2
+        )
+        mark = models.HighWaterMark.objects.get_mark('RCPT_CD')
+        self.assertEqual(mark.filing_id, 10)
+        mark.__unicode__()
+
+
+class ShadowTablesTest(TestCase):
+    """
+    Point models at their shadow tables and back again.
+    """
+    def test_activate(self):
+        live_table = models.Filing._meta.db_table
+        shadow = ShadowTables([models.Filing])
+        shadow.activate()
+        try:
+            self.assertEqual(
+                models.Filing._meta.db_table,
+                live_table + "_shadow"
+            )
+        finally:
+            shadow.deactivate()
+        self.assertEqual(models.Filing._meta.db_table, live_table)
+        self.assertEqual(
+            shadow.get_old_table(models.Filing),
+            live_table + "_old"
+        )
+
+
+class DeferredIndexesTest(TestCase):
+    """
+    Pick out the indexes that can be rebuilt after a load.
+    """
+    def test_field_list(self):
+        indexes = DeferredIndexes(models.Contribution)
+        self.assertEqual(
+            sorted(f.name for f in indexes.field_list),
+            [
+                'amend_id',
+                'backreference_transaction_id',
+                'filing_id_raw',
+                'is_real',
+                'transaction_id',
+            ]
+        )
+
+
+class PlanCursor(object):
+    """
+    A cursor that notes each statement and returns the same plan
+    for every EXPLAIN.
+    """
+    description = [('id',), ('table',), ('type',), ('key',), ('rows',),
+                   ('Extra',)]
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.sql_list = []
+
+    def execute(self, sql, params=None):
+        self.sql_list.append(sql)
+
+    def fetchall(self):
+        return self.plan
+
+    def fetchone(self):
+        return self.plan[0]
+
+
+class ChunkCursor(PlanCursor):
+    """
+    A cursor that notes the range of each chunk and reports two rows
+    for each one.
+    """
+    rowcount = 2
+
+    def __init__(self):
+        super(ChunkCursor, self).__init__([])
+        self.params_list = []
+
+    def execute(self, sql, params=None):
+        super(ChunkCursor, self).execute(sql, params)
+        self.params_list.append((params['chunk_start'], params['chunk_end']))
+
+
+class ChunkCommand(CalAccessCommand):
+    """
+    Runs its chunks on a fake cursor and keeps its messages.
+    """
+    def __init__(self):
+        super(ChunkCommand, self).__init__()
+        self.cursor = ChunkCursor()
+        self.messages = MessageList()
+        self.log = self.warn = self.messages.log
+
+    def get_cursor(self):
+        return self.cursor
+
+
+class MessageList(list):
+    """
+    Collects the messages a command would print.
+    """
+    def log(self, string):
+        self.append(string)
+    header = success = failure = warn = log
+
+
+class ExplainCursorTest(TestCase):
+    """
+    Explain statements instead of running them and flag bad plans.
+    """
+    def test_explain(self):
+        cursor = PlanCursor([
+            (1, 'f', 'range', 'filing_id_raw', 50, ''),
+            (1, 'r', 'ALL', None, 2000000, 'Using join buffer'),
+        ])
+        explain = ExplainCursor(cursor, MessageList())
+        explain.execute("DROP TABLE IF EXISTS foo;")
+        explain.execute("LOAD DATA LOCAL INFILE 'foo.csv' INTO TABLE foo")
+        explain.execute("INSERT INTO foo SELECT * FROM bar")
+        self.assertEqual(cursor.sql_list, [
+            "EXPLAIN INSERT INTO foo SELECT * FROM bar"
+        ])
+        self.assertEqual(explain.flag_list, [
+            "Unindexed join on r (~2000000 rows)"
+        ])
+        self.assertTrue("   ~100000000 rows examined" in explain.command)
+
+    def test_create(self):
+        cursor = PlanCursor([])
+        explain = ExplainCursor(cursor, MessageList())
+        explain.execute("""CREATE TABLE foo (
+            INDEX(`id`)
+        ) AS (
+            SELECT `id` FROM bar
+        );""")
+        explain.execute("SELECT `id` FROM bar INTO OUTFILE 'bar.csv'")
+        self.assertEqual(cursor.sql_list[0], "EXPLAIN SELECT `id` FROM bar")
+        self.assertTrue(cursor.sql_list[1].startswith(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS foo"
+        ))
+        self.assertTrue(cursor.sql_list[1].endswith(
+            "SELECT * FROM (SELECT `id` FROM bar) as explain_only WHERE 1 = 0"
+        ))
+        self.assertEqual(cursor.sql_list[2], "EXPLAIN SELECT `id` FROM bar ")
+        self.assertEqual(explain.statement_count, 2)
+
+
+class ExecuteInChunksTest(TestCase):
+    """
+    Run a statement over ranges of filing ids.
+    """
+    def test_chunks(self):
+        command = ChunkCommand()
+        total = command.execute_in_chunks("INSERT", 1, 25, chunk_size=10)
+        self.assertEqual(command.cursor.params_list, [
+            (1, 11),
+            (11, 21),
+            (21, 26),
+        ])
+        self.assertEqual(total, 6)
+        self.assertEqual(len(command.messages), 3)
+
+    def test_one_chunk(self):
+        command = ChunkCommand()
+        command.execute_in_chunks("INSERT", 1, 25, chunk_size=None)
+        self.assertEqual(command.cursor.params_list, [(1, 26)])
+
+    def test_empty(self):
+        command = ChunkCommand()
+        total = command.execute_in_chunks("INSERT", None, None, 10)
+        self.assertEqual(total, 0)
+        self.assertEqual(command.cursor.params_list, [])
+
+    def test_budget(self):
+        command = ChunkCommand()
+        # Any time at all runs over a budget below zero
+        self.assertRaises(
+            CommandError,
+            command.execute_in_chunks,
+            "INSERT", 1, 25, chunk_size=10, budget=-1
+        )
+        self.assertEqual(command.cursor.params_list, [(1, 11)])
+
+
+class BackendTest(TestCase):
+    """
+    Write the database-specific parts of the loaders for each database.
+    """
+    def get_sql_list(self, cursor):
+        return [" ".join(sql.split()) for sql in cursor.sql_list]
+
+    def test_get_backend(self):
+        if connection.vendor in backends.BACKENDS:
+            self.assertEqual(backends.get_backend().vendor, connection.vendor)
+        else:
+            self.assertRaises(ImproperlyConfigured, backends.get_backend)
+
+    def test_update_join(self):
+        mysql = PlanCursor([])
+        backends.MySQLBackend().update_join(
+            mysql, "filing", "f", "dupes", "d",
+            "f.`id` = d.`id`", "is_duplicate = true"
+        )
+        postgresql = PlanCursor([])
+        backend = backends.PostgreSQLBackend()
+        backend.update_join(
+            backends.PostgreSQLCursor(postgresql, backend),
+            "filing", "f", "dupes", "d",
+            "f.`id` = d.`id`", "is_duplicate = true"
+        )
+        self.assertEqual(self.get_sql_list(mysql), [
+            "UPDATE `filing` as f INNER JOIN `dupes` as d "
+            "ON f.`id` = d.`id` SET is_duplicate = true;"
+        ])
+        self.assertEqual(self.get_sql_list(postgresql), [
+            'UPDATE "filing" as f SET is_duplicate = true '
+            'FROM "dupes" as d WHERE f."id" = d."id";'
+        ])
+
+    def test_create_table_as(self):
+        cursor = PlanCursor([])
+        backend = backends.PostgreSQLBackend()
+        backend.create_table_as(
+            backends.PostgreSQLCursor(cursor, backend),
+            "tmp_dupes",
+            "SELECT `FILING_ID`, `AMEND_ID` FROM `RCPT_CD`",
+            index_list=[("FILING_ID", "AMEND_ID")],
+            primary_key="id"
+        )
+        self.assertEqual(self.get_sql_list(cursor), [
+            'CREATE TEMPORARY TABLE "tmp_dupes" AS '
+            'SELECT "FILING_ID", "AMEND_ID" FROM "RCPT_CD";',
+            'ALTER TABLE "tmp_dupes" ADD PRIMARY KEY ("id");',
+            'CREATE INDEX ON "tmp_dupes" ("FILING_ID", "AMEND_ID");',
+        ])
+
+    def test_get_binary_sql(self):
+        self.assertEqual(
+            backends.MySQLBackend().get_binary_sql("r.`TRAN_ID`"),
+            "BINARY r.`TRAN_ID`"
+        )
+        self.assertEqual(
+            backends.PostgreSQLBackend().get_binary_sql("r.`TRAN_ID`"),
+            "r.`TRAN_ID`"
+        )
+
+    def test_get_hash_sql(self):
+        self.assertEqual(
+            backends.MySQLBackend().get_hash_sql(["TRAN_ID", "AMOUNT"]),
+            "MD5(CONCAT(COUNT(*), '-', SUM(CAST(CONV(LEFT("
+            "MD5(CONCAT_WS('|', r.`TRAN_ID`, r.`AMOUNT`)), 15), 16, 10) "
+            "AS UNSIGNED))))"
+        )
+
+    def test_get_table_size(self):
+        cursor = PlanCursor([(3 * 1024, 1024, 1024)])
+        self.assertEqual(
+            backends.MySQLBackend().get_table_size(cursor, "filing"),
+            (3 * 1024, 1024, 0.25)
+        )
+        # An empty table has no free space to speak of
+        cursor = PlanCursor([(0, None, 0)])
+        self.assertEqual(
+            backends.MySQLBackend().get_table_size(cursor, "filing"),
+            (0, 0, 0)
+        )
+
+    def test_partition_by_cycle(self):
+        cursor = PlanCursor([])
+        new_list = backends.MySQLBackend().partition_by_cycle(
+            cursor,
+            "filing",
+            [2014, 2012]
+        )
+        self.assertEqual(new_list, [2012, 2014])
+        self.assertEqual(self.get_sql_list(cursor)[-1], (
+            "ALTER TABLE `filing` "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `cycle_id`) "
+            "PARTITION BY RANGE (`cycle_id`) ("
+            "PARTITION `pold` VALUES LESS THAN (2012), "
+            "PARTITION `p2012` VALUES LESS THAN (2013), "
+            "PARTITION `p2014` VALUES LESS THAN (2015), "
+            "PARTITION `pmax` VALUES LESS THAN MAXVALUE);"
+        ))
+        self.assertRaises(
+            ImproperlyConfigured,
+            backends.PostgreSQLBackend().partition_by_cycle,
+            cursor,
+            "filing",
+            [2014]
+        )
+
+    def test_truncate_cycle(self):
+        # Without a partition of its own the cycle's rows are deleted
+        cursor = PlanCursor([])
+        backends.MySQLBackend().truncate_cycle(cursor, "filing", 2014)
+        self.assertEqual(
+            self.get_sql_list(cursor)[-1],
+            "DELETE FROM `filing` WHERE `cycle_id` = 2014;"
+        )
+
+
+class StagingTest(TestCase):
+    """
+    Create each staging table once and reuse it after that.
+    """
+    def test_create_once(self):
+        cursor = PlanCursor([])
+        staging = StagingTables(cursor, backends.MySQLBackend())
+        self.assertEqual(
+            staging.create_table_as("latest_filer_type", "SELECT 1"),
+            "staging_latest_filer_type"
+        )
+        self.assertEqual(len(cursor.sql_list), 1)
+        connection.cursor().execute(
+            "CREATE TABLE staging_latest_filer_type (filer_id integer);"
+        )
+        self.assertTrue(staging.exists("latest_filer_type"))
+        staging.create_table_as("latest_filer_type", "SELECT 1")
+        self.assertEqual(len(cursor.sql_list), 1)
+        self.assertEqual(staging.drop(), ["staging_latest_filer_type"])
+
+
+class DiffTest(TestCase):
+    """
+    Find the new, amended and superseded filings of a build.
+    """
+    def test_diff(self):
+        filer = models.Filer.objects.create(
+            name="FooPAC",
+            filer_id_raw=1,
+            xref_filer_id=1,
+            filer_type="pac",
+            effective_date=datetime.now()
+        )
+        committee = models.Committee.objects.create(
+            name="FooPAC",
+            filer=filer,
+            filer_id_raw=1,
+            xref_filer_id=1,
+            committee_type="pac",
+            effective_date=datetime.now()
+        )
+        cycle = models.Cycle.objects.create(name=2014)
+
+        def create_filing(filing_id_raw, amend_id, **kwargs):
+            return models.Filing.objects.create(
+                cycle=cycle,
+                committee=committee,
+                filing_id_raw=filing_id_raw,
+                amend_id=amend_id,
+                form_type="F460",
+                **kwargs
+            )
+        create_filing(1, 0)
+        superseded = create_filing(2, 0)
+        connection.cursor().execute("""
+            CREATE TABLE staging_previous_filing AS
+            SELECT filing_id_raw, amend_id, is_duplicate
+            FROM calaccess_campaign_browser_filing
+        """)
+        superseded.is_duplicate = True
+        superseded.save()
+        create_filing(2, 1)
+        create_filing(3, 0)
+
+        # The MySQL SQL also runs on SQLite
+        backend = backends.BACKENDS.get(
+            connection.vendor,
+            backends.MySQLBackend
+        )()
+        changes = BuildChanges(backend.cursor(), backend)
+        changes.diff(
+            models.Filing,
+            models.BuildRun.objects.create(mode='full')
+        )
+        self.assertEqual(
+            sorted(models.BuildChange.objects.values_list(
+                'change_type',
+                'filing_id_raw',
+                'amend_id'
+            )),
+            [('amended', 2, 1), ('new', 3, 0), ('superseded', 2, 0)]
+        )
+
+
+class RecordingStage(Stage):
+    """
+    A stage that notes when it ran instead of calling a command.
+    """
+    def __init__(self, name, history, fail=False, **kwargs):
+        super(RecordingStage, self).__init__(name, None, **kwargs)
+        self.history = history
+        self.fail = fail
+
+    def run(self):
+        if self.fail:
+            raise ValueError(self.name)
+        self.history.append(self.name)
+
+
+class PipelineTest(TestCase):
+    """
+    Run stages in dependency order and find the critical path.
+    """
+    def get_stage_list(self, history, fail=False):
+        return [
+            RecordingStage("a", history, outputs=["A"]),
+            RecordingStage("b", history, inputs=["A"], outputs=["B"]),
+            RecordingStage("c", history, inputs=["A"], fail=fail),
+            RecordingStage("d", history, inputs=["B", "Z"]),
+        ]
+
+    def test_dependencies(self):
+        stage_list = self.get_stage_list([])
+        pipeline = Pipeline(stage_list)
+        self.assertEqual(pipeline.dependencies[stage_list[0]], [])
+        self.assertEqual(
+            pipeline.dependencies[stage_list[3]],
+            [stage_list[1]]
+        )
+
+    def test_run(self):
+        for workers in (1, 3):
+            history = []
+            pipeline = Pipeline(self.get_stage_list(history), workers=workers)
+            pipeline.run()
+            self.assertEqual(sorted(history), ["a", "b", "c", "d"])
+            self.assertEqual(history[0], "a")
+            self.assertTrue(history.index("b") < history.index("d"))
+            duration, stage_list = pipeline.get_critical_path()
+            self.assertEqual(stage_list[0].name, "a")
+
+    def test_failure(self):
+        history = []
+        pipeline = Pipeline(self.get_stage_list(history, fail=True))
+        self.assertRaises(ValueError, pipeline.run)
+        self.assertEqual(history, ["a", "b"])
+
+    def test_resume(self):
+        build_run = models.BuildRun.objects.create(mode='full')
+        history = []
+        pipeline = CheckpointPipeline(
+            self.get_stage_list(history, fail=True),
+            build_run
+        )
+        self.assertRaises(ValueError, pipeline.run)
+        self.assertEqual(
+            dict(build_run.stages.values_list('name', 'status')),
+            dict(a='complete', b='complete', c='failed')
+        )
+        build_run.stages.get(name='a').row_count_dict
+        build_run.__unicode__()
+
+        history = []
+        pipeline = CheckpointPipeline(self.get_stage_list(history), build_run)
+        pipeline.run()
+        self.assertEqual(history, ["c", "d"])
+        self.assertEqual(
+            build_run.stages.filter(status='complete').count(),
+            4
+        )
+
+    def test_telemetry(self):
+        build_run = models.BuildRun.objects.create(mode='full')
+        CheckpointPipeline(self.get_stage_list([]), build_run).run()
+        stage = build_run.stages.get(name='a')
+        self.assertTrue(stage.duration >= 0)
+        self.assertEqual(stage.rows_in, 0)
+        self.assertEqual(stage.rows_out, 0)
+        self.assertTrue(stage.peak_rss > 0)
+        telemetry = build_run.get_telemetry()
+        self.assertEqual(len(telemetry['stages']), 4)
+        self.assertEqual(telemetry['stages'][0]['name'], 'a')
+
+
+class RecordingBuild(buildcalaccesscampaignbrowser.Command):
+    """
+    A build command that notes the options its stages were given and
+    then fails, instead of loading anything.
+    """
+    def build(self, build_run, **kwargs):
+        self.build_kwargs = kwargs
+        raise ValueError("build")
+
+
+class ResumeTest(TestCase):
+    """
+    Resume a build with the options it was started with.
+    """
+    def setUp(self):
+        self.build_run = models.BuildRun.objects.create(
+            mode='full',
+            from_files=True,
+            status='failed'
+        )
+
+    def resume(self, **kwargs):
+        command = RecordingBuild()
+        options = dict(
+            (o.dest, o.default) for o in command.option_list if o.dest
+        )
+        options.update(resume=True, stdout=StringIO(), **kwargs)
+        self.assertRaises(ValueError, command.execute, **options)
+        return command.build_kwargs
+
+    def test_stored_options(self):
+        kwargs = self.resume()
+        self.assertTrue(kwargs['from_files'])
+        self.assertFalse(kwargs['optimize'])
+        self.assertEqual(
+            models.BuildRun.objects.get().get_telemetry()['from_files'],
+            True
+        )
+
+    def test_conflicting_options(self):
+        for name in ('incremental', 'shadow', 'optimize'):
+            self.assertRaises(
+                CommandError,
+                call_command,
+                "buildcalaccesscampaignbrowser",
+                resume=True,
+                stdout=StringIO(),
+                **{name: True}
+            )
+        self.assertEqual(self.resume(from_files=True)['from_files'], True)
+
+
+@skipUnless(get_rss(), "Memory is read from /proc")
+class MemoryMonitorTest(TestCase):
+    """
+    Measure the memory held during each block on its own.
+    """
+    def test_peak(self):
+        with MemoryMonitor(interval=0.01) as first:
+            data = "x" * (64 * 1024 * 1024)
+            # Give the monitor time to take a sample
+            time.sleep(0.1)
+            del data
+        # The block after the most memory hungry one doesn't report its peak
+        with MemoryMonitor(interval=0.01) as second:
+            pass
+        self.assertTrue(first.peak > 64 * 1024 * 1024)
+        self.assertTrue(second.peak < first.peak - 32 * 1024 * 1024)
+
+
+@skipUnless(
+    connection.vendor in backends.BACKENDS,
+    "The loaders only run on MySQL and PostgreSQL"
+)
+class LoaderTest(TransactionTestCase):
+    """
+    Run the loaders against a handful of raw records.
+
+    They need MySQL or PostgreSQL with calaccess_raw installed, so they are
+    skipped on SQLite. Set DATABASE_URL to run them with setup.py test.
+    """
+    def setUp(self):
+        from calaccess_raw import models as raw_models
+        self.raw = raw_models
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'csv'))
+        self.cycle = models.Cycle.objects.create(name=2014)
+        self.filer = models.Filer.objects.create(
+            name="FOO PAC",
+            filer_id_raw=1,
+            xref_filer_id="C1",
+            filer_type="pac",
+            effective_date=datetime.now()
+        )
+        self.committee = models.Committee.objects.create(
+            name="FOO PAC",
+            filer=self.filer,
+            filer_id_raw=1,
+            xref_filer_id="C1",
+            committee_type="pac",
+            effective_date=datetime.now()
+        )
+        self.raw.FilingPeriodCd.objects.create(
+            period_id=1,
+            start_date=date(2014, 1, 1),
+            end_date=date(2014, 6, 30),
+            deadline=date(2014, 7, 31),
+            period_type=0,
+            per_grp_type=0,
+            period_desc="First half"
+        )
+
+    def tearDown(self):
+        StagingTables().drop()
+        shutil.rmtree(self.tmp_dir)
+
+    def call(self, name, **kwargs):
+        with self.settings(CALACCESS_DOWNLOAD_DIR=self.tmp_dir):
+            call_command(name, stdout=StringIO(), **kwargs)
+
+    def add_filing(self, filing_id, amend_id, form_id="F460",
+                   start=date(2014, 1, 1), end=date(2014, 6, 30),
+                   period_id=1):
+        self.raw.FilerFilingsCd.objects.create(
+            filer_id=1,
+            filing_id=filing_id,
+            filing_sequence=amend_id,
+            period_id=period_id,
+            form_id=form_id,
+            stmnt_type=0,
+            session_id=2013,
+            rpt_start=start,
+            rpt_end=end
+        )
+
+    def add_receipt(self, filing_id, amend_id, tran_id, amount=100):
+        self.raw.RcptCd.objects.create(
+            filing_id=filing_id,
+            amend_id=amend_id,
+            line_item=1,
+            tran_id=tran_id,
+            form_type="A",
+            ctrib_naml="DOE",
+            ctrib_namf="JANE",
+            amount=amount
+        )
+
+    def add_late_receipt(self, filing_id, amend_id, tran_id, amount=100):
+        self.raw.S497Cd.objects.create(
+            filing_id=filing_id,
+            amend_id=amend_id,
+            line_item=1,
+            tran_id=tran_id,
+            form_type="F497P1",
+            enty_naml="DOE",
+            enty_namf="JANE",
+            amount=amount
+        )
+
+    def add_expense(self, filing_id, amend_id, tran_id, amount=100):
+        self.raw.ExpnCd.objects.create(
+            filing_id=filing_id,
+            amend_id=amend_id,
+            line_item=1,
+            tran_id=tran_id,
+            form_type="E",
+            payee_naml="ACME",
+            amount=amount
+        )
+
+    def add_summary(self, filing_id, amend_id, amount, form_type="A",
+                    line_item="1"):
+        self.raw.SmryCd.objects.create(
+            filing_id=filing_id,
+            amend_id=amend_id,
+            line_item=line_item,
+            rec_type="SMRY",
+            form_type=form_type,
+            amount_a=amount
+        )
+
+    def write_tsv(self, model, row_list):
+        """
+        Writes raw records to the TSV file a raw model is downloaded as.
+        """
+        header_list = [f.db_column for f in model._meta.fields if f.db_column]
+        tsv_dir = os.path.join(self.tmp_dir, 'tsv')
+        if not os.path.exists(tsv_dir):
+            os.mkdir(tsv_dir)
+        path = os.path.join(tsv_dir, '%s.TSV' % model._meta.db_table)
+        with open(path, 'wb') as f:
+            f.write("\t".join(header_list) + "\r\n")
+            for row in row_list:
+                f.write("\t".join(
+                    str(row.get(h, '')) for h in header_list
+                ) + "\r\n")
+
+    def get_contributions(self):
+        return sorted(models.Contribution.objects.values_list(
+            'filing_id_raw',
+            'amend_id',
+            'transaction_id',
+            'is_duplicate'
+        ))
+
+    def test_mark_real(self):
+        self.add_filing(10, 0)
+        self.add_filing(10, 1)
+        # A late filing covered by the quarterly one, and one after it
+        self.add_filing(11, 0, form_id="F497", start=date(2014, 3, 1))
+        self.add_filing(12, 0, form_id="F497", start=date(2014, 7, 15))
+        self.call("loadcalaccesscampaignfilings")
+        self.assertEqual(
+            sorted(models.Filing.objects.values_list(
+                'filing_id_raw',
+                'amend_id',
+                'is_real'
+            )),
+            [(10, 0, False), (10, 1, True), (11, 0, False), (12, 0, True)]
+        )
+
+    def test_dedupe_paths(self):
+        self.add_filing(10, 0)
+        self.add_filing(10, 1)
+        self.add_receipt(10, 0, "T1")
+        self.add_receipt(10, 1, "T1")
+        # A TRAN_ID that only differs in case is a transaction of its own
+        self.add_receipt(10, 0, "t1")
+        self.add_receipt(10, 0, "T2")
+        self.call("loadcalaccesscampaignfilings")
+        expected = [
+            (10, 0, "T1", True),
+            (10, 0, "T2", False),
+            (10, 0, "t1", False),
+            (10, 1, "T1", False),
+        ]
+        for options in [{}, {"in_database": True}]:
+            models.Contribution.objects.all().delete()
+            self.call("loadcalaccesscampaigncontributions", **options)
+            self.assertEqual(self.get_contributions(), expected)
+
+    def test_late_contributions(self):
+        self.add_filing(11, 0, form_id="F497")
+        self.add_filing(11, 1, form_id="F497")
+        self.add_late_receipt(11, 0, "L1")
+        self.add_late_receipt(11, 1, "L1")
+        self.call("loadcalaccesscampaignfilings")
+        expected = [(11, 0, "L1", True), (11, 1, "L1", False)]
+        for options in [{}, {"in_database": True}]:
+            models.Contribution.objects.all().delete()
+            self.call("loadcalaccesscampaigncontributions", **options)
+            self.assertEqual(self.get_contributions(), expected)
+        late = models.Contribution.objects.get(amend_id=1)
+        self.assertEqual(late.contributor_last_name, "DOE")
+        self.assertEqual(late.intermediary_committee_id, "")
+
+        # An incremental load picks up a new amendment
+        self.add_filing(11, 2, form_id="F497")
+        self.add_late_receipt(11, 2, "L1")
+        self.call("loadcalaccesscampaignfilings", incremental=True)
+        self.call("loadcalaccesscampaigncontributions", incremental=True)
+        self.assertEqual(self.get_contributions(), [
+            (11, 0, "L1", True),
+            (11, 1, "L1", True),
+            (11, 2, "L1", False),
+        ])
+
+    def test_incremental(self):
+        self.add_filing(10, 0)
+        self.add_summary(10, 0, 100)
+        self.call("loadcalaccesscampaignfilings")
+        self.call("loadcalaccesscampaignsummaries", in_database=True)
+
+        # A new filing beyond the mark and an amendment to an older one
+        self.add_filing(10, 1)
+        self.add_summary(10, 1, 150)
+        self.add_filing(11, 0)
+        self.add_summary(11, 0, 200)
+        expected = [(10, 0, 100), (10, 1, 150), (11, 0, 200)]
+        for i in range(2):
+            self.call("loadcalaccesscampaignfilings", incremental=True)
+            self.call("loadcalaccesscampaignsummaries", incremental=True)
+            self.assertEqual(
+                sorted(models.Filing.objects.values_list(
+                    'filing_id_raw',
+                    'amend_id'
+                )),
+                [(10, 0), (10, 1), (11, 0)]
+            )
+            self.assertEqual(
+                sorted(models.Summary.objects.values_list(
+                    'filing_id_raw',
+                    'amend_id',
+                    'itemized_monetary_contributions'
+                )),
+                expected
+            )
+
+    def test_incremental_expenditures(self):
+        self.add_filing(10, 0)
+        self.add_expense(10, 0, "E1")
+        self.call("loadcalaccesscampaignfilings")
+        self.call("loadcalaccesscampaignexpenditures")
+
+        # A new filing beyond the mark and an amendment to an older one
+        self.add_filing(10, 1)
+        self.add_expense(10, 1, "E1")
+        self.add_filing(11, 0)
+        self.add_expense(11, 0, "E2")
+        for i in range(2):
+            self.call("loadcalaccesscampaignfilings", incremental=True)
+            self.call("loadcalaccesscampaignexpenditures", incremental=True)
+            self.assertEqual(
+                sorted(models.Expenditure.objects.values_list(
+                    'filing_id_raw',
+                    'amend_id',
+                    'tran_id',
+                    'is_duplicate'
+                )),
+                [
+                    (10, 0, "E1", True),
+                    (10, 1, "E1", False),
+                    (11, 0, "E2", False),
+                ]
+            )
+        self.assertEqual(
+            models.HighWaterMark.objects.get_mark('EXPN_CD').filing_id,
+            11
+        )
+        self.assertRaises(
+            CommandError,
+            self.call,
+            "loadcalaccesscampaignexpenditures",
+            incremental=True,
+            cycle=2014
+        )
+
+    def test_raw_files(self):
+        self.add_filing(11, 0, form_id="F497")
+        self.add_filing(11, 1, form_id="F497")
+        self.call("loadcalaccesscampaignfilings")
+        late = dict(FILING_ID=11, TRAN_ID="L1", FORM_TYPE="F497P1",
+                    ENTY_NAML="DOE", ENTY_NAMF="JANE", AMOUNT="100")
+        self.write_tsv(self.raw.RcptCd, [])
+        self.write_tsv(self.raw.S497Cd, [
+            dict(late, AMEND_ID=0),
+            dict(late, AMEND_ID=1),
+        ])
+        self.write_tsv(self.raw.ExpnCd, [])
+        self.write_tsv(self.raw.SmryCd, [])
+        self.call("loadcalaccesscampaignrawfiles")
+        self.assertEqual(self.get_contributions(), [
+            (11, 0, "L1", True),
+            (11, 1, "L1", False),
+        ])
+
+    def test_shadow_swap(self):
+        shadow = ShadowTables(
+            buildcalaccesscampaignbrowser.Command.shadow_model_list
+        )
+        filer_table = models.Filer._meta.db_table
+        committee_table = models.Committee._meta.db_table
+        self.addCleanup(
+            backends.get_backend().drop_tables,
+            connection.cursor(),
+            [shadow.get_old_table(m) for m in shadow.model_list]
+        )
+        # The second swap drops the tables the first one kept around
+        for i in range(2):
+            shadow.create()
+            self.assertIn(
+                ("filer_id", filer_table + "_shadow", "id"),
+                shadow.get_foreign_keys(committee_table + "_shadow")
+            )
+            shadow.swap()
+            self.assertIn(
+                ("filer_id", filer_table, "id"),
+                shadow.get_foreign_keys(committee_table)
+            )
+        self.assertEqual(shadow.count(committee_table + "_old"), 0)
+        shadow.rollback()
+        self.assertIn(
+            ("filer_id", filer_table, "id"),
+            shadow.get_foreign_keys(committee_table)
+        )
+
+    def test_deferred_indexes(self):
+        indexes = DeferredIndexes(models.Contribution)
+
+        def count_indexes():
+            constraints = indexes.get_constraints()
+            return dict(
+                (f.name, len(indexes.get_index_names(f, constraints)))
+                for f in indexes.field_list
+            )
+        before = count_indexes()
+        indexes.drop()
+        self.assertEqual(indexes.get_missing_fields(), indexes.field_list)
+        indexes.rebuild()
+        self.assertEqual(indexes.get_missing_fields(), [])
+        self.assertEqual(count_indexes(), before)
+        if connection.vendor == 'postgresql':
+            # Text fields get a LIKE index as well as the plain one
+            self.assertEqual(before['transaction_id'], 2)
+
+    def test_chunked_merge(self):
+        self.add_filing(10, 0)
+        self.add_filing(10, 1)
+        self.add_filing(11, 0, form_id="F497")
+        self.add_filing(12, 0)
+        self.add_receipt(10, 0, "T1")
+        self.add_receipt(10, 1, "T1")
+        self.add_late_receipt(11, 0, "L1")
+        self.add_receipt(12, 0, "T2")
+        self.call("loadcalaccesscampaignfilings")
+        expected = [
+            (10, 0, "T1", True),
+            (10, 1, "T1", False),
+            (11, 0, "L1", False),
+            (12, 0, "T2", False),
+        ]
+        # One filing id at a time, from the CSV and from the raw tables
+        for options in [{}, {"in_database": True}]:
+            models.Contribution.objects.all().delete()
+            self.call(
+                "loadcalaccesscampaigncontributions",
+                chunk_size=1,
+                **options
+            )
+            self.assertEqual(self.get_contributions(), expected)
+
+    def test_pivot_summaries(self):
+        self.add_filing(10, 0)
+        self.add_filing(11, 0, form_id="F450")
+        # A line item reported twice keeps the last amount, even when it
+        # is smaller
+        self.add_summary(10, 0, 120, form_type="A", line_item="1")
+        self.add_summary(10, 0, 100, form_type="A", line_item="1")
+        self.add_summary(10, 0, 50, form_type="A", line_item="2")
+        self.add_summary(10, 0, 170, form_type="A", line_item="3")
+        self.add_summary(10, 0, 80, form_type="E", line_item="4")
+        self.add_summary(10, 0, 999, form_type="B1", line_item="1")
+        self.add_summary(11, 0, 300, form_type="F450", line_item="7")
+        self.add_summary(11, 0, 40, form_type="E", line_item="6")
+        self.call("loadcalaccesscampaignfilings")
+        expected = [
+            (10, 100, 50, 170, 80, None),
+            (11, None, None, 300, 40, None),
+        ]
+        # Regrouping the raw file reduces the line items the same way
+        self.write_tsv(self.raw.SmryCd, [
+            dict(
+                FILING_ID=r.filing_id,
+                AMEND_ID=r.amend_id,
+                LINE_ITEM=r.line_item,
+                REC_TYPE=r.rec_type,
+                FORM_TYPE=r.form_type,
+                AMOUNT_A=r.amount_a
+            )
+            for r in self.raw.SmryCd.objects.order_by('id')
+        ])
+        for options in [{"in_database": True}, {"from_tsv": True}]:
+            models.Summary.objects.all().delete()
+            self.call("loadcalaccesscampaignsummaries", **options)
+            self.assertEqual(
+                sorted(models.Summary.objects.values_list(
+                    'filing_id_raw',
+                    'itemized_monetary_contributions',
+                    'unitemized_monetary_contributions',
+                    'total_monetary_contributions',
+                    'total_expenditures',
+                    'ending_cash_balance',
+                )),
+                expected
+            )
+        # Each summary is linked to its filing
+        self.assertEqual(
+            models.Summary.objects.filter(filing__isnull=False).count(),
+            2
+        )
+
+    def test_expenditures(self):
+        self.add_filing(10, 0)
+        self.add_filing(10, 1)
+        self.add_filing(12, 0)
+        self.add_expense(10, 0, "E1")
+        self.add_expense(10, 1, "E1")
+        # A TRAN_ID that only differs in case is a transaction of its own
+        self.add_expense(10, 0, "e1")
+        # Dropped from the amendment, so the original is the latest
+        self.add_expense(10, 0, "E2")
+        self.add_expense(12, 0, "E1")
+        self.call("loadcalaccesscampaignfilings")
+        # One filing id at a time, and all of them at once
+        for chunk_size in [1, None]:
+            models.Expenditure.objects.all().delete()
+            self.call(
+                "loadcalaccesscampaignexpenditures",
+                chunk_size=chunk_size
+            )
+            self.assertEqual(
+                sorted(models.Expenditure.objects.values_list(
+                    'filing_id_raw',
+                    'amend_id',
+                    'tran_id',
+                    'is_duplicate'
+                )),
+                [
+                    (10, 0, "E1", True),
+                    (10, 0, "E2", False),
+                    (10, 0, "e1", False),
+                    (10, 1, "E1", False),
+                    (12, 0, "E1", False),
+                ]
+            )
+        self.assertEqual(
+            models.Expenditure.objects.get(amend_id=1).name,
+            "ACME"
+        )
+
+    def test_mark_duplicates(self):
+        self.add_filing(10, 0)
+        self.add_filing(10, 1)
+        self.add_filing(10, 2)
+        # Filings without a period are duplicates even when they're latest
+        self.add_filing(11, 0, period_id=0)
+        self.add_filing(12, 0)
+        self.add_filing(12, 1, period_id=0)
+        self.call("loadcalaccesscampaignfilings")
+        expected = [
+            (10, 0, True),
+            (10, 1, True),
+            (10, 2, False),
+            (11, 0, True),
+            (12, 0, True),
+            (12, 1, True),
+        ]
+
+        def get_filings():
+            return sorted(models.Filing.objects.values_list(
+                'filing_id_raw',
+                'amend_id',
+                'is_duplicate'
+            ))
+        self.assertEqual(get_filings(), expected)
+
+        # An incremental load leaves the groups it doesn't touch alone
+        self.add_filing(12, 2)
+        self.add_filing(13, 0)
+        self.call("loadcalaccesscampaignfilings", incremental=True)
+        self.assertEqual(get_filings(), expected + [
+            (12, 2, False),
+            (13, 0, False),
+        ])
+
+    def test_refresh(self):
+        self.add_filing(10, 0)
+        self.add_filing(12, 0)
+        self.add_receipt(10, 0, "T1")
+        self.add_receipt(12, 0, "T2")
+        self.add_expense(10, 0, "E1")
+        self.add_expense(12, 0, "E2")
+        self.add_summary(10, 0, 100)
+        self.add_summary(12, 0, 200)
+        self.call("loadcalaccesscampaignfilings")
+        self.call("loadcalaccesscampaignsummaries", in_database=True)
+        self.call("loadcalaccesscampaigncontributions", in_database=True)
+        self.call("loadcalaccesscampaignexpenditures")
+        self.call("refreshcalaccesscampaignfilings", record_only=True)
+        self.assertFalse(
+            models.Filing.objects.filter(content_hash__isnull=True).exists()
+        )
+        unchanged = models.Contribution.objects.get(filing_id_raw=12)
+
+        # Only the filing with a changed raw record is reloaded
+        self.raw.RcptCd.objects.filter(filing_id=10).update(amount=150)
+        self.raw.SmryCd.objects.filter(filing_id=10).update(amount_a=150)
+        self.call("refreshcalaccesscampaignfilings")
+        self.assertEqual(
+            models.Contribution.objects.get(filing_id_raw=12).id,
+            unchanged.id
+        )
+        changed = models.Contribution.objects.get(filing_id_raw=10)
+        self.assertEqual(changed.amount, 150)
+        self.assertEqual(
+            sorted(models.Summary.objects.values_list(
+                'filing_id_raw',
+                'itemized_monetary_contributions'
+            )),
+            [(10, 150), (12, 200)]
+        )
+        self.assertEqual(models.Expenditure.objects.count(), 2)
+        self.assertFalse(
+            models.Filing.objects.filter(content_hash__isnull=True).exists()
+        )
+
+    def test_reload_cycle(self):
+        self.add_filing(10, 0)
+        self.add_receipt(10, 0, "T1")
+        self.add_expense(10, 0, "E1")
+        self.add_summary(10, 0, 100)
+        self.call("loadcalaccesscampaignfilings")
+        self.call("loadcalaccesscampaignsummaries", in_database=True)
+        self.call("loadcalaccesscampaigncontributions", in_database=True)
+        self.call("loadcalaccesscampaignexpenditures")
+        self.add_filing(10, 1)
+        self.add_receipt(10, 1, "T1")
+        # The republished cycle also changes the totals of a filing
+        self.raw.SmryCd.objects.update(amount_a=150)
+        self.add_summary(10, 1, 200)
+        # The cycle's filings are replaced along with what points at them
+        self.call("loadcalaccesscampaignfilings", cycle=2014)
+        self.assertEqual(models.Filing.objects.count(), 2)
+        self.assertEqual(models.Contribution.objects.count(), 0)
+        self.assertEqual(models.Expenditure.objects.count(), 0)
+        self.call("loadcalaccesscampaigncontributions", cycle=2014)
+        self.call("loadcalaccesscampaignexpenditures", cycle=2014)
+        self.assertEqual(self.get_contributions(), [
+            (10, 0, "T1", True),
+            (10, 1, "T1", False),
+        ])
+        self.assertEqual(models.Expenditure.objects.count(), 1)
+        self.call("loadcalaccesscampaignsummaries", cycle=2014)
+        self.assertEqual(
+            sorted(models.Summary.objects.values_list(
+                'filing_id_raw',
+                'amend_id',
+                'itemized_monetary_contributions'
+            )),
+            [(10, 0, 150), (10, 1, 200)]
+        )
+        self.assertFalse(
+            models.Summary.objects.filter(filing__isnull=True).exists()
+        )
+        self.assertRaises(
+            CommandError,
+            self.call,
+            "loadcalaccesscampaignsummaries",
+            cycle=2014,
+            from_tsv=True
+        )
+
+    def test_identity_columns(self):
+        self.add_filing(10, 0)
+        self.add_receipt(10, 0, "T1")
+        self.add_expense(10, 0, "E1")
+        self.call("loadcalaccesscampaignfilings")
+        self.call("loadcalaccesscampaigncontributions", in_database=True)
+        self.call("loadcalaccesscampaignexpenditures")
+        fields = (
+            'committee_name',
+            'committee_filer_id_raw',
+            'filer_name',
+            'filer_id_raw',
+            'filing_start_date',
+            'filing_end_date',
+        )
+
+        def get_identities():
+            return [
+                list(m.objects.values_list(*fields))
+                for m in [models.Contribution, models.Expenditure]
+            ]
+        expected = [
+            self.committee.clean_name,
+            1,
+            self.filer.clean_name,
+            1,
+            date(2014, 1, 1),
+            date(2014, 6, 30),
+        ]
+        self.assertEqual(get_identities(), [[tuple(expected)]] * 2)
+
+        # Reloading the cycle picks up new names and dates
+        self.committee.name = "BAR COMMITTEE"
+        self.committee.save()
+        self.filer.name = "BAR FILER"
+        self.filer.save()
+        self.raw.FilerFilingsCd.objects.update(rpt_end=date(2014, 6, 29))
+        self.call("loadcalaccesscampaignfilings", cycle=2014)
+        self.call("loadcalaccesscampaigncontributions", cycle=2014)
+        self.call("loadcalaccesscampaignexpenditures", cycle=2014)
+        expected[0] = self.committee.clean_name
+        expected[2] = self.filer.clean_name
+        expected[5] = date(2014, 6, 29)
+        self.assertEqual(get_identities(), [[tuple(expected)]] * 2)
@@ -0,0 +1,489 @@
+"""
+The database-specific parts of the loaders, so the same commands can
+refine CAL-ACCESS data in MySQL or PostgreSQL.
+
+The loaders write their SQL with backtick-quoted names and hand anything
+that can't be written the same way in both dialects to a backend.
+"""
+import warnings
+from django.db import connection, transaction
+from django.core.exceptions import ImproperlyConfigured
+
+
+def get_backend():
+    """
+    Returns the loader backend for the default database connection.
+    """
+    try:
+        return BACKENDS[connection.vendor]()
+    except KeyError:
+        raise ImproperlyConfigured(
+            "The CAL-ACCESS loaders don't support the %s database" %
+            connection.vendor
+        )
+
+
+class MySQLBackend(object):
+    """
+    Loads files with LOAD DATA INFILE and dumps them with SELECT ... INTO
+    OUTFILE, which are read and written by the database server itself.
+    """
+    vendor = 'mysql'
+    # Newlines inside fields are escaped, so a dump can be split on any line
+    splittable_dumps = True
+
+    def prepare(self, sql):
+        return sql
+
+    def cursor(self):
+        return connection.cursor()
+
+    def ignore_warnings(self):
+        """
+        Ignore MySQL warnings so the loaders can be run with DEBUG=True.
+        """
+        import MySQLdb
+        warnings.filterwarnings("ignore", category=MySQLdb.Warning)
+
+    def dump_query(self, cursor, sql, path):
+        """
+        Writes the results of a query to a CSV file.
+        """
+        cursor.execute("""
+            %s
+            INTO OUTFILE '%s'
+            FIELDS TERMINATED BY ','
+            ENCLOSED BY '"'
+            LINES TERMINATED BY '\\n'
+        """ % (sql, path))
+
+    def load_csv(self, cursor, table, path, columns, line_terminator='\\n'):
+        """
+        Loads a CSV file with a header row into a table.
+        """
+        cursor.execute("""
+            LOAD DATA LOCAL INFILE '%(path)s'
+            INTO TABLE `%(table)s`
+            FIELDS TERMINATED BY ','
+            OPTIONALLY ENCLOSED BY '"'
+            LINES TERMINATED BY '%(line_terminator)s'
+            IGNORE 1 LINES (%(columns)s)
+        """ % dict(
+            path=path,
+            table=table,
+            line_terminator=line_terminator,
+            columns=", ".join("`%s`" % c for c in columns),
+        ))
+
+    def create_table_as(self, cursor, table, sql, index_list=(),
+                        primary_key=None, temporary=True):
+        """
+        Creates a table from the results of a query.
+
+        Each item in ``index_list`` is a tuple of the columns in an index.
+        """
+        key_list = []
+        if primary_key:
+            key_list.append("PRIMARY KEY(`%s`)" % primary_key)
+        for columns in index_list:
+            key_list.append(
+                "INDEX(%s)" % ", ".join("`%s`" % c for c in columns)
+            )
+        cursor.execute("""
+            CREATE %(temporary)s TABLE `%(table)s` %(keys)s AS (
+                %(sql)s
+            );
+        """ % dict(
+            temporary="TEMPORARY" if temporary else "",
+            table=table,
+            keys="(%s)" % ", ".join(key_list) if key_list else "",
+            sql=sql,
+        ))
+
+    def create_table_like(self, cursor, table, like, temporary=False):
+        """
+        Creates an empty copy of a table along with its indexes.
+        """
+        cursor.execute("CREATE %s TABLE `%s` LIKE `%s`;" % (
+            "TEMPORARY" if temporary else "",
+            table,
+            like,
+        ))
+
+    def update_join(self, cursor, table, alias, join_table, join_alias, on,
+                    assignments):
+        """
+        Updates the rows of a table that have a match in another one.
+        """
+        cursor.execute("""
+            UPDATE `%s` as %s
+            INNER JOIN `%s` as %s
+            ON %s
+            SET %s;
+        """ % (table, alias, join_table, join_alias, on, assignments))
+
+    def truncate(self, cursor, table_list):
+        """
+        Empties tables without checking the foreign keys that point at them.
+        """
+        cursor.execute("""SET FOREIGN_KEY_CHECKS = 0;""")
+        for table in table_list:
+            cursor.execute("""TRUNCATE `%s`;""" % table)
+        cursor.execute("""SET FOREIGN_KEY_CHECKS = 1;""")
+
+    def drop_tables(self, cursor, table_list):
+        """
+        Drops the tables that exist without checking the foreign keys
+        that point at them.
+        """
+        cursor.execute("""SET FOREIGN_KEY_CHECKS = 0;""")
+        cursor.execute("""DROP TABLE IF EXISTS %s;""" % ", ".join(
+            "`%s`" % t for t in table_list
+        ))
+        cursor.execute("""SET FOREIGN_KEY_CHECKS = 1;""")
+
+    def add_foreign_key(self, cursor, table, column, target_table,
+                        target_column):
+        cursor.execute("""
+            ALTER TABLE `%s` ADD FOREIGN KEY (`%s`) REFERENCES `%s` (`%s`);
+        """ % (table, column, target_table, target_column))
+
+    def rename_tables(self, cursor, rename_list):
+        """
+        Renames a list of (old, new) table names in one atomic statement.
+        """
+        cursor.execute("RENAME TABLE %s;" % ", ".join(
+            "`%s` TO `%s`" % pair for pair in rename_list
+        ))
+
+    def get_binary_sql(self, sql):
+        """
+        Returns an expression that compares a string byte for byte, the
+        way Python does, instead of under its column's case-insensitive
+        collation.
+        """
+        return "BINARY %s" % sql
+
+    def get_hash_sql(self, column_list, alias="r"):
+        """
+        Returns an aggregate that hashes the rows in each group of a grouped
+        query, coming out the same whatever order they are read in.
+
+        Each row is hashed on its own and the hashes are summed along with
+        the count, so there is no limit to how many rows can go into one.
+        """
+        row = "MD5(CONCAT_WS('|', %s))" % ", ".join(
+            "%s.`%s`" % (alias, c) for c in column_list
+        )
+        return "MD5(CONCAT(COUNT(*), '-', SUM(%s)))" % (
+            "CAST(CONV(LEFT(%s, 15), 16, 10) AS UNSIGNED)" % row
+        )
+
+    def get_table_size(self, cursor, table):
+        """
+        Returns the bytes in a table's rows and indexes, along with the
+        share of its space that is free for reuse after deletes and updates.
+        """
+        cursor.execute("""
+            SELECT `DATA_LENGTH`, `INDEX_LENGTH`, `DATA_FREE`
+            FROM information_schema.`TABLES`
+            WHERE `TABLE_SCHEMA` = DATABASE()
+            AND `TABLE_NAME` = '%s'
+        """ % table)
+        data, index, free = cursor.fetchone()
+        total = (data or 0) + (free or 0)
+        return data or 0, index or 0, float(free or 0) / total if total else 0
+
+    def analyze(self, cursor, table):
+        """
+        Refreshes the statistics the optimizer plans queries on a table with.
+        """
+        cursor.execute("ANALYZE TABLE `%s`;" % table)
+        cursor.fetchall()
+
+    def optimize(self, cursor, table):
+        """
+        Rebuilds a table to reclaim its free space, then analyzes it.
+        """
+        cursor.execute("OPTIMIZE TABLE `%s`;" % table)
+        cursor.fetchall()
+
+    def get_partitions(self, cursor, table):
+        """
+        Returns the names of a table's partitions, in order.
+        """
+        cursor.execute("""
+            SELECT `PARTITION_NAME`
+            FROM information_schema.`PARTITIONS`
+            WHERE `TABLE_SCHEMA` = DATABASE()
+            AND `TABLE_NAME` = '%s'
+            AND `PARTITION_NAME` IS NOT NULL
+            ORDER BY `PARTITION_ORDINAL_POSITION`
+        """ % table)
+        return [row[0] for row in cursor.fetchall()]
+
+    def partition_by_cycle(self, cursor, table, cycle_list):
+        """
+        Splits a table into a partition for each election cycle, with
+        older cycles in ``pold`` and ones not seen yet in ``pmax``.
+
+        MySQL can't partition a table with foreign keys, or one that others
+        point to, so those constraints are dropped. The cycle also has to
+        join the primary key. A table that is already partitioned only has
+        cycles newer than its last partition split out of ``pmax``, so the
+        partitions of older cycles aren't rewritten.
+
+        Returns the cycles that were given partitions.
+        """
+        cycle_list = sorted(set(cycle_list))
+        existing = self.get_partitions(cursor, table)
+        if existing:
+            last = max([
+                int(name[1:]) for name in existing if name[1:].isdigit()
+            ] or [0])
+            new_list = [c for c in cycle_list if c > last]
+        else:
+            new_list = cycle_list
+        if not new_list:
+            return []
+        definitions = [
+            "PARTITION `p%s` VALUES LESS THAN (%s)" % (c, c + 1)
+            for c in new_list
+        ]
+        definitions.append("PARTITION `pmax` VALUES LESS THAN MAXVALUE")
+        if existing:
+            cursor.execute("""
+                ALTER TABLE `%s` REORGANIZE PARTITION `pmax` INTO (%s);
+            """ % (table, ", ".join(definitions)))
+            return new_list
+
+        cursor.execute("""
+            SELECT DISTINCT `TABLE_NAME`, `CONSTRAINT_NAME`
+            FROM information_schema.`KEY_COLUMN_USAGE`
+            WHERE `TABLE_SCHEMA` = DATABASE()
+            AND `REFERENCED_TABLE_NAME` IS NOT NULL
+            AND (`TABLE_NAME` = '%s' OR `REFERENCED_TABLE_NAME` = '%s')
+        """ % (table, table))
+        for table_name, constraint in cursor.fetchall():
+            cursor.execute("ALTER TABLE `%s` DROP FOREIGN KEY `%s`;" % (
+                table_name,
+                constraint
+            ))
+        definitions.insert(0, "PARTITION `pold` VALUES LESS THAN (%s)" % (
+            cycle_list[0]
+        ))
+        cursor.execute("""
+            ALTER TABLE `%s`
+            DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `cycle_id`)
+            PARTITION BY RANGE (`cycle_id`) (%s);
+        """ % (table, ", ".join(definitions)))
+        return new_list
+
+    def truncate_cycle(self, cursor, table, cycle):
+        """
+        Empties the rows of one election cycle from a table.
+
+        A cycle with a partition of its own is emptied by truncating it,
+        which is much faster than deleting its rows one at a time. A
+        partition is only truncated if it doesn't hold any other cycle,
+        such as one loaded after the table was partitioned.
+        """
+        partition = "p%s" % cycle
+        if partition in self.get_partitions(cursor, table):
+            cursor.execute("""
+                SELECT 1 FROM `%s` PARTITION (`%s`)
+                WHERE `cycle_id` <> %s
+                LIMIT 1
+            """ % (table, partition, cycle))
+            if not cursor.fetchall():
+                cursor.execute("ALTER TABLE `%s` TRUNCATE PARTITION `%s`;" % (
+                    table,
+                    partition
+                ))
+                return
+        cursor.execute("DELETE FROM `%s` WHERE `cycle_id` = %s;" % (
+            table,
+            cycle
+        ))
+
+
+class PostgreSQLBackend(MySQLBackend):
+    """
+    Streams files through COPY, which is read and written on the client.
+    """
+    vendor = 'postgresql'
+    # Newlines inside quoted fields are left as they are, so a dump can
+    # only be split by something that reads the quoting.
+    splittable_dumps = False
+
+    def prepare(self, sql):
+        """
+        Switches the backticks the loaders quote names with to double quotes.
+        """
+        return sql.replace('`', '"')
+
+    def cursor(self):
+        return PostgreSQLCursor(connection.cursor(), self)
+
+    def ignore_warnings(self):
+        pass
+
+    def dump_query(self, cursor, sql, path):
+        with open(path, 'wb') as f:
+            cursor.copy_expert(
+                self.prepare("COPY (%s) TO STDOUT WITH CSV NULL '\\N'" % sql),
+                f
+            )
+
+    def load_csv(self, cursor, table, path, columns, line_terminator=None):
+        with open(path, 'rb') as f:
+            cursor.copy_expert(
+                'COPY "%s" (%s) FROM STDIN WITH CSV HEADER NULL \'\\N\'' % (
+                    table,
+                    ", ".join('"%s"' % c for c in columns),
+                ),
+                f
+            )
+
+    def create_table_as(self, cursor, table, sql, index_list=(),
+                        primary_key=None, temporary=True):
+        cursor.execute("""
+            CREATE %s TABLE `%s` AS
+            %s;
+        """ % ("TEMPORARY" if temporary else "", table, sql))
+        if primary_key:
+            cursor.execute("ALTER TABLE `%s` ADD PRIMARY KEY (`%s`);" % (
+                table,
+                primary_key
+            ))
+        for columns in index_list:
+            cursor.execute("CREATE INDEX ON `%s` (%s);" % (
+                table,
+                ", ".join("`%s`" % c for c in columns)
+            ))
+
+    def create_table_like(self, cursor, table, like, temporary=False):
+        cursor.execute('CREATE %s TABLE "%s" (LIKE "%s" INCLUDING ALL);' % (
+            "TEMPORARY" if temporary else "",
+            table,
+            like,
+        ))
+
+    def update_join(self, cursor, table, alias, join_table, join_alias, on,
+                    assignments):
+        cursor.execute("""
+            UPDATE `%s` as %s
+            SET %s
+            FROM `%s` as %s
+            WHERE %s;
+        """ % (table, alias, assignments, join_table, join_alias, on))
+
+    def truncate(self, cursor, table_list):
+        """
+        PostgreSQL won't leave rows pointing at the ones it truncates,
+        so tables with foreign keys to these are emptied too.
+        """
+        if table_list:
+            cursor.execute('TRUNCATE %s CASCADE;' % ", ".join(
+                '"%s"' % t for t in table_list
+            ))
+
+    def drop_tables(self, cursor, table_list):
+        """
+        The foreign keys that point at the dropped tables from other
+        tables are dropped along with them.
+        """
+        cursor.execute('DROP TABLE IF EXISTS %s CASCADE;' % ", ".join(
+            '"%s"' % t for t in table_list
+        ))
+
+    def add_foreign_key(self, cursor, table, column, target_table,
+                        target_column):
+        """
+        Checked at the end of each transaction, like the foreign keys
+        Django creates.
+        """
+        cursor.execute("""
+            ALTER TABLE `%s` ADD FOREIGN KEY (`%s`) REFERENCES `%s` (`%s`)
+            DEFERRABLE INITIALLY DEFERRED;
+        """ % (table, column, target_table, target_column))
+
+    def rename_tables(self, cursor, rename_list):
+        with transaction.atomic():
+            for pair in rename_list:
+                cursor.execute('ALTER TABLE "%s" RENAME TO "%s";' % pair)
+
+    def get_binary_sql(self, sql):
+        """
+        PostgreSQL's collations already tell apart strings that only differ
+        in case.
+        """
+        return sql
+
+    def get_hash_sql(self, column_list, alias="r"):
+        row = "MD5(CONCAT_WS('|', %s))" % ", ".join(
+            "%s.`%s`" % (alias, c) for c in column_list
+        )
+        return "MD5(COUNT(*) || '-' || SUM(%s))" % (
+            "('x' || LEFT(%s, 15))::bit(60)::bigint" % row
+        )
+
+    def get_table_size(self, cursor, table):
+        """
+        Dead rows left behind by updates and deletes stand in for the
+        free space PostgreSQL doesn't report.
+        """
+        cursor.execute("""
+            SELECT
+                pg_table_size(c.oid),
+                pg_indexes_size(c.oid),
+                COALESCE(
+                    s.n_dead_tup::float /
+                    NULLIF(s.n_live_tup + s.n_dead_tup, 0),
+                    0
+                )
+            FROM pg_class as c
+            LEFT OUTER JOIN pg_stat_user_tables as s
+            ON c.oid = s.relid
+            WHERE c.oid = '"%s"'::regclass
+        """ % table)
+        return cursor.fetchone()
+
+    def analyze(self, cursor, table):
+        cursor.execute('ANALYZE "%s";' % table)
+
+    def optimize(self, cursor, table):
+        cursor.execute('VACUUM FULL ANALYZE "%s";' % table)
+
+    def partition_by_cycle(self, cursor, table, cycle_list):
+        raise ImproperlyConfigured(
+            "Tables can only be partitioned by cycle on MySQL"
+        )
+
+    def truncate_cycle(self, cursor, table, cycle):
+        cursor.execute('DELETE FROM "%s" WHERE "cycle_id" = %s;' % (
+            table,
+            cycle
+        ))
+
+
+class PostgreSQLCursor(object):
+    """
+    Wraps a cursor so the backtick-quoted SQL of the loaders runs on
+    PostgreSQL.
+    """
+    def __init__(self, cursor, backend):
+        self.cursor = cursor
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, sql, params=None):
+        return self.cursor.execute(self.backend.prepare(sql), params)
+
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'postgresql': PostgreSQLBackend,
+}
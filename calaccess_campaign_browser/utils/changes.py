@@ -0,0 +1,152 @@
+"""
+What a build changed, compared with the generation of tables it replaced.
+"""
+from calaccess_campaign_browser.models import (
+    BuildChange,
+    Filing,
+    Contribution
+)
+from .staging import StagingTables
+
+
+class BuildChanges(object):
+    """
+    Compares the filings and contributions of a build with a snapshot of
+    their keys taken before it started.
+
+    The snapshots are staging tables, so they outlast a flush or a shadow
+    swap and are picked up again by a resumed build.
+    """
+    model_list = [Filing, Contribution]
+
+    # The natural key of each model, and the part of it that stays the
+    # same from one amendment to the next
+    key_dict = {
+        Filing: (
+            ["filing_id_raw", "amend_id"],
+            ["filing_id_raw"],
+        ),
+        Contribution: (
+            ["filing_id_raw", "amend_id", "transaction_id"],
+            ["filing_id_raw", "transaction_id"],
+        ),
+    }
+
+    def __init__(self, cursor=None, backend=None):
+        self.staging = StagingTables(cursor, backend)
+        self.cursor = self.staging.cursor
+
+    def get_snapshot_name(self, model):
+        return "previous_%s" % model.__name__.lower()
+
+    def has_snapshot(self):
+        return all(
+            self.staging.exists(self.get_snapshot_name(m))
+            for m in self.model_list
+        )
+
+    def snapshot(self):
+        """
+        Copies the keys and duplicate flags of each table.
+        """
+        for model in self.model_list:
+            key_list, group_list = self.key_dict[model]
+            sql = """
+                SELECT %(keys)s, `is_duplicate`
+                FROM %(table)s
+            """ % dict(
+                keys=", ".join("`%s`" % k for k in key_list),
+                table=model._meta.db_table,
+            )
+            self.staging.create_table_as(
+                self.get_snapshot_name(model),
+                sql,
+                index_list=[tuple(key_list), tuple(group_list)]
+            )
+
+    def record(self, build_run):
+        """
+        Stores the changes of every table under a build, replacing any
+        recorded by an earlier attempt at it.
+        """
+        BuildChange.objects.filter(build_run=build_run).delete()
+        for model in self.model_list:
+            self.diff(model, build_run)
+
+    def diff(self, model, build_run):
+        """
+        Records the changes to one table with two INSERT ... SELECT
+        statements against its snapshot.
+
+        Records with a key that wasn't there before are new, or amended if
+        another amendment of them was. Records that were the latest
+        amendment before and are marked duplicates now are superseded.
+        """
+        key_list, group_list = self.key_dict[model]
+        transaction_id = "t.`transaction_id`"
+        if "transaction_id" not in key_list:
+            transaction_id = "''"
+        sql_dict = dict(
+            change_table=BuildChange._meta.db_table,
+            table=model._meta.db_table,
+            previous=self.staging.get_table(self.get_snapshot_name(model)),
+            build_run=build_run.id,
+            model_name=model.__name__,
+            transaction_id=transaction_id,
+            key_join=" AND ".join(
+                "t.`%(k)s` = p.`%(k)s`" % dict(k=k) for k in key_list
+            ),
+            group_join=" AND ".join(
+                "t.`%(k)s` = g.`%(k)s`" % dict(k=k) for k in group_list
+            ),
+        )
+        self.cursor.execute("""
+            INSERT INTO %(change_table)s (
+                build_run_id,
+                model_name,
+                change_type,
+                filing_id_raw,
+                amend_id,
+                transaction_id
+            )
+            SELECT
+                %(build_run)s,
+                '%(model_name)s',
+                CASE
+                    WHEN EXISTS (
+                        SELECT 1
+                        FROM %(previous)s as g
+                        WHERE %(group_join)s
+                    ) THEN 'amended'
+                    ELSE 'new'
+                END,
+                t.`filing_id_raw`,
+                t.`amend_id`,
+                %(transaction_id)s
+            FROM %(table)s as t
+            LEFT OUTER JOIN %(previous)s as p
+            ON %(key_join)s
+            WHERE p.`filing_id_raw` IS NULL
+        """ % sql_dict)
+        self.cursor.execute("""
+            INSERT INTO %(change_table)s (
+                build_run_id,
+                model_name,
+                change_type,
+                filing_id_raw,
+                amend_id,
+                transaction_id
+            )
+            SELECT
+                %(build_run)s,
+                '%(model_name)s',
+                'superseded',
+                t.`filing_id_raw`,
+                t.`amend_id`,
+                %(transaction_id)s
+            FROM %(table)s as t
+            INNER JOIN %(previous)s as p
+            ON %(key_join)s
+            WHERE t.`is_duplicate` = true
+            AND p.`is_duplicate` = false
+        """ % sql_dict)
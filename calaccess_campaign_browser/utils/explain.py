@@ -0,0 +1,137 @@
+"""
+Stands in for a database cursor during a dry run of a loader, explaining
+each statement instead of running it.
+"""
+import re
+from django.db import DatabaseError
+
+
+class ExplainCursor(object):
+    """
+    Wraps a cursor so a loader's statements are explained rather than run.
+
+    Inserts, updates, deletes and the queries behind tables created with a
+    SELECT are passed to EXPLAIN, and plans that scan or filesort tables of
+    more than ``big_table_rows`` are flagged. Tables the loader creates are
+    made as empty temporary tables, so statements that read them can still
+    be explained. Loads, drops and truncates are skipped. Plain SELECTs only
+    read the small lookups the loaders need, so they are run for real.
+    """
+    big_table_rows = 1000000
+    explainable = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+    create_re = re.compile(
+        r'^\s*CREATE\s+(TEMPORARY\s+)?TABLE\s+(IF\s+NOT\s+EXISTS\s+)?',
+        re.I
+    )
+    select_re = re.compile(r'\bSELECT\b', re.I)
+    outfile_re = re.compile(r'\bINTO\s+OUTFILE\b', re.I)
+
+    def __init__(self, cursor, command):
+        self.cursor = cursor
+        self.command = command
+        self.statement_count = 0
+        self.flag_list = []
+        self.rowcount = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, sql, params=None):
+        verb = sql.split(None, 1)[0].upper()
+        if verb == 'SELECT':
+            match = self.outfile_re.search(sql)
+            if match:
+                self.explain(sql[:match.start()], params)
+            else:
+                self.cursor.execute(sql, params)
+        elif verb == 'SET':
+            self.cursor.execute(sql, params)
+        elif verb in self.explainable:
+            self.explain(sql, params)
+        elif verb == 'CREATE' and self.create_re.match(sql):
+            self.create(sql, params)
+        self.rowcount = 0
+
+    def create(self, sql, params=None):
+        """
+        Explains the query behind a CREATE TABLE ... SELECT and creates
+        an empty temporary copy of the table it would make.
+        """
+        sql = self.create_re.sub('CREATE TEMPORARY TABLE IF NOT EXISTS ', sql)
+        match = self.select_re.search(sql)
+        if match:
+            head = sql[:match.start()].rstrip()
+            select = sql[match.start():].rstrip().rstrip(';').rstrip()
+            # Unwrap the parentheses in "AS (SELECT ...)"
+            if head.endswith('('):
+                head = head[:-1]
+                select = select[:-1].rstrip()
+            self.explain(select, params)
+            # An impossible WHERE lets the database skip the query itself
+            sql = "%s SELECT * FROM (%s) as explain_only WHERE 1 = 0" % (
+                head,
+                select
+            )
+        try:
+            self.cursor.execute(sql, params)
+        except DatabaseError as e:
+            self.command.warn("   Could not create a stand-in table: %s" % e)
+
+    def explain(self, sql, params=None):
+        self.statement_count += 1
+        self.command.log("  %s" % " ".join(sql.split())[:72])
+        try:
+            self.cursor.execute("EXPLAIN %s" % sql, params)
+        except DatabaseError as e:
+            self.command.warn("   Could not explain: %s" % e)
+            return
+        columns = [d[0] for d in self.cursor.description]
+        plan = [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+        estimates = {}
+        for step in plan:
+            rows = int(step.get('rows') or 0)
+            estimates[step['id']] = estimates.get(step['id'], 1) * max(rows, 1)
+            self.command.log("   %s: %s via %s, ~%s rows %s" % (
+                step['table'],
+                step['type'],
+                step['key'] or 'no index',
+                rows,
+                step.get('Extra') or '',
+            ))
+            for flag in self.get_flags(step, rows):
+                self.flag_list.append(flag)
+                self.command.warn("   ! %s" % flag)
+        self.command.log("   ~%s rows examined" % sum(estimates.values()))
+
+    def get_flags(self, step, rows):
+        """
+        Returns the problems worth stopping a build for in one step
+        of a plan.
+        """
+        if rows < self.big_table_rows:
+            return []
+        flags = []
+        extra = step.get('Extra') or ''
+        if step['type'] == 'ALL':
+            if 'join buffer' in extra:
+                flags.append("Unindexed join on %s (~%s rows)" % (
+                    step['table'],
+                    rows
+                ))
+            else:
+                flags.append("Full scan of %s (~%s rows)" % (
+                    step['table'],
+                    rows
+                ))
+        if 'filesort' in extra:
+            flags.append("Filesort of %s (~%s rows)" % (step['table'], rows))
+        return flags
+
+    def summarize(self):
+        self.command.header("Explained %s statements" % self.statement_count)
+        if self.flag_list:
+            for flag in self.flag_list:
+                self.command.failure(" %s" % flag)
+        else:
+            self.command.success(" No full scans or filesorts flagged")
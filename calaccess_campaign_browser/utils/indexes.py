@@ -0,0 +1,135 @@
+"""
+Drops secondary indexes before a bulk load and rebuilds them afterwards,
+so the database builds each one in a single pass instead of row by row.
+"""
+from django.db import connection
+from django.db.backends.utils import truncate_name
+
+
+class DeferredIndexes(object):
+    """
+    The single-column indexes a model declares with ``db_index=True``.
+
+    Foreign key indexes are left alone because MySQL won't drop an index
+    that backs a foreign key constraint. Rebuilding works from the model
+    definition, so it also restores indexes dropped by an earlier run that
+    failed before it could put them back.
+
+    On PostgreSQL Django gives text fields a second index with a pattern
+    operator class for LIKE queries, which is rebuilt along with the
+    plain one.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.field_list = [
+            f for f in model._meta.local_fields
+            if f.db_index and not f.unique and not f.primary_key and not f.rel
+        ]
+
+    def get_constraints(self):
+        c = connection.cursor()
+        return connection.introspection.get_constraints(
+            c,
+            self.model._meta.db_table
+        )
+
+    def get_index_names(self, field, constraints):
+        return [
+            name for name, info in constraints.items()
+            if info['columns'] == [field.column] and info['index'] and
+            not info['unique'] and not info['primary_key'] and
+            not info['foreign_key']
+        ]
+
+    def get_index_name(self, field, suffix=""):
+        return truncate_name(
+            "%s_%s%s" % (self.model._meta.db_table, field.column, suffix),
+            connection.ops.max_name_length()
+        )
+
+    def get_index_sql(self, field):
+        """
+        Returns the statements that create the indexes Django gives a field.
+        """
+        qn = connection.ops.quote_name
+        table = self.model._meta.db_table
+        sql_list = ["CREATE INDEX %s ON %s (%s);" % (
+            qn(self.get_index_name(field)),
+            qn(table),
+            qn(field.column)
+        )]
+        if connection.vendor == 'postgresql':
+            db_type = field.db_type(connection)
+            if db_type.startswith('varchar'):
+                pattern_ops = 'varchar_pattern_ops'
+            elif db_type.startswith('text'):
+                pattern_ops = 'text_pattern_ops'
+            else:
+                return sql_list
+            sql_list.append("CREATE INDEX %s ON %s (%s %s);" % (
+                qn(self.get_index_name(field, "_like")),
+                qn(table),
+                qn(field.column),
+                pattern_ops
+            ))
+        return sql_list
+
+    def get_missing_fields(self):
+        """
+        Returns the fields that have fewer indexes on their column than
+        Django gives them.
+        """
+        constraints = self.get_constraints()
+        return [
+            f for f in self.field_list
+            if len(self.get_index_names(f, constraints)) <
+            len(self.get_index_sql(f))
+        ]
+
+    def drop(self, field_list=None):
+        constraints = self.get_constraints()
+        name_list = []
+        for f in field_list or self.field_list:
+            name_list.extend(self.get_index_names(f, constraints))
+        if not name_list:
+            return []
+        c = connection.cursor()
+        if connection.vendor == 'mysql':
+            c.execute("ALTER TABLE `%s` %s;" % (
+                self.model._meta.db_table,
+                ", ".join("DROP INDEX `%s`" % name for name in name_list)
+            ))
+        else:
+            for name in name_list:
+                c.execute("DROP INDEX %s;" % connection.ops.quote_name(name))
+        return name_list
+
+    def rebuild(self):
+        """
+        Creates every index the model defines that is missing from its table.
+
+        A field left with only some of its indexes has them all dropped and
+        created again. On MySQL they all go in one ALTER TABLE statement,
+        which builds them together from a single scan of the table.
+        """
+        field_list = self.get_missing_fields()
+        if not field_list:
+            return []
+        self.drop(field_list)
+        c = connection.cursor()
+        if connection.vendor == 'mysql':
+            c.execute("ALTER TABLE `%s` %s;" % (
+                self.model._meta.db_table,
+                ", ".join(
+                    "ADD INDEX `%s` (`%s`)" % (
+                        self.get_index_name(f),
+                        f.column
+                    )
+                    for f in field_list
+                )
+            ))
+        else:
+            for f in field_list:
+                for sql in self.get_index_sql(f):
+                    c.execute(sql)
+        return field_list
@@ -1,3 +1,4 @@
+import re
 from django.db import models
 from django.template.defaultfilters import title
 from django.utils.datastructures import SortedDict
@@ -30,54 +31,67 @@ class BaseModel(models.Model):
         return jsonify(self)
 
 
+# Words that are put back in lowercase or uppercase after the name is
+# title cased, and phrases that are rewritten wherever they appear
+NAME_SUBSTITUTIONS = dict(
+    [(w, w.lower()) for w in ['Of', 'For', 'To', 'By']] +
+    [(w, w.upper()) for w in [
+        'Usaf', 'Pac', 'Ca', 'Ad', 'Rcc', 'Cdp', 'Aclu',
+        'Cbpa-Pac', 'Aka', 'Aflac',
+    ]]
+)
+NAME_PHRASES = {
+    "A. D.": "A.D.",
+    "Re-Elect": "Re-elect",
+    "Political Action Committee": "PAC",
+}
+NAME_SUBSTITUTIONS.update(NAME_PHRASES)
+NAME_REGEX = re.compile(r"(?<![^ ])(?:%s)(?![^ ])|%s" % (
+    "|".join(re.escape(w) for w in sorted(
+        set(NAME_SUBSTITUTIONS) - set(NAME_PHRASES),
+        key=len,
+        reverse=True
+    )),
+    "|".join(re.escape(p) for p in NAME_PHRASES),
+))
+
+
+def clean_all_caps_name(name):
+    """
+    A cleaned up version of the ALL CAPS names that are provided by
+    the source data.
+    """
+    if not name:
+        return ''
+    return NAME_REGEX.sub(
+        lambda m: NAME_SUBSTITUTIONS[m.group(0)],
+        title(name.strip().lower())
+    )
+
+
 class AllCapsNameMixin(BaseModel):
     """
     Abstract model with name cleaners we can reuse across models.
     """
+    clean_name = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="A cleaned up version of the ALL CAPS name, filled in by \
+the loader or when the record is saved."
+    )
+
     class Meta:
         abstract = True
 
     def __unicode__(self):
         return self.clean_name
 
+    def save(self, *args, **kwargs):
+        self.clean_name = clean_all_caps_name(self.name)
+        super(AllCapsNameMixin, self).save(*args, **kwargs)
+
     @property
     def short_name(self, character_limit=60):
         if len(self.clean_name) > character_limit:
             return self.clean_name[:character_limit] + "..."
         return self.clean_name
-
-    @property
-    def clean_name(self):
-        """
-        A cleaned up version of the ALL CAPS names that are provided by
-        the source data.
-        """
-        n = self.name
-        n = n.strip()
-        n = n.lower()
-        n = title(n)
-        n = n.replace("A. D.", "A.D.")
-        force_lowercase = ['Of', 'For', 'To', 'By']
-        for fl in force_lowercase:
-            s = []
-            for p in n.split(" "):
-                if p in force_lowercase:
-                    s.append(p.lower())
-                else:
-                    s.append(p)
-            n = " ".join(s)
-        force_uppercase = [
-            'Usaf', 'Pac', 'Ca', 'Ad', 'Rcc', 'Cdp', 'Aclu',
-            'Cbpa-Pac', 'Aka', 'Aflac',
-        ]
-        for fl in force_uppercase:
-            s = []
-            for p in n.split(" "):
-                if p in force_uppercase:
-                    s.append(p.upper())
-                else:
-                    s.append(p)
-            n = " ".join(s)
-        n = n.replace("Re-Elect", "Re-elect")
-        n = n.replace("Political Action Committee", "PAC")
-        return n
@@ -0,0 +1,329 @@
+"""
+Runs the build's management commands as a graph of stages, starting each
+one as soon as the stages that produce its inputs have finished.
+"""
+import sys
+import json
+import time
+import resource
+import threading
+from Queue import Queue
+from django.apps import apps
+from django.utils import timezone
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from .backends import get_backend
+
+
+def get_rss():
+    """
+    Returns the memory this process holds right now, in bytes, or None
+    where /proc isn't available to read it from.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+class MemoryMonitor(object):
+    """
+    Samples the memory the process holds from a thread of its own while
+    a block runs, keeping the most it held at once.
+
+    The kernel's high-water mark for the process never goes down, so it
+    can't tell one stage of a build from the stages before it.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        self.update()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.update()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.update()
+
+    def update(self):
+        rss = get_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+class Stage(object):
+    """
+    A management command in the build, along with the tables it reads
+    and the tables it writes.
+
+    ``sources`` lists the raw CAL-ACCESS tables the command reads, which
+    are counted as the stage's rows in.
+    """
+    def __init__(self, name, command, inputs=(), outputs=(), sources=(),
+                 truncate_on_restart=True, **options):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.sources = list(sources)
+        # Incremental stages only add records that aren't loaded yet,
+        # so they can be rerun without clearing out what they wrote.
+        self.truncate_on_restart = truncate_on_restart
+        self.options = options
+        self.duration = None
+        self.db_time = None
+        self.rows_in = None
+        self.rows_out = None
+        self.peak_rss = None
+
+    def __repr__(self):
+        return "<Stage: %s>" % self.name
+
+    def run(self):
+        call_command(self.command, **self.options)
+
+    def run_measured(self):
+        """
+        Runs the stage and notes the time it spent waiting on the database,
+        the rows it read and wrote and the most memory the process held
+        while it ran.
+
+        Memory is sampled for the whole process, so when stages run in
+        parallel it includes whatever else was running at the same time.
+        """
+        self.rows_in = self.count_sources()
+        rows_before = sum(self.get_row_counts().values())
+        queries = CaptureQueriesContext(connection)
+        memory = MemoryMonitor()
+        try:
+            with memory, queries:
+                self.run()
+        finally:
+            self.db_time = sum(
+                float(q['time']) for q in queries.captured_queries
+            )
+            # Don't hold on to the queries once they are added up
+            reset_queries()
+            self.peak_rss = memory.peak
+        self.rows_out = sum(self.get_row_counts().values()) - rows_before
+
+    def count_sources(self):
+        if not self.sources:
+            return 0
+        c = get_backend().cursor()
+        total = 0
+        for table in self.sources:
+            c.execute("""SELECT COUNT(*) FROM `%s`;""" % table)
+            total += c.fetchone()[0]
+        return total
+
+    def get_output_models(self):
+        """
+        Returns the models for the outputs that are tables in this app.
+        """
+        model_list = []
+        for name in self.outputs:
+            try:
+                model_list.append(
+                    apps.get_model('calaccess_campaign_browser', name)
+                )
+            except LookupError:
+                continue
+        return model_list
+
+    def get_row_counts(self):
+        return dict(
+            (m.__name__, m.objects.count()) for m in self.get_output_models()
+        )
+
+    def truncate_outputs(self):
+        """
+        Empties the tables this stage writes, so it can start over.
+        """
+        model_list = self.get_output_models()
+        if not model_list:
+            return
+        backend = get_backend()
+        backend.truncate(
+            backend.cursor(),
+            [m._meta.db_table for m in model_list]
+        )
+
+
+class Pipeline(object):
+    """
+    Runs a list of stages with up to ``workers`` of them at once.
+
+    With more than one worker each stage runs in its own thread, which gives
+    it its own database connection. A stage depends on every earlier stage
+    in the list that outputs one of its inputs.
+    """
+    def __init__(self, stage_list, workers=1, log=None, completed=()):
+        self.stage_list = stage_list
+        self.workers = max(workers, 1)
+        self.log = log or (lambda s: None)
+        self.completed = set(completed)
+        self.dependencies = dict(
+            (s, self.get_dependencies(s)) for s in self.stage_list
+        )
+
+    def get_dependencies(self, stage):
+        """
+        Returns the stages listed before this one that write its inputs.
+        """
+        dependencies = []
+        for other in self.stage_list[:self.stage_list.index(stage)]:
+            if set(other.outputs) & set(stage.inputs):
+                dependencies.append(other)
+        return dependencies
+
+    def before_stage(self, stage):
+        """
+        Called in the thread running the stage, before it runs.
+        """
+        pass
+
+    def after_stage(self, stage, error):
+        """
+        Called in the thread running the stage, after it runs, with the
+        exception info if it failed.
+        """
+        pass
+
+    def run_stage(self, stage, queue, threaded=False):
+        start = time.time()
+        try:
+            self.before_stage(stage)
+            stage.run_measured()
+            error = None
+        except Exception:
+            error = sys.exc_info()
+        stage.duration = time.time() - start
+        try:
+            self.after_stage(stage, error)
+        except Exception:
+            error = error or sys.exc_info()
+        finally:
+            if threaded:
+                connection.close()
+        queue.put((stage, error))
+
+    def run(self):
+        """
+        Runs every stage, in list order wherever the graph allows it.
+
+        If a stage fails no new stages are started, and the error is raised
+        once the stages already running have finished.
+        """
+        queue = Queue()
+        finished = set(
+            s for s in self.stage_list if s.name in self.completed
+        )
+        for stage in finished:
+            self.log(" %s already complete" % stage.name)
+        pending = [s for s in self.stage_list if s not in finished]
+        running = set()
+        error = None
+        self.start = time.time()
+        while pending or running:
+            if not error:
+                for stage in list(pending):
+                    if len(running) >= self.workers:
+                        break
+                    if set(self.dependencies[stage]) <= finished:
+                        pending.remove(stage)
+                        running.add(stage)
+                        if self.workers == 1:
+                            self.run_stage(stage, queue)
+                            continue
+                        thread = threading.Thread(
+                            target=self.run_stage,
+                            args=(stage, queue, True),
+                        )
+                        thread.daemon = True
+                        thread.start()
+            if not running:
+                break
+            stage, stage_error = queue.get()
+            running.remove(stage)
+            if stage_error:
+                self.log(" %s failed after %.1fs" % (
+                    stage.name,
+                    stage.duration
+                ))
+                error = error or stage_error
+            else:
+                self.log(" %s finished in %.1fs" % (
+                    stage.name,
+                    stage.duration
+                ))
+                finished.add(stage)
+        self.duration = time.time() - self.start
+        if error:
+            raise error[0], error[1], error[2]
+
+    def get_critical_path(self):
+        """
+        Returns the chain of dependent stages that took the longest,
+        which bounds how fast the build can go however many workers it has.
+        """
+        longest = {}
+        for stage in self.stage_list:
+            chain = max(
+                [longest[d] for d in self.dependencies[stage]] or [(0, [])],
+                key=lambda x: x[0]
+            )
+            longest[stage] = (
+                chain[0] + (stage.duration or 0),
+                chain[1] + [stage]
+            )
+        return max(longest.values(), key=lambda x: x[0])
+
+
+class CheckpointPipeline(Pipeline):
+    """
+    A pipeline that records each stage of a BuildRun as it goes, so a run
+    that fails can be resumed from the stages that didn't complete.
+    """
+    def __init__(self, stage_list, build_run, **kwargs):
+        self.build_run = build_run
+        kwargs['completed'] = build_run.stages.filter(
+            status='complete'
+        ).values_list('name', flat=True)
+        super(CheckpointPipeline, self).__init__(stage_list, **kwargs)
+
+    def before_stage(self, stage):
+        record, created = self.build_run.stages.get_or_create(
+            name=stage.name
+        )
+        if not created and stage.truncate_on_restart:
+            self.log(" Clearing partial output of %s" % stage.name)
+            stage.truncate_outputs()
+        record.status = 'running'
+        record.started = timezone.now()
+        record.finished = None
+        record.save()
+
+    def after_stage(self, stage, error):
+        record = self.build_run.stages.get(name=stage.name)
+        record.status = 'failed' if error else 'complete'
+        record.finished = timezone.now()
+        record.row_counts = json.dumps(stage.get_row_counts())
+        record.duration = stage.duration
+        record.db_time = stage.db_time
+        record.rows_in = stage.rows_in
+        record.rows_out = stage.rows_out
+        record.peak_rss = stage.peak_rss
+        record.save()
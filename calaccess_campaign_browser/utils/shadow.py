@@ -0,0 +1,179 @@
+"""
+Loads a new generation of the refined tables alongside the live ones and
+swaps it in with a single atomic rename.
+"""
+from django.db import connection
+from .backends import get_backend
+
+
+class ShadowTables(object):
+    """
+    A set of empty copies of the refined tables that a build can be
+    pointed at while the live tables keep serving the site.
+
+    While active, each model's ``db_table`` is switched to its shadow copy
+    inside this process, so the loaders, the scrapers and the ORM all write
+    to the new generation. Other processes keep reading the live tables.
+    """
+    shadow_suffix = "_shadow"
+    old_suffix = "_old"
+
+    def __init__(self, model_list):
+        self.model_list = model_list
+        self.live_tables = dict(
+            (m, m._meta.db_table) for m in self.model_list
+        )
+
+    def get_live_table(self, model):
+        return self.live_tables[model]
+
+    def get_shadow_table(self, model):
+        return self.live_tables[model] + self.shadow_suffix
+
+    def get_old_table(self, model):
+        return self.live_tables[model] + self.old_suffix
+
+    def create(self):
+        """
+        Creates an empty shadow copy of every live table.
+
+        Copying a table doesn't copy its foreign keys, so the ones between
+        the live tables are added again between their shadow copies.
+        """
+        backend = get_backend()
+        c = backend.cursor()
+        backend.drop_tables(
+            c,
+            [self.get_shadow_table(m) for m in self.model_list]
+        )
+        for m in self.model_list:
+            backend.create_table_like(
+                c,
+                self.get_shadow_table(m),
+                self.get_live_table(m),
+            )
+        shadow_tables = dict(
+            (self.get_live_table(m), self.get_shadow_table(m))
+            for m in self.model_list
+        )
+        for m in self.model_list:
+            for column, target_table, target_column in self.get_foreign_keys(
+                self.get_live_table(m)
+            ):
+                backend.add_foreign_key(
+                    c,
+                    self.get_shadow_table(m),
+                    column,
+                    shadow_tables.get(target_table, target_table),
+                    target_column
+                )
+
+    def get_foreign_keys(self, table):
+        """
+        Returns the column, target table and target column of each
+        foreign key on a table.
+        """
+        constraints = connection.introspection.get_constraints(
+            connection.cursor(),
+            table
+        )
+        return sorted(
+            (c['columns'][0],) + tuple(c['foreign_key'])
+            for c in constraints.values()
+            if c['foreign_key']
+        )
+
+    def activate(self):
+        """
+        Points the models at their shadow tables.
+        """
+        for m in self.model_list:
+            m._meta.db_table = self.get_shadow_table(m)
+
+    def deactivate(self):
+        """
+        Points the models back at their live tables.
+        """
+        for m in self.model_list:
+            m._meta.db_table = self.get_live_table(m)
+
+    def count(self, table):
+        c = get_backend().cursor()
+        c.execute("SELECT COUNT(*) FROM `%s`;" % table)
+        return c.fetchone()[0]
+
+    def get_row_counts(self):
+        """
+        Returns a list of the live and shadow row counts for each model.
+        """
+        return [
+            (
+                m,
+                self.count(self.get_live_table(m)),
+                self.count(self.get_shadow_table(m)),
+            )
+            for m in self.model_list
+        ]
+
+    def validate(self, required_models, max_shrink=0.1):
+        """
+        Returns a list of problems that should stop the swap.
+
+        Required models must have rows in their shadow table, and may not
+        shrink by more than the ``max_shrink`` share of their live rows.
+        """
+        problems = []
+        for m, live, shadow in self.get_row_counts():
+            if m not in required_models:
+                continue
+            if not shadow:
+                problems.append("%s is empty" % m.__name__)
+            elif shadow < live * (1 - max_shrink):
+                problems.append("%s shrank from %s to %s rows" % (
+                    m.__name__,
+                    live,
+                    shadow,
+                ))
+        return problems
+
+    def swap(self):
+        """
+        Replaces the live tables with the shadow tables and keeps the
+        previous generation under the old suffix for a rollback.
+
+        Everything happens in one RENAME TABLE statement, or one transaction
+        on PostgreSQL, so readers see either the whole old generation or the
+        whole new one.
+        """
+        backend = get_backend()
+        c = backend.cursor()
+        # The previous generation's foreign keys point at each other,
+        # so its tables are dropped together
+        backend.drop_tables(
+            c,
+            [self.get_old_table(m) for m in self.model_list]
+        )
+        renames = []
+        for m in self.model_list:
+            renames.append((self.get_live_table(m), self.get_old_table(m)))
+            renames.append((self.get_shadow_table(m), self.get_live_table(m)))
+        backend.rename_tables(c, renames)
+
+    def rollback(self):
+        """
+        Trades places between the live tables and the previous generation.
+
+        Running it again rolls forward to the newer generation.
+        """
+        backend = get_backend()
+        c = backend.cursor()
+        backend.drop_tables(
+            c,
+            [self.get_shadow_table(m) for m in self.model_list]
+        )
+        renames = []
+        for m in self.model_list:
+            renames.append((self.get_live_table(m), self.get_shadow_table(m)))
+            renames.append((self.get_old_table(m), self.get_live_table(m)))
+            renames.append((self.get_shadow_table(m), self.get_old_table(m)))
+        backend.rename_tables(c, renames)
@@ -0,0 +1,62 @@
+"""
+Intermediate tables that more than one loader, or more than one step of a
+loader, read from. They are kept until the end of a build so each one is
+only created once.
+"""
+from django.db import connection
+from .backends import get_backend
+
+
+class StagingTables(object):
+    """
+    The persistent, indexed intermediate tables of a build.
+
+    Each one is created the first time a loader asks for it and reused
+    after that, including by a build that is resumed after a failure. A
+    new build drops them all before it starts so none are carried over
+    from older raw data.
+    """
+    prefix = "staging_"
+
+    def __init__(self, cursor=None, backend=None):
+        self.backend = backend or get_backend()
+        self.cursor = cursor or self.backend.cursor()
+
+    def get_table(self, name):
+        return self.prefix + name
+
+    def get_table_list(self):
+        return [
+            t for t in connection.introspection.table_names()
+            if t.startswith(self.prefix)
+        ]
+
+    def exists(self, name):
+        return self.get_table(name) in self.get_table_list()
+
+    def create_table_as(self, name, sql, index_list=(), primary_key=None):
+        """
+        Creates a staging table from a query unless it is already there.
+
+        Returns the name of the table.
+        """
+        table = self.get_table(name)
+        if not self.exists(name):
+            self.backend.create_table_as(
+                self.cursor,
+                table,
+                sql,
+                index_list=index_list,
+                primary_key=primary_key,
+                temporary=False
+            )
+        return table
+
+    def drop(self):
+        """
+        Drops every staging table.
+        """
+        table_list = self.get_table_list()
+        for table in table_list:
+            self.cursor.execute("DROP TABLE `%s`;" % table)
+        return table_list
@@ -0,0 +1,138 @@
+"""
+Reads the raw CAL-ACCESS TSV downloads one row at a time, so records can be
+deduplicated and reshaped on their way into the refined tables without
+first being loaded into the raw tables.
+"""
+import os
+import csv
+import heapq
+import tempfile
+from itertools import islice
+
+
+def clean_line(line):
+    """
+    Drops the line ending and any bytes that aren't ASCII, which turn up
+    in the raw files and upset the database loaders.
+    """
+    return line.rstrip('\r\n').decode('ascii', 'ignore').encode('ascii')
+
+
+class RawFile(object):
+    """
+    A raw TSV file with its header row, iterated as lists of fields.
+
+    Rows with too few fields are padded and rows with too many are trimmed
+    to the length of the header.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(self.path, 'rb') as f:
+            self.headers = clean_line(f.readline()).split('\t')
+        self.index = dict((h, i) for i, h in enumerate(self.headers))
+
+    def __iter__(self):
+        field_count = len(self.headers)
+        with open(self.path, 'rb') as f:
+            f.readline()
+            for line in f:
+                row = clean_line(line).split('\t')
+                if len(row) < field_count:
+                    row += [''] * (field_count - len(row))
+                else:
+                    del row[field_count:]
+                yield row
+
+    def iterdicts(self):
+        for row in self:
+            yield dict(zip(self.headers, row))
+
+
+def external_sort(rows, key, run_size=250000, load=None):
+    """
+    Yields rows sorted by ``key`` while holding no more than ``run_size``
+    of them in memory.
+
+    Sorted runs are written to temporary CSV files and merged back
+    together as they are read. Rows come back from the files as lists of
+    strings, unless a ``load`` function is given to rebuild them.
+
+    The sort is stable however many runs it takes, so rows with the same
+    key come back in the order they were read.
+    """
+    path_list = []
+    rows = iter(rows)
+    try:
+        while True:
+            run = list(islice(rows, run_size))
+            if not run:
+                break
+            run.sort(key=key)
+            # Everything fit in one run, so there's nothing to merge
+            if not path_list and len(run) < run_size:
+                for row in run:
+                    yield row
+                return
+            fd, path = tempfile.mkstemp(suffix='.csv')
+            path_list.append(path)
+            with os.fdopen(fd, 'wb') as out:
+                csv.writer(out).writerows(run)
+        file_list = [open(p, 'rb') for p in path_list]
+        try:
+            decorated = [
+                decorate_run(read_run(f, load), key, i)
+                for i, f in enumerate(file_list)
+            ]
+            for k, i, n, row in heapq.merge(*decorated):
+                yield row
+        finally:
+            for f in file_list:
+                f.close()
+    finally:
+        for path in path_list:
+            os.remove(path)
+
+
+def read_run(f, load=None):
+    for row in csv.reader(f):
+        yield load(row) if load else row
+
+
+def decorate_run(rows, key, index):
+    """
+    Yields each row of a sorted run after its key, the run's index and its
+    position in the run, so ties are merged in the order they were read
+    instead of by comparing the rows.
+    """
+    for n, row in enumerate(rows):
+        yield key(row), index, n, row
+
+
+def mark_latest(rows, key):
+    """
+    Yields each row with a flag that is True for all but the first row
+    in each run of rows with the same ``key``.
+
+    Rows sorted with the latest amendment first in each group get the
+    same duplicates as the CSV transformation.
+    """
+    last_key = None
+    for row in rows:
+        k = key(row)
+        yield row, k == last_key
+        last_key = k
+
+
+def to_date(value):
+    """
+    Converts a raw date like "5/2/2012 12:00:00 AM" to an ISO date,
+    or the null marker the database loaders read if it is blank.
+    """
+    if not value:
+        return '\\N'
+    month, day, year = value.split(' ', 1)[0].split('/')
+    return "%s-%02d-%02d" % (year, int(month), int(day))
+
+
+def to_number(value, default='\\N'):
+    return value or default
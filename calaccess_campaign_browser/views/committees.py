@@ -18,7 +18,7 @@ class CommitteeDetailView(generic.DetailView):
         # Filings
         filing_qs = Filing.real.by_committee(
             self.object,
-        ).select_related("cycle", "period").order_by(
+        ).select_related("cycle", "period", "linked_summary").order_by(
             "-end_date",
             "filing_id_raw",
             "-amend_id"
@@ -100,4 +100,6 @@ class CommitteeFilingView(CommitteeDataView):
         """
         committee = Committee.objects.get(pk=self.kwargs['pk'])
         self.committee = committee
-        return Filing.real.by_committee(committee).order_by('-date_filed')
+        return Filing.real.by_committee(committee).select_related(
+            "linked_summary"
+        ).order_by('-date_filed')
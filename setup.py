@@ -1,9 +1,48 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import tempfile
+from urlparse import urlparse
 from setuptools import setup, find_packages
 from distutils.core import Command
 
 
+def get_test_database():
+    """
+    Returns the database the tests run against, which is an in-memory
+    SQLite database unless the DATABASE_URL environment variable points at
+    another one, like mysql://root@localhost/calaccess.
+
+    The loader tests are skipped on SQLite, so they need MySQL or
+    PostgreSQL to run.
+    """
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        return {
+            'NAME': ':memory:',
+            'ENGINE': 'django.db.backends.sqlite3'
+        }
+    url = urlparse(url)
+    engine = {
+        'mysql': 'django.db.backends.mysql',
+        'postgres': 'django.db.backends.postgresql_psycopg2',
+        'postgresql': 'django.db.backends.postgresql_psycopg2',
+        'sqlite': 'django.db.backends.sqlite3',
+    }[url.scheme]
+    database = {
+        'ENGINE': engine,
+        'NAME': url.path[1:],
+        'USER': url.username or '',
+        'PASSWORD': url.password or '',
+        'HOST': url.hostname or '',
+        'PORT': str(url.port or ''),
+    }
+    # The loaders bulk load CSV files from the client
+    if url.scheme == 'mysql':
+        database['OPTIONS'] = {'local_infile': 1}
+    return database
+
+
 class TestCommand(Command):
     user_options = []
 
@@ -17,13 +56,11 @@ class TestCommand(Command):
         from django.conf import settings
         settings.configure(
             DATABASES={
-                'default': {
-                    'NAME': ':memory:',
-                    'ENGINE': 'django.db.backends.sqlite3'
-                }
+                'default': get_test_database()
             },
-            INSTALLED_APPS=('calaccess_campaign_browser',),
-            MIDDLEWARE_CLASSES=()
+            INSTALLED_APPS=('calaccess_raw', 'calaccess_campaign_browser'),
+            MIDDLEWARE_CLASSES=(),
+            CALACCESS_DOWNLOAD_DIR=tempfile.gettempdir()
         )
         from django.core.management import call_command
         import django